@@ -13,11 +13,12 @@ Created on Thu Mar 26 17:07:35 2015
 """
 
 #!/usr/bin/python
-import gdal, ogr, osr, numpy
+from __future__ import print_function
+import ogr
 import csv
+import numpy
 import pandas
-#from shapely.wkb import loads
-#from shapely.ops import cascaded_union
+import LSDPlottingTools as LSDP
 
 #--------------------------------------------------------------------------
 # Enter zone number :
@@ -31,131 +32,66 @@ paramch = 'seism'
 #--------------------------------------------------------------------------
 
 DataDirectory ="/exports/csce/datastore/geos/users/mharel/Topo_Data/general/New_zone_ref/zone"+str(zonenb)+"/"
-print DataDirectory
+print(DataDirectory)
+
+def non_overlapping_groups(shapefiles):
+    """
+    Splits the shapefiles into groups whose extents don't overlap, so each group
+    can be rasterised into one label raster without basins covering each other.
+    """
+    extents = []
+    for input_zone_polygon in shapefiles:
+        shp = ogr.Open(input_zone_polygon)
+        if shp is None:
+            raise IOError('Could not open file ' + str(input_zone_polygon))
+        extents.append(shp.GetLayer().GetExtent())
+
+    groups = []
+    for i, (xmin, xmax, ymin, ymax) in enumerate(extents):
+        for group in groups:
+            if all(xmax < extents[j][0] or xmin > extents[j][1] or
+                   ymax < extents[j][2] or ymin > extents[j][3] for j in group):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+    return groups
 
-def proc():
-                
-        # Each process needs its own pointer.
-        shape = ogr.Open(input_zone_polygon)
-        lyr = shape.GetLayer()
-        raster = gdal.Open(input_value_raster)
-        xmin, xmax, ymin, ymax = lyr.GetExtent()
-        #print "Extent : ", lyr.GetExtent()
-#        # Get extent of feat
-#        geom = feat.GetGeometryRef()
-#        if (geom.GetGeometryName() == 'MULTIPOLYGON'):
-#            count = 0
-#            pointsX = []; pointsY = []
-#            for polygon in geom:
-#                geomInner = geom.GetGeometryRef(count)    
-#                ring = geomInner.GetGeometryRef(0)
-#                numpoints = ring.GetPointCount()
-#                for p in range(numpoints):
-#                        lon, lat, z = ring.GetPoint(p)
-#                        pointsX.append(lon)
-#                        pointsY.append(lat)    
-#                count += 1
-#        elif (geom.GetGeometryName() == 'POLYGON'):
-#            ring = geom.GetGeometryRef(0)
-#            numpoints = ring.GetPointCount()
-#            pointsX = []; pointsY = []
-#            for p in range(numpoints):
-#                    lon, lat, z = ring.GetPoint(p)
-#                    pointsX.append(lon)
-#                    pointsY.append(lat)
-#        else:
-#            sys.exit()
-#    
-#        xmin = min(pointsX)
-#        xmax = max(pointsX)
-#        ymin = min(pointsY)
-#        ymax = max(pointsY)
-        
-#        print geom.GetGeometryName()
-        # Specify offset and rows and columns to read
-        xoff = int((xmin - xOrigin)/pixelWidth)
-        yoff = int((yOrigin - ymax)/pixelWidth)
-        xcount = int((xmax - xmin)/pixelWidth)+1
-        ycount = int((ymax - ymin)/pixelWidth)+1
-                
-        # Create memory target raster
-        target_ds = gdal.GetDriverByName('MEM').Create('', xcount, ycount, gdal.GDT_Byte)
-        target_ds.SetGeoTransform((
-            xmin, pixelWidth, 0,
-            ymax, 0, pixelHeight,
-        ))
-        # Create for target raster the same projection as for the value raster
-        raster_srs = osr.SpatialReference()
-        raster_srs.ImportFromWkt(raster.GetProjectionRef())
-        target_ds.SetProjection(raster_srs.ExportToWkt())
-    
-        # Rasterize zone polygon to raster
-        gdal.RasterizeLayer(target_ds, [1], lyr, burn_values=[1])
-        # Read raster as arrays
-        banddataraster = raster.GetRasterBand(1)
-        # error here        
-        dataraster = banddataraster.ReadAsArray(xoff, yoff, xcount, ycount).astype(numpy.float)
-        bandmask = target_ds.GetRasterBand(1)
-        datamask = bandmask.ReadAsArray(0, 0, xcount, ycount).astype(numpy.float)
-
-        # Mask zone of raster
-        zoneraster = numpy.ma.masked_array(dataraster,  numpy.logical_not(datamask))
-
-        # Calculate statistics of zonal raster
-        value = numpy.mean(zoneraster)
 
-        print value
-        return value
-
-
-resu = []  # Empty list to store the results 
 # Extract junction numbers for this zone
 #data = pandas.read_csv('/home/mharel/LSDVisu_work/compil-data-MAH.csv')
 data = pandas.read_csv('compil-data-MAH.csv')
 datazon = data[(data.zone == newzonenb)].copy()
-#lenzon = len(datazon['Junction'])
+junctions = [int(junct) for junct in datazon['Junction']]
+
+# Raster dataset
+if paramch == 'eleva':
+    input_value_raster = DataDirectory+"zone"+str(zonenb)+".flt"
+else:
+    input_value_raster = DataDirectory+paramch+"_zone"+str(zonenb)+".flt"
+
+# Vector dataset(zones)
+shapefiles = [DataDirectory+"shape_"+str(junction)+".shp" for junction in junctions]
+
+# Rasterise the basins once (a few times if some of them overlap) and get the
+# mean of every basin in one pass through the raster. Each group of basins is
+# cropped to its extent, so a group of nested tributaries only reads their window
+basin_means = {}
+for group in non_overlapping_groups(shapefiles):
+    zones = LSDP.RasterizeZones(input_value_raster, [shapefiles[i] for i in group],
+                                zone_values = [junctions[i] for i in group], crop = True)
+    # only the means are needed, so there are no histograms (and no scan for the value range)
+    table = LSDP.ZonalStatistics(input_value_raster, zone_dataset = zones, percentiles = None)
+    basin_means.update(table["mean"].to_dict())
 
-for junct in datazon['Junction']: 
-    junction = int(junct)
-    print "Junctin is " +str(junction)
-    
-    # Raster dataset
-    if paramch == 'eleva':
-        input_value_raster = DataDirectory+"zone"+str(zonenb)+".flt"
-    else:
-        input_value_raster = DataDirectory+paramch+"_zone"+str(zonenb)+".flt"
-
-    # Vector dataset(zones)
-    input_zone_polygon = DataDirectory+"shape_"+str(junction)+".shp"
-     
-    # Open data
-    rast = gdal.Open(input_value_raster)
-    print rast.RasterXSize, rast.RasterYSize
-    shp = ogr.Open(input_zone_polygon)
-
-    if shp is None:
-        raise IOError('Could not open file ' + str(input_zone_polygon))
-
-    # Get raster georeference info
-    transform = rast.GetGeoTransform()
-    xOrigin = transform[0]
-    yOrigin = transform[3]
-    pixelWidth = transform[1]
-    pixelHeight = transform[5]
-             
-    # Start the processes
-    layer = shp.GetLayer()
-    featList = range(layer.GetFeatureCount())
-    #print "Number of features = " +str(featList)
-               
-    #pool = Pool(processes=24)   
-    #value = pool.map(proc,0,8)
-    value = proc()
+resu = []  # Empty list to store the results 
+for junction in junctions:
+    value = basin_means.get(junction, numpy.nan)
+    print("Junction is " +str(junction)+", value = " +str(value))
     resu.append([value])
-    print "value = " +str(value)
     
 with open ('/exports/csce/datastore/geos/users/mharel/Topo_Data/general/'+'zone'+str(newzonenb)+'_resufile_'+paramch+'.csv', 'w') as csvfile:
     g = csv.writer(csvfile, delimiter = ',')
     g.writerows(resu)
     
-print "Done."
+print("Done.")
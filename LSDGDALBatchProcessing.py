@@ -2,71 +2,164 @@
 """
 Created on Wed Sep 09 16:52:27 2015
 
+Batch conversion and merging of rasters, using the GDAL python bindings
+rather than calling the gdal command line tools.
+
 @author: smudd
 """
+from __future__ import absolute_import, division, print_function
 
-import numpy as np
-from glob import glob
-import LSDOSystemTools as LSDost
 import os
-import shutil
-import subprocess
-
-# This function looks for all the files of a certain format in a directory and
-# then translates them into a new format into a subdirectory named
-# after the target format. 
-def GDALBatchConvert(DataDirectory,raster_format,target_format):
- 
-    NewDataDirectory = LSDost.ReformatSeperators(DataDirectory)   
+from glob import glob
+from multiprocessing import Pool, cpu_count
+from LSDPlottingTools import LSDMap_OSystemTools as LSDost
+
+# The file extension of each raster format
+RASTER_EXTENSIONS = {"ENVI": ".bil", "EHdr": ".bil", "GTiff": ".tif", "VRT": ".vrt"}
+
+# The creation options used when writing each format
+CREATION_OPTIONS = {"ENVI": ["INTERLEAVE=BIL"],
+                    "EHdr": [],
+                    "GTiff": ["TILED=YES", "BIGTIFF=IF_SAFER"],
+                    "VRT": []}
+
+def GetRasterExtension(raster_format):
+    """
+    Returns the extension of a raster format, or None (with a message) if the
+    format isn't one of ENVI, EHdr, GTiff and VRT.
+
+    Author: SMM
+    """
+    if raster_format not in RASTER_EXTENSIONS:
+        print("You have not selcted a valid raster format!")
+        print("Options are ENVI, EHdr, GTiff and VRT")
+        return None
+    return RASTER_EXTENSIONS[raster_format]
+
+def IsUpToDate(target_file, source_files):
+    """
+    Checks if a file exists and is newer than all of the files it was made from.
+
+    Author: SMM
+    """
+    if not os.path.isfile(target_file):
+        return False
+    target_time = os.path.getmtime(target_file)
+    return all(os.path.getmtime(f) <= target_time for f in source_files)
+
+def _ConvertRaster(args):
+    """
+    Converts one raster. It is the worker of GDALBatchConvert so it takes a single
+    tuple, and returns (source, target, error message or None) rather than raising,
+    so one bad tile doesn't stop the batch.
+    """
+    from osgeo import gdal
+    gdal.UseExceptions()
+
+    FileName, target_FileName, target_format = args
+    try:
+        gdal.Translate(target_FileName, FileName, format = target_format,
+                       creationOptions = CREATION_OPTIONS[target_format])
+    except RuntimeError as e:
+        return FileName, target_FileName, str(e)
+    return FileName, target_FileName, None
+
+def GDALBatchConvert(DataDirectory, raster_format, target_format,
+                     n_processes = None, overwrite = False):
+    """
+    Looks for all the files of a certain format in a directory and translates them
+    into a new format, in a subdirectory named after the target format. The files
+    are converted in parallel by a pool of processes, and files that have already
+    been converted (and are newer than their source) are skipped.
+
+    Args:
+        DataDirectory (str): The directory of the rasters
+        raster_format (str): The format of the rasters: ENVI, EHdr or GTiff
+        target_format (str): The format to convert to: ENVI, EHdr or GTiff
+        n_processes (int): The number of processes. Default is the number of cores.
+        overwrite (bool): If True all the files are converted, even if they are up to date
+
+    Returns:
+        A list of the converted files
+
+    Author: SMM
+    """
+    NewDataDirectory = LSDost.ReformatSeperators(DataDirectory)
     DataDirectory = LSDost.AppendSepToDirectoryPath(NewDataDirectory)
 
-    # Check the target format   
-    if target_format == "ENVI":
-        target_extension = ".bil"
-    elif target_format == "EHdr":
-        target_extension = ".bil"
-    elif target_format == "GTiff":
-        target_extension = ".tiff"
+    raster_extension = GetRasterExtension(raster_format)
+    target_extension = GetRasterExtension(target_format)
+    if raster_extension is None or target_extension is None:
+        return []
+
+    # now make a directory
+    target_directory = LSDost.AppendSepToDirectoryPath(DataDirectory+target_format)
+    if not os.access(target_directory, os.F_OK):
+        print("Making path: ")
+        os.mkdir(target_directory)
+        print("I made a directory: " + target_directory)
     else:
-        print "You have not selcted a valid raster format!"
-        print "Options are ENVI, EHdr and GTiff"
-        target_extension = "NULL"   
-
-    # now make a directory   
-    if target_extension != "NULL":
-        
-        target_directory = DataDirectory+target_format
-
-        if not os.access(target_directory,os.F_OK):
-            print "Making path: "
-            os.mkdir(target_directory)
-            print "I made a directory: " + target_directory
+        print("Path: " + target_directory + " already exists.")
+
+    # find all the dataset of the source format
+    print("The data directory is: " + DataDirectory)
+    print("The raster extension is: " + raster_extension)
+    jobs = []
+    converted = []
+    for FileName in sorted(glob(DataDirectory+"*"+raster_extension)):
+        target_FileName = target_directory+os.path.splitext(os.path.basename(FileName))[0]+target_extension
+        if not overwrite and IsUpToDate(target_FileName, [FileName]):
+            converted.append(target_FileName)
         else:
-            print "Path: " +target_directory+" already exists."     
-
-    # Now check the source format   
-    if raster_format == "ENVI":
-        raster_extension = ".bil"
-    elif raster_format == "EHdr":
-        raster_extension = ".bil"
-    elif raster_format == "GTiff":
-        raster_extension = ".tif"
-    else:
-        print "You have not selcted a valid raster format!"
-        print "Options are ENVI, EHdr and GTiff"
-        raster_extension = "NULL"
-
-    # find all the dataset of the source format  
-    print "The data directory is: " + DataDirectory
-    print "The raster extension is: " + raster_extension
-    if raster_extension != "NULL":
-        for FileName in glob(DataDirectory+"*"+raster_extension):
-            print "found file: " + FileName
-            subprocess.call(['gdalinfo',FileName])
-        
-def GDALBatchMerge(DataDirectory,merge_subfolder_name,merge_filename,raster_format,target_format):
-    
-    NewDataDirectory = LSDost.ReformatSeperators(DataDirectory)   
+            jobs.append((FileName, target_FileName, target_format))
+    print("Found " + str(len(jobs)+len(converted)) + " files, " + str(len(converted)) + " are already up to date.")
+    if len(jobs) == 0:
+        return converted
+
+    if n_processes is None:
+        n_processes = cpu_count()
+    n_processes = max(1, min(n_processes, len(jobs)))
+
+    pool = Pool(n_processes)
+    try:
+        for i, (FileName, target_FileName, error) in enumerate(pool.imap_unordered(_ConvertRaster, jobs)):
+            if error is None:
+                converted.append(target_FileName)
+                print("Converted " + str(i+1) + " of " + str(len(jobs)) + ": " + FileName)
+            else:
+                print("I couldn't convert " + FileName + ": " + error)
+    finally:
+        pool.close()
+        pool.join()
+
+    return sorted(converted)
+
+def GDALBatchMerge(DataDirectory, merge_subfolder_name, merge_filename,
+                   raster_format, target_format, overwrite = False):
+    """
+    Merges all the rasters of a certain format in a directory into one raster.
+    The rasters are first gathered into a virtual mosaic (a VRT file, which only
+    points to the tiles), which is then written once in the target format.
+    If the target format is VRT only the virtual mosaic is made.
+
+    Args:
+        DataDirectory (str): The directory of the rasters
+        merge_subfolder_name (str): The subdirectory for the merged raster
+        merge_filename (str): The name of the merged raster, without extension
+        raster_format (str): The format of the rasters: ENVI, EHdr or GTiff
+        target_format (str): The format of the merged raster: ENVI, EHdr, GTiff or VRT
+        overwrite (bool): If True the raster is merged even if it is up to date
+
+    Returns:
+        The merged file, or None if there was nothing to merge (or GDAL couldn't merge it)
+
+    Author: SMM
+    """
+    # this runs in the caller's process, so GDAL's error handling isn't changed
+    # (gdal.UseExceptions would change it for the whole session): check what it returns
+    from osgeo import gdal
+
+    NewDataDirectory = LSDost.ReformatSeperators(DataDirectory)
     DataDirectory = LSDost.AppendSepToDirectoryPath(NewDataDirectory)
 
     # get the name of the data directory into which the file should be merged
@@ -74,59 +167,60 @@ def GDALBatchMerge(DataDirectory,merge_subfolder_name,merge_filename,raster_form
     mDataDriectory = LSDost.AppendSepToDirectoryPath(merge_DataDirectory)
 
     # make the directory
-    if not os.access(mDataDriectory,os.F_OK):
-        print "Making path: "
+    if not os.access(mDataDriectory, os.F_OK):
+        print("Making path: ")
         os.mkdir(mDataDriectory)
-        print "I made a directory: " + mDataDriectory
-    else:
-        print "Path: " +mDataDriectory+" already exists."             
-
-    # Check the source format   
-    if raster_format == "ENVI":
-        raster_extension = ".bil"
-    elif raster_format == "EHdr":
-        raster_extension = ".bil"
-    elif raster_format == "GTiff":
-        raster_extension = ".tif"
+        print("I made a directory: " + mDataDriectory)
     else:
-        print "You have not selcted a valid raster format!"
-        print "Options are ENVI, EHdr and GTiff"
-        raster_extension = "NULL"
-
-    # Check the target format. Default is geotiff  
-    if target_format == "ENVI":
-        target_extension = ".bil"
-    elif target_format == "EHdr":
-        target_extension = ".bil"
-    elif target_format == "GTiff":
-        target_extension = ".tif"
-    else:
-        print "You have not selcted a valid raster format!"
-        print "Defaulting to GTiff"
-        target_format == "GTiff"        
-        target_extension = ".tif"
-    
+        print("Path: " + mDataDriectory + " already exists.")
+
+    # Check the source format
+    raster_extension = GetRasterExtension(raster_format)
+    if raster_extension is None:
+        return None
+
+    # Check the target format. Default is geotiff
+    if target_format not in RASTER_EXTENSIONS:
+        print("You have not selcted a valid raster format!")
+        print("Defaulting to GTiff")
+        target_format = "GTiff"
+    target_extension = RASTER_EXTENSIONS[target_format]
+
     # set the name of the target file
     target_FileName = mDataDriectory+merge_filename+target_extension
+    vrt_FileName = mDataDriectory+merge_filename+".vrt"
+
+    # find all the dataset of the source format
+    print("The data directory is: " + DataDirectory)
+    print("The raster extension is: " + raster_extension)
+    FileList = sorted(glob(DataDirectory+"*"+raster_extension))
+    print("Found " + str(len(FileList)) + " files to merge")
+    if len(FileList) == 0:
+        return None
+
+    if not overwrite and IsUpToDate(target_FileName, FileList):
+        print("The merged raster " + target_FileName + " is up to date.")
+        return target_FileName
+
+    # the mosaic only references the tiles, so it is quick to build
+    vrt = gdal.BuildVRT(vrt_FileName, FileList)
+    if vrt is None:
+        print("I couldn't make the virtual mosaic: " + gdal.GetLastErrorMsg())
+        return None
+    if target_format == "VRT":
+        vrt = None
+        print("I made the virtual mosaic " + vrt_FileName)
+        return vrt_FileName
+
+    print("Writing the merged raster " + target_FileName)
+    merged = gdal.Translate(target_FileName, vrt, format = target_format,
+                            creationOptions = CREATION_OPTIONS[target_format],
+                            callback = gdal.TermProgress_nocb)
+    vrt = None
+    os.remove(vrt_FileName)
+    if merged is None:
+        print("I couldn't write the merged raster: " + gdal.GetLastErrorMsg())
+        return None
+    merged = None
 
-    # find all the dataset of the source format  
-    print "The data directory is: " + DataDirectory
-    print "The raster extension is: " + raster_extension
-    if raster_extension != "NULL":
-        
-        # Set up the list for holding command prompt commands        
-        command_prompt = []
-        command_prompt.append("gdal_merge.py")
-        command_prompt.append("-of")
-        command_prompt.append(target_format)
-        command_prompt.append("-o")
-        command_prompt.append(target_FileName)
-                
-        
-        for FileName in glob(DataDirectory+"*"+raster_extension):
-            print "found file: " + FileName
-            command_prompt.append(FileName)            
-            
-        print "The subprocess call is: "
-        print command_prompt         
-        subprocess.call(command_prompt)
+    return target_FileName
@@ -504,6 +504,28 @@ def ReadBasinStatsPointCSV(DataDirectory, fname_prefix):
 
     return df
 
+def ReadChiDataMapCSV(DataDirectory, fname_prefix):
+    """
+    This function reads in the file with the suffix '_chi_data_map.csv'
+    to a pandas dataframe
+
+    Args:
+        DataDirectory: the data directory
+        fname_prefix: the file name prefix
+
+    Returns:
+        pandas dataframe with the csv file
+
+    Author: SMM
+    """
+    # get the csv filename
+    csv_suffix = '_chi_data_map.csv'
+    fname = fname_prefix+csv_suffix
+    # read in the dataframe using pandas
+    df = pd.read_csv(DataDirectory+fname)
+
+    return df
+
 def ReadChainCSV(DataDirectory, fname_prefix, basin_key):
     """
     This function reads in the file with the suffix '_BasinX_chain.csv'
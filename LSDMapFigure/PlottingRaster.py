@@ -566,7 +566,7 @@ class MapFigure(object):
             label_basins (bool): If true, add text labels to basins.
             adjust_text (bool): If true calls the text adjustment routine. Takes a long time!
             rename_dict (dict): a dictionary where the key is the basin to rename (either key or junc, depending on use_keys_not_junctions) and the value is a string of the new name.
-            value_dict (dict): the key is the basin (either key or junc, depending on use_keys_not_junctions) and the value is a new value that is used as a colour for the basin.
+            value_dict (dict): the key is the basin (either key or junc, depending on use_keys_not_junctions) and the value is a new value that is used as a colour for the basin. LSDP.ZonalStatistics makes these, i.e. ZonalStatistics(value_raster, Directory+RasterName)["mean"].to_dict() for junctions.
             mask_list (list of ints): Any basin named in this list (can be either a key or junction index depending on use_keys_not_junctions) is removed from the polgons and not plotted.
             edgecolour (string): colour of the lines around the basins.
             linewidth(float): width of the line around the basins.
@@ -983,7 +983,7 @@ class MapFigure(object):
                        max_point_size = 5, min_point_size = 0.5,
                        colour_log = False, colour_manual_scale = [],
                        manual_size = 0.5, alpha = 1, minimum_log_scale_cut_off = -10, label_field = "None",
-                       font_size = 6, offset = 100):
+                       font_size = 6, offset = 100, crop_to_extent = True):
         """
         This add point data to the map.
 
@@ -1005,6 +1005,7 @@ class MapFigure(object):
             label_field (str): text annotation below the point contained in this column in the csv file
             offset (int/float): offset of the text below the point
             font_size (int): everything is in the title
+            crop_to_extent (bool): If true, only the points within the map extent are plotted. These are fetched with the spatial index of the point data.
 
         Author: SMM, BG
         """
@@ -1017,18 +1018,29 @@ class MapFigure(object):
         EPSG_string = self._RasterList[0]._EPSGString
         print("I am going to plot some points for you. The EPSG string is:"+EPSG_string)
 
-        # convert to easting and northing
-        [easting,northing] = thisPointData.GetUTMEastingNorthing(EPSG_string)
+        # convert to easting and northing. The spatial index keeps these so they
+        # are only projected once per point data object
+        spatial_index = thisPointData.GetSpatialIndex(EPSG_string)
+        easting = spatial_index.easting
+        northing = spatial_index.northing
         print("I got the easting and northing")
 
         # check if the column for plotting exists
         this_data = thisPointData.QueryData(column_for_plotting)
         print("I got the data column you wanted")
+
         # Log the color if required
         if(colour_log):
             this_data = np.log10(this_data)
             print("I logged (is it a verb?) your colour data, the minimum is %s and the maximum is %s" %(np.nanmin(this_data), np.nanmax(this_data)))
 
+        # The colour and size scales come from all the points, so cropping to
+        # the map extent doesn't change them
+        n_points = len(easting)
+        colour_limits = [None,None]
+        if len(this_data) > 0 and len(this_data) == n_points:
+            colour_limits = [np.nanmin(this_data), np.nanmax(this_data)]
+
         # Now the data for scaling. Point size will be scaled by these data
 
 
@@ -1042,7 +1054,7 @@ class MapFigure(object):
         # If there is scaled data, convert to log if that option is selected
         if scaled_data_in_log:
             print("I am going to convert data to log for point scaling.")
-            if len(scale_data) == 0 or len(scale_data) != len(easting):
+            if len(scale_data) == 0 or len(scale_data) != n_points:
                 scale_data = [0.5]
             else:
                 # We need this logic since we can get nans and -Infs from 0 and negative numbers
@@ -1051,7 +1063,22 @@ class MapFigure(object):
                 scale_data[scale_data < minimum_log_scale_cut_off] = minimum_log_scale_cut_off
         else:
             print("You are not going to use a log scale to scale the size of the points")
-
+        if len(scale_data) > 0 and len(scale_data) == n_points:
+            max_sd = np.nanmax(scale_data)
+            min_sd = np.nanmin(scale_data)
+
+        # Only keep the points within the map extent
+        if crop_to_extent:
+            in_extent = spatial_index.query_bbox(this_xlim[0],this_xlim[1],this_ylim[0],this_ylim[1])
+            print("There are "+str(len(in_extent))+" of "+str(n_points)+" points within the map extent")
+            easting = easting[in_extent]
+            northing = northing[in_extent]
+            if len(this_data) == n_points:
+                this_data = np.asarray(this_data)[in_extent]
+            if len(scale_data) == n_points:
+                scale_data = np.asarray(scale_data)[in_extent]
+        else:
+            in_extent = np.arange(n_points)
 
         # scale the points if you want
         if scale_points == True:
@@ -1060,9 +1087,6 @@ class MapFigure(object):
                 print("There doesn't seem to be any scaling data. Reverting to manual size.")
                 point_scale = manual_size
             else:
-                max_sd = np.nanmax(scale_data)
-                min_sd = np.nanmin(scale_data)
-
                 print("max is: "+str(max_sd)+ " and min is: "+ str(min_sd))
 
                 # now rescale the data. Always a linear scaling.
@@ -1099,12 +1123,14 @@ class MapFigure(object):
                     print("Your colour_log_manual_scale should be something like [min,max], aborting")
                     quit()
             else:
-                sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=this_data,cmap=this_colourmap,edgecolors='none', alpha = alpha)
+                sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=this_data,cmap=this_colourmap,edgecolors='none', alpha = alpha, vmin = colour_limits[0], vmax = colour_limits[1])
 
         # Setting the labelling
         if(label_field != "None"):
             print("labelling from this tool is not available yet, Boris is working on it")
             tg = thisPointData.QueryData(label_field)
+            if len(tg) == len(spatial_index):
+                tg = np.asarray(tg)[in_extent]
             print(tg)
             for i in range(len(easting)):
                 print str(tg[i])
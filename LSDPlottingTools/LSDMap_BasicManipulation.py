@@ -7,9 +7,11 @@
 ##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import warnings
 import numpy as np
 from . import LSDMap_OSystemTools as LSDOst
 from . import LSDMap_GDALIO as LSDMap_IO
+from . import statsutilities as LSDStats
 from pyproj import Proj, transform
 
 
@@ -362,6 +364,148 @@ def NanBelowThreshold(rasterArray,threshold):
 
 
 
+def SwathPixelDistances(x, y, values, baseline_x, baseline_y, half_width, densify_spacing = 1.0):
+    """This gets the distance along a baseline (a polyline) and the signed distance across it
+    of a set of points, i.e. the pixels of a raster. The baseline is densified and its vertices
+    put in a KD-tree, so the nearest part of the baseline to every point is found at once.
+    Each point is then projected onto the direction of the baseline at its nearest vertex.
+
+    Args:
+        x, y (arrays): The coordinates of the points
+        values (array): The values at the points (i.e. elevation). nan values are left out.
+        baseline_x, baseline_y (arrays): The vertices of the baseline
+        half_width (float): The half width of the swath. Points further from the baseline are left out.
+        densify_spacing (float): The spacing of the densified baseline vertices (i.e. half a pixel)
+
+    Returns:
+        A dict with the values, the along (distance along the baseline from its first vertex)
+        and across (distance from the baseline, positive to the left) of the points in the swath
+
+    Author: SMM
+    """
+    from scipy.spatial import cKDTree
+
+    baseline_x = np.asarray(baseline_x, dtype = float)
+    baseline_y = np.asarray(baseline_y, dtype = float)
+    segment_lengths = np.hypot(np.diff(baseline_x), np.diff(baseline_y))
+    keep = np.append(True, segment_lengths > 0)
+    baseline_x = baseline_x[keep]
+    baseline_y = baseline_y[keep]
+    segment_lengths = segment_lengths[segment_lengths > 0]
+    if segment_lengths.size == 0:
+        raise ValueError("The baseline needs at least two different vertices")
+    vertex_distance = np.append(0, np.cumsum(segment_lengths))
+    total_length = vertex_distance[-1]
+
+    # densify the baseline, keeping the segment of each new vertex for its direction
+    n_new = np.maximum(np.ceil(segment_lengths/densify_spacing).astype(np.int64), 1)
+    segment = np.repeat(np.arange(segment_lengths.size), n_new)
+    fraction = (np.arange(segment.size) - np.repeat(np.cumsum(n_new)-n_new, n_new))/np.repeat(n_new, n_new)
+    dense_distance = vertex_distance[segment] + fraction*segment_lengths[segment]
+    direction_x = np.diff(baseline_x)/segment_lengths
+    direction_y = np.diff(baseline_y)/segment_lengths
+    dense_x = baseline_x[segment] + fraction*segment_lengths[segment]*direction_x[segment]
+    dense_y = baseline_y[segment] + fraction*segment_lengths[segment]*direction_y[segment]
+
+    x = np.asarray(x, dtype = float).ravel()
+    y = np.asarray(y, dtype = float).ravel()
+    values = np.asarray(values, dtype = float).ravel()
+    valid = ~np.isnan(values)
+    x, y, values = x[valid], y[valid], values[valid]
+
+    # the nearest densified vertex of each point
+    tree = cKDTree(np.column_stack((dense_x, dense_y)))
+    nearest_distance, nearest = tree.query(np.column_stack((x, y)), distance_upper_bound = half_width + densify_spacing)
+    found = np.isfinite(nearest_distance)
+    nearest = nearest[found]
+    x, y, values = x[found], y[found], values[found]
+
+    # project onto the baseline direction at that vertex
+    dx = x - dense_x[nearest]
+    dy = y - dense_y[nearest]
+    tx = direction_x[segment[nearest]]
+    ty = direction_y[segment[nearest]]
+    along = dense_distance[nearest] + dx*tx + dy*ty
+    across = tx*dy - ty*dx
+
+    in_swath = (np.abs(across) <= half_width) & (along >= 0) & (along <= total_length)
+    return {"values": values[in_swath], "along": along[in_swath], "across": across[in_swath]}
+
+def BinSwath(swath_pixels, bin_width, direction = "along"):
+    """This gets the statistics of the values of a swath (from SwathPixelDistances) in bins of
+    distance along or across the baseline, all the bins at once.
+
+    Args:
+        swath_pixels (dict): From SwathPixelDistances
+        bin_width (float): The width of the distance bins
+        direction (str): "along" for a profile along the baseline or "across" for a transverse profile
+
+    Returns:
+        A dict with the distance (the middle of each bin) and the count, mean, std, min,
+        25th_percentile, median, 75th_percentile and max of the values in each bin that has data
+
+    Author: SMM
+    """
+    distance = swath_pixels[direction]
+    values = swath_pixels["values"]
+    bin_number = np.floor(distance/bin_width).astype(np.int64)
+    bins = LSDStats.GroupIndex(bin_number)
+
+    order = bins.order_within(values)
+    mean = bins.mean(values)
+    swath = {"distance": (bins.keys[0]+0.5)*bin_width,
+             "count": bins.sizes,
+             "mean": mean,
+             "std": np.sqrt(bins.mean((values - bins.broadcast(mean))**2)),
+             "min": bins.min(values),
+             "max": bins.max(values)}
+    for name, q in [("25th_percentile", 0.25), ("median", 0.5), ("75th_percentile", 0.75)]:
+        swath[name] = bins.quantile(values, q, order)
+    return swath
+
+def PolylineSwath(path, file1, baseline_x, baseline_y, half_width, bin_width, direction = "along"):
+    """This makes a swath profile of a raster along (or across) a baseline polyline of any orientation,
+    in Python rather than with the swath driver of LSDTopoTools. Only the window of the raster
+    around the swath is read.
+
+    Args:
+        path (str): The path to the files
+        file1 (str): The name of the raster.
+        baseline_x, baseline_y (arrays): The vertices of the baseline, in the coordinates of the raster
+        half_width (float): The half width of the swath
+        bin_width (float): The width of the distance bins
+        direction (str): "along" for a profile along the baseline or "across" for a transverse profile
+
+    Returns:
+        swath, swath_pixels: the binned statistics (see BinSwath) and the distances of the pixels
+        (see SwathPixelDistances), so you can rebin without reading the raster again
+
+    Author: SMM
+    """
+    NewPath = LSDOst.AppendSepToDirectoryPath(path)
+    raster_file1 = NewPath+file1
+    NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(raster_file1)
+
+    # the window of the raster around the baseline
+    baseline_x = np.asarray(baseline_x, dtype = float)
+    baseline_y = np.asarray(baseline_y, dtype = float)
+    col_limits = (np.array([baseline_x.min()-half_width, baseline_x.max()+half_width]) - GeoT[0])/GeoT[1]
+    row_limits = (np.array([baseline_y.min()-half_width, baseline_y.max()+half_width]) - GeoT[3])/GeoT[5]
+    x_offset = int(np.floor(col_limits.min()))
+    y_offset = int(np.floor(row_limits.min()))
+    n_cols = int(np.ceil(col_limits.max())) - x_offset + 1
+    n_rows = int(np.ceil(row_limits.max())) - y_offset + 1
+    x_offset, y_offset, block = LSDMap_IO.ReadRasterWindow(raster_file1, x_offset, y_offset, n_cols, n_rows)
+
+    # the coordinates of the pixel centres
+    x = GeoT[0] + (x_offset + np.arange(block.shape[1]) + 0.5)*GeoT[1]
+    y = GeoT[3] + (y_offset + np.arange(block.shape[0]) + 0.5)*GeoT[5]
+    X, Y = np.meshgrid(x, y)
+
+    swath_pixels = SwathPixelDistances(X, Y, block, baseline_x, baseline_y, half_width,
+                                       densify_spacing = 0.5*abs(GeoT[1]))
+    return BinSwath(swath_pixels, bin_width, direction), swath_pixels
+
 #==============================================================================
 # This does a basic mass balance.
 # Assumes all units are metres
@@ -397,13 +541,14 @@ def RasterMeanValue(path, file1):
 # if axis is 0, this is along x axis, if axis is 1, is along y axis
 # otherwise will throw error
 #==============================================================================
-def SimpleSwath(path, file1, axis):
+def SimpleSwath(path, file1, axis, n_hist_bins = 1024):
     """This function averages all the data along one of the directions
 
     Args:
         path (str): The path to the files
         file1 (str): The name of the first raster.
         axis (int): Either 0 (rows) or 1 (cols)
+        n_hist_bins (int): The number of histogram bins used for the medians and percentiles (see StreamingSwath)
 
     Returns:
         float: A load of information about the swath.
@@ -418,52 +563,487 @@ def SimpleSwath(path, file1, axis):
 
     Author: SMM
     """
+    swath = StreamingSwath(path, file1, axis, n_hist_bins = n_hist_bins)
+    return swath["mean"],swath["median"],swath["std"],swath["25th_percentile"],swath["75th_percentile"]
+
+def _HistogramPercentile(histogram, count, lo, hi, q, minimum, maximum):
+    """The q-th percentile of each row of a (n, n_bins) histogram between lo and hi,
+    using the linear interpolation rank of np.percentile and interpolating within the bin"""
+    n_bins = histogram.shape[1]
+    cumulative = np.cumsum(histogram, axis = 1)
+    rank = q/100.0*(count-1)
+    this_bin = np.argmax(cumulative > rank[:,None], axis = 1)
+    positions = np.arange(histogram.shape[0])
+    in_bin = histogram[positions, this_bin]
+    below = cumulative[positions, this_bin] - in_bin
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = (rank - below + 0.5)/in_bin
+    bin_width = (hi-lo)/n_bins
+    values = lo + (this_bin + np.clip(fraction, 0, 1))*bin_width
+    return np.clip(values, minimum, maximum)
+
+class SwathAccumulator(object):
+    """This accumulates the statistics of a swath from strips of rows of a raster, so the
+    raster never has to be in memory all at once. Nodata should be nan.
+
+    The count, mean, standard deviation (combined between strips with Chan's method),
+    minimum and maximum are exact. For swaths along the rows (axis = 1) each row is in a single
+    strip so the medians and percentiles are exact too. For swaths along the columns (axis = 0)
+    they come from a histogram of each column with n_hist_bins bins between value_range,
+    interpolated within the bins, so their error is about a bin width ((max-min)/n_hist_bins)
+    or the gap between neighbouring values, whichever is larger.
+
+    If value_range isn't given it starts as the range of the first strip, and the bins are
+    doubled in width (merging pairs of bins) whenever a strip goes outside it, so the raster
+    is still only read once. The bins are then at most about twice as wide.
+
+    Args:
+        axis (int): Either 0 (statistics of each column) or 1 (statistics of each row)
+        n_positions (int): The number of columns (axis 0) or rows (axis 1)
+        value_range (tuple): The (min, max) of the raster, for the histograms
+        n_hist_bins (int): The number of histogram bins (rounded up to an even number)
 
+    Author: SMM
+    """
+    def __init__(self, axis, n_positions, value_range = None, n_hist_bins = 1024):
+        self.axis = axis
+        self.n_positions = n_positions
+        self.count = np.zeros(n_positions)
+        self.mean = np.zeros(n_positions)
+        self.M2 = np.zeros(n_positions)
+        self.min = np.full(n_positions, np.inf)
+        self.max = np.full(n_positions, -np.inf)
+
+        self.lo = None
+        self.hi = None
+        if value_range is not None:
+            self.lo = float(value_range[0])
+            self.hi = float(value_range[1])
+            if not self.hi > self.lo:
+                self.hi = self.lo+1.0
+        self.n_hist_bins = n_hist_bins + n_hist_bins % 2
+        if axis == 0:
+            self.histogram = np.zeros((n_positions, self.n_hist_bins), dtype = np.int64)
+        else:
+            self.percentiles = np.full((3, n_positions), np.nan)
+
+    def _extend_range(self, value_min, value_max):
+        """Makes the histograms cover value_min to value_max, doubling the width of the bins
+        (and keeping the old bin edges) as many times as needed"""
+        if self.lo is None:
+            pad = 0.05*(value_max-value_min)
+            self.lo = value_min-pad
+            self.hi = value_max+pad
+            if not self.hi > self.lo:
+                self.hi = self.lo+1.0
+            return
+        half = self.n_hist_bins//2
+        while value_min < self.lo or value_max > self.hi:
+            merged = self.histogram.reshape(self.n_positions, half, 2).sum(axis = 2)
+            empty = np.zeros((self.n_positions, half), dtype = np.int64)
+            width = self.hi-self.lo
+            if value_min < self.lo:
+                self.histogram = np.concatenate((empty, merged), axis = 1)
+                self.lo = self.hi-2*width
+            else:
+                self.histogram = np.concatenate((merged, empty), axis = 1)
+                self.hi = self.lo+2*width
+
+    def add_block(self, first_row, block):
+        """Adds a strip of rows (with nodata as nan), starting at first_row"""
+        block = np.asarray(block, dtype = float)
+        valid = ~np.isnan(block)
+        if self.axis == 0:
+            positions = slice(0, self.n_positions)
+        else:
+            positions = slice(first_row, first_row + block.shape[0])
+
+        # the statistics of this strip
+        n_block = valid.sum(axis = self.axis)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_block = np.where(valid, block, 0).sum(axis = self.axis)/n_block
+        deviations = np.where(valid, block - np.expand_dims(np.nan_to_num(mean_block), self.axis), 0)
+        M2_block = (deviations**2).sum(axis = self.axis)
+
+        # combine them with the other strips
+        n = self.count[positions]
+        total = n + n_block
+        has_data = n_block > 0
+        delta = np.where(has_data, mean_block, 0) - self.mean[positions]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean[positions] += np.where(has_data, delta*n_block/total, 0)
+            self.M2[positions] += np.where(has_data, M2_block + delta**2*n*n_block/total, 0)
+        self.count[positions] = total
+        self.min[positions] = np.minimum(self.min[positions], np.where(valid, block, np.inf).min(axis = self.axis))
+        self.max[positions] = np.maximum(self.max[positions], np.where(valid, block, -np.inf).max(axis = self.axis))
+
+        if self.axis == 0:
+            # add the strip to the histogram of each column
+            rows, cols = np.nonzero(valid)
+            if cols.size == 0:
+                return
+            values = block[rows, cols]
+            self._extend_range(values.min(), values.max())
+            bins = np.floor((values-self.lo)/(self.hi-self.lo)*self.n_hist_bins).astype(np.int64)
+            bins = np.clip(bins, 0, self.n_hist_bins-1)
+            # only the bins of this strip are touched, not the whole histogram
+            np.add.at(self.histogram.reshape(-1), cols*self.n_hist_bins+bins, 1)
+        else:
+            # each row is complete, so the percentiles are exact
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                self.percentiles[:, positions] = np.nanpercentile(block, [25, 50, 75], axis = 1)
+
+    def results(self):
+        """
+        Returns:
+            A dict with the count, mean, std, min, max, median, 25th_percentile and 75th_percentile
+            at each position, nan where there is no data.
+        """
+        has_data = self.count > 0
+        swath = {"count": self.count.astype(np.int64)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            swath["mean"] = np.where(has_data, self.mean, np.nan)
+            swath["std"] = np.where(has_data, np.sqrt(self.M2/self.count), np.nan)
+        swath["min"] = np.where(has_data, self.min, np.nan)
+        swath["max"] = np.where(has_data, self.max, np.nan)
+        if self.axis == 0:
+            # with no data at all the histograms are empty, whatever their range
+            lo, hi = (self.lo, self.hi) if self.lo is not None else (0.0, 1.0)
+            percentiles = [_HistogramPercentile(self.histogram, self.count, lo, hi, q,
+                                                self.min, self.max) for q in [25, 50, 75]]
+        else:
+            percentiles = self.percentiles
+        for name, values in zip(["25th_percentile", "median", "75th_percentile"], percentiles):
+            swath[name] = np.where(has_data, values, np.nan)
+        return swath
+
+def StreamingSwath(path, file1, axis, n_hist_bins = 1024, block_rows = None):
+    """This gets the statistics of a raster along one of the directions in one pass
+    through the raster, reading it a strip of rows at a time (see SwathAccumulator).
+    Nodata is left out of all the statistics.
+
+    Args:
+        path (str): The path to the files
+        file1 (str): The name of the raster.
+        axis (int): Either 0 (statistics of each column) or 1 (statistics of each row)
+        n_hist_bins (int): The number of histogram bins used for the medians and percentiles
+        block_rows (int): The number of rows read at a time. Default is the raster block height.
+
+    Returns:
+        A dict with the count, mean, std, min, max, median, 25th_percentile and 75th_percentile
+        at each node across the axis of the swath.
+
+    Author: SMM
+    """
     # make sure names are in correct format
     NewPath = LSDOst.AppendSepToDirectoryPath(path)
-
     raster_file1 = NewPath+file1
 
     # get some information about the raster
     NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(raster_file1)
 
-    print("NDV is: ")
-    print(NDV)
+    # the range of the histograms is found as the strips are read (see SwathAccumulator)
+    if axis == 0:
+        n_positions = xsize
+    else:
+        n_positions = ysize
 
-    if NDV == None:
-        NDV = -9999
-        print("No NDV defined")
+    swath = SwathAccumulator(axis, n_positions, n_hist_bins = n_hist_bins)
+    for first_row, block in LSDMap_IO.ReadRasterRowBlocks(raster_file1, block_rows = block_rows):
+        swath.add_block(first_row, block)
+    return swath.results()
 
-    Raster1 = LSDMap_IO.ReadRasterArrayBlocks(raster_file1,raster_band=1)
 
+class ZonalAccumulator(object):
+    """This accumulates the statistics of the pixels in each zone of a label raster (i.e. the
+    basins in _AllBasins.bil) from strips of rows, so neither raster has to be in memory all at
+    once. The zones are found as they turn up (the arrays grow by doubling), and the sums of
+    the zones in each strip are made with np.bincount.
 
-    #nan_raster = Raster1[Raster1==NDV]=np.nan
-    #print nan_raster
+    The count, mean, standard deviation (combined between strips with Chan's method), minimum and
+    maximum are exact. The medians and percentiles come from a histogram of each zone with
+    n_hist_bins bins between value_range, interpolated within the bins (see SwathAccumulator).
 
-    #now mask the nodata
-    masked_Raster1  = np.ma.masked_values(Raster1, NDV)
+    Args:
+        value_range (tuple): The (min, max) of the value raster, for the histograms
+        n_hist_bins (int): The number of histogram bins
+        percentiles (list): The percentiles to report, as well as the median. If None there are
+            no histograms, medians or percentiles (and value_range isn't used)
+
+    Author: SMM
+    """
+    def __init__(self, value_range = (0,1), n_hist_bins = 1024, percentiles = (25, 75)):
+        # the rows of the arrays are the zones in the order they turned up. The arrays have
+        # spare rows (they double when full), and the labels are also kept sorted to look them up
+        self.n_zones = 0
+        self.zones = np.zeros(0, dtype = np.int64)
+        self.sorted_zones = np.zeros(0, dtype = np.int64)
+        self.sorted_rows = np.zeros(0, dtype = np.int64)
+        self.count = np.zeros(0)
+        self.mean = np.zeros(0)
+        self.M2 = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+        if percentiles is None:
+            self.percentiles = None
+            value_range = (0, 1)
+            n_hist_bins = 0
+        else:
+            self.percentiles = list(percentiles)
+
+        self.lo = float(value_range[0])
+        self.hi = float(value_range[1])
+        if not self.hi > self.lo:
+            self.hi = self.lo+1.0
+        self.n_hist_bins = n_hist_bins
+        self.histogram = np.zeros((0, n_hist_bins), dtype = np.int64)
+
+    def _zone_rows(self, block_zones):
+        """Returns the rows of the (sorted, unique) block_zones, making rows for zones that
+        haven't been seen yet"""
+        position = np.searchsorted(self.sorted_zones, block_zones)
+        seen = position < self.sorted_zones.size
+        seen[seen] = self.sorted_zones[position[seen]] == block_zones[seen]
+        new_zones = block_zones[~seen]
+        if new_zones.size > 0:
+            n_zones = self.n_zones + new_zones.size
+            if n_zones > self.zones.size:
+                capacity = max(n_zones, 2*self.zones.size, 64)
+                for name, fill in [("count", 0), ("mean", 0), ("M2", 0), ("min", np.inf),
+                                   ("max", -np.inf), ("zones", 0)]:
+                    old = getattr(self, name)
+                    grown = np.full(capacity, fill, dtype = old.dtype)
+                    grown[:self.n_zones] = old[:self.n_zones]
+                    setattr(self, name, grown)
+                histogram = np.zeros((capacity, self.n_hist_bins), dtype = np.int64)
+                histogram[:self.n_zones] = self.histogram[:self.n_zones]
+                self.histogram = histogram
+            self.zones[self.n_zones:n_zones] = new_zones
+            new_rows = np.arange(self.n_zones, n_zones)
+            self.n_zones = n_zones
+
+            sorted_zones = np.concatenate((self.sorted_zones, new_zones))
+            order = np.argsort(sorted_zones, kind = "mergesort")
+            self.sorted_zones = sorted_zones[order]
+            self.sorted_rows = np.concatenate((self.sorted_rows, new_rows))[order]
+        return self.sorted_rows[np.searchsorted(self.sorted_zones, block_zones)]
+
+    def add_block(self, labels, block):
+        """Adds a strip of labels and the matching strip of values (both with nodata as nan).
+        Only the rows of the zones in the strip are updated."""
+        labels = np.asarray(labels, dtype = float)
+        block = np.asarray(block, dtype = float)
+        valid = ~(np.isnan(labels) | np.isnan(block))
+        values = block[valid]
+        if values.size == 0:
+            return
+        block_zones, index = np.unique(labels[valid].astype(np.int64), return_inverse = True)
+        index = index.ravel()
+        rows = self._zone_rows(block_zones)
+        n_zones = block_zones.size
+
+        # the statistics of this strip
+        n_block = np.bincount(index, minlength = n_zones).astype(float)
+        mean_block = np.bincount(index, values, n_zones)/n_block
+        M2_block = np.bincount(index, (values - mean_block[index])**2, n_zones)
+        min_block = np.full(n_zones, np.inf)
+        np.minimum.at(min_block, index, values)
+        max_block = np.full(n_zones, -np.inf)
+        np.maximum.at(max_block, index, values)
+
+        # combine them with the other strips
+        n = self.count[rows]
+        total = n + n_block
+        delta = mean_block - self.mean[rows]
+        self.mean[rows] += delta*n_block/total
+        self.M2[rows] += M2_block + delta**2*n*n_block/total
+        self.count[rows] = total
+        self.min[rows] = np.minimum(self.min[rows], min_block)
+        self.max[rows] = np.maximum(self.max[rows], max_block)
+
+        if self.percentiles is None:
+            return
+        bins = np.floor((values-self.lo)/(self.hi-self.lo)*self.n_hist_bins).astype(np.int64)
+        bins = np.clip(bins, 0, self.n_hist_bins-1)
+        self.histogram[rows] += np.bincount(index*self.n_hist_bins+bins,
+                                            minlength = n_zones*self.n_hist_bins).reshape(n_zones, self.n_hist_bins)
+
+    def results(self):
+        """
+        Returns:
+            A pandas dataframe indexed by zone with the count, mean, std, min, max, median and
+            the percentiles (i.e. 25th_percentile) of each zone
+        """
+        import pandas as pd
+
+        rows = self.sorted_rows
+        count = self.count[rows]
+        minimum = self.min[rows]
+        maximum = self.max[rows]
+        histogram = self.histogram[rows]
+
+        table = pd.DataFrame(index = pd.Index(self.sorted_zones, name = "zone"))
+        table["count"] = count.astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table["mean"] = self.mean[rows]
+            table["std"] = np.sqrt(self.M2[rows]/count)
+        table["min"] = minimum
+        table["max"] = maximum
+        if self.percentiles is None:
+            return table
+        table["median"] = _HistogramPercentile(histogram, count, self.lo, self.hi, 50,
+                                               minimum, maximum)
+        for q in self.percentiles:
+            table[str(q)+"th_percentile"] = _HistogramPercentile(histogram, count, self.lo,
+                                                                 self.hi, q, minimum, maximum)
+        return table
+
+def RasterizeZones(template_raster, shapefiles, zone_field = None, zone_values = None,
+                   crop = False):
+    """This rasterises polygons into a label raster (in memory) with the same grid as
+    template_raster, all in one go, for ZonalStatistics.
 
-    means = np.mean(masked_Raster1, axis)
-    medians = np.median(masked_Raster1, axis)
-    std_deviations = np.std(masked_Raster1, axis)
-    twentyfifth_percentile = np.percentile(masked_Raster1, 25, axis)
-    seventyfifth_percentile = np.percentile(masked_Raster1, 75, axis)
+    Args:
+        template_raster (str): The raster whose grid the labels are on
+        shapefiles (list): The shapefiles of the zones
+        zone_field (str): The (integer) field with the label of each polygon
+        zone_values (list): Or, one label for each shapefile (i.e. the junction of a basin)
+        crop (bool): If True the labels only cover the pixels of template_raster within the
+            extent of the shapefiles, so ZonalStatistics only reads that window
+
+    Returns:
+        A gdal MEM dataset with the labels, and -9999 outside the zones
 
-    # This stuff only works with numpy 1.8 or later, wich we don't have
-    #means = np.nanmean(nan_raster, axis)
-    #medians = np.nanmedian(nan_raster, axis)
-    #std_deviations = np.nanstd(nan_raster, axis)
-    #twentyfifth_percentile = np.nanpercentile(nan_raster, 25, axis)
-    #seventyfifth_percentile = np.nanpercentile(nan_raster, 75, axis)
+    Author: SMM
+    """
+    from osgeo import gdal, ogr
+
+    if zone_field is None and zone_values is None:
+        raise ValueError("You need to give me a zone_field or zone_values")
+
+    dataSources = []
+    for shapefile in shapefiles:
+        dataSource = ogr.Open(shapefile)
+        if dataSource is None:
+            raise IOError('Could not open file ' + str(shapefile))
+        dataSources.append(dataSource)
+
+    template = gdal.Open(template_raster)
+    GeoT = template.GetGeoTransform()
+    x_offset, y_offset, xsize, ysize = 0, 0, template.RasterXSize, template.RasterYSize
+    if crop and len(dataSources) > 0:
+        # the pixels of the template that the extent of the shapefiles touches
+        extents = np.array([dataSource.GetLayer().GetExtent() for dataSource in dataSources])
+        cols = (np.array([extents[:,0].min(), extents[:,1].max()]) - GeoT[0])/GeoT[1]
+        rows = (np.array([extents[:,3].max(), extents[:,2].min()]) - GeoT[3])/GeoT[5]
+        x_offset = int(np.clip(np.floor(cols.min()), 0, xsize))
+        y_offset = int(np.clip(np.floor(rows.min()), 0, ysize))
+        xsize = max(int(np.clip(np.ceil(cols.max()), 0, xsize)) - x_offset, 1)
+        ysize = max(int(np.clip(np.ceil(rows.max()), 0, ysize)) - y_offset, 1)
+        x_offset = min(x_offset, template.RasterXSize - 1)
+        y_offset = min(y_offset, template.RasterYSize - 1)
+
+    zones = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Int32)
+    zones.SetGeoTransform((GeoT[0] + x_offset*GeoT[1], GeoT[1], GeoT[2],
+                           GeoT[3] + y_offset*GeoT[5], GeoT[4], GeoT[5]))
+    zones.SetProjection(template.GetProjection())
+    band = zones.GetRasterBand(1)
+    band.SetNoDataValue(-9999)
+    band.Fill(-9999)
+
+    for i, dataSource in enumerate(dataSources):
+        layer = dataSource.GetLayer()
+        if zone_values is None:
+            gdal.RasterizeLayer(zones, [1], layer, options = ["ATTRIBUTE="+zone_field])
+        else:
+            gdal.RasterizeLayer(zones, [1], layer, burn_values = [zone_values[i]])
+    return zones
+
+def ZonalStatistics(value_raster, zone_raster = None, zone_dataset = None, percentiles = (25, 75),
+                    n_hist_bins = 1024, block_rows = None, junction_to_key_dict = None,
+                    value_range = None):
+    """This gets the statistics of a raster in every zone of a label raster in one pass through
+    the rasters, reading them a strip of rows at a time (see ZonalAccumulator). Nodata in either
+    raster is left out. The medians and percentiles also need the range of the values: pass
+    value_range if you know it (i.e. when you call this for several groups of zones), otherwise
+    it is computed with another pass through value_raster.
+
+    The labels of _AllBasins.bil are the outlet junctions of the basins, so the table is
+    indexed by junction. To index it by basin key pass junction_to_key_dict (i.e. made from the
+    outlet_junction and basin_key columns of _AllBasinsInfo.csv). A column of the table is
+    then the value_dict of LSDMapFigure.add_basin_plot, i.e. table["mean"].to_dict().
 
-    #print means
-    #print medians
-    #print std_deviations
-    #print twentyfifth_percentile
-    #print seventyfifth_percentile
+    Args:
+        value_raster (str): The raster with the values (with path and extension)
+        zone_raster (str): The label raster, on the same grid
+        zone_dataset: Or, a gdal dataset of the labels (i.e. from RasterizeZones). It can
+            cover a window of value_raster on the same grid, and only that window is read
+        percentiles (list): The percentiles to report, as well as the median. If None only the
+            count, mean, std, min and max are reported, which is quicker
+        n_hist_bins (int): The number of histogram bins used for the medians and percentiles
+        block_rows (int): The number of rows read at a time
+        junction_to_key_dict (dict): Relabels the zones, i.e. from junctions to basin keys
+        value_range (tuple): The (min, max) of value_raster, for the histograms
 
+    Returns:
+        A pandas dataframe indexed by zone with the count, mean, std, min, max, median and percentiles
 
-    return means,medians,std_deviations,twentyfifth_percentile,seventyfifth_percentile
+    Author: SMM
+    """
+    NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(value_raster)
+
+    # both rasters are read in strips of the same number of rows
+    if block_rows is None:
+        block_rows = 256
+
+    window = None
+    if zone_dataset is not None:
+        zone_size = (zone_dataset.RasterXSize, zone_dataset.RasterYSize)
+        zone_blocks = _DatasetRowBlocks(zone_dataset, block_rows)
+        # the zones can cover just a window of the raster (see RasterizeZones)
+        zone_GeoT = zone_dataset.GetGeoTransform()
+        if tuple(zone_size) != (xsize, ysize) and np.allclose(zone_GeoT[1:3]+zone_GeoT[4:], GeoT[1:3]+GeoT[4:]):
+            x_offset = int(round((zone_GeoT[0] - GeoT[0])/GeoT[1]))
+            y_offset = int(round((zone_GeoT[3] - GeoT[3])/GeoT[5]))
+            if x_offset >= 0 and y_offset >= 0 and x_offset + zone_size[0] <= xsize and \
+               y_offset + zone_size[1] <= ysize:
+                window = (x_offset, y_offset) + tuple(zone_size)
+    elif zone_raster is not None:
+        zone_size = LSDMap_IO.GetGeoInfo(zone_raster)[1:3]
+        zone_blocks = LSDMap_IO.ReadRasterRowBlocks(zone_raster, block_rows = block_rows)
+    else:
+        raise ValueError("You need to give me a zone_raster or a zone_dataset")
+    if window is None and tuple(zone_size) != (xsize, ysize):
+        raise ValueError("The zones are not on the same grid as "+value_raster)
+
+    # the histograms need the range of the values, which is another pass through the raster
+    # unless it is given
+    if percentiles is not None and value_range is None:
+        value_range = LSDMap_IO.GetRasterMinMax(value_raster)
+    zonal = ZonalAccumulator(value_range, n_hist_bins, percentiles)
+    value_blocks = LSDMap_IO.ReadRasterRowBlocks(value_raster, block_rows = block_rows,
+                                                 window = window)
+    for (first_row, labels), (first_row, block) in zip(zone_blocks, value_blocks):
+        zonal.add_block(labels, block)
+
+    table = zonal.results()
+    if junction_to_key_dict is not None:
+        table = table[table.index.isin(list(junction_to_key_dict.keys()))].copy()
+        table.index = [junction_to_key_dict[junction] for junction in table.index]
+        table.index.name = "zone"
+    return table
+
+def _DatasetRowBlocks(dataset, block_rows):
+    """Reads the first band of an open gdal dataset a strip of rows at a time, nodata as nan
+    (like ReadRasterRowBlocks)"""
+    band = dataset.GetRasterBand(1)
+    NoDataValue = band.GetNoDataValue()
+    for i in range(0, band.YSize, block_rows):
+        block = band.ReadAsArray(0, i, band.XSize, min(block_rows, band.YSize - i)).astype(float)
+        if NoDataValue is not None:
+            block[block == NoDataValue] = np.nan
+        yield i, block
 
 
 #==============================================================================
@@ -1502,51 +1502,85 @@ def SwathPlot(path, filename, axis):
 #==============================================================================
 
 
-def LongitudinalSwathAnalysisPlot(full_file_path, ax):
+# The columns of the swath profile files from the swath analysis driver
+SWATH_PROFILE_COLUMNS = ["distance", "mean", "sd", "minimum", "LQ", "median", "UQ", "maximum"]
+
+def ReadSwathProfileFile(full_file_path, NoDataValue = -9999):
+    """Reads a swath profile text file from the swath analysis driver in one go
+    (rather than line by line). Rows where the mean is nodata are set to nan.
+
+    Args:
+        full_file_path (str): The swath profile file (space separated, with a header line)
+        NoDataValue (float): The nodata value of the file
+
+    Returns:
+        A pandas dataframe with the columns in SWATH_PROFILE_COLUMNS
+
+    Author: SMM
+    """
+    import pandas as pd
+
+    swath = pd.read_csv(full_file_path, sep=r"\s+", skiprows=1, header=None,
+                        usecols=range(len(SWATH_PROFILE_COLUMNS)), names=SWATH_PROFILE_COLUMNS,
+                        dtype=float)
+    nodata = swath["mean"].values == NoDataValue
+    swath.loc[nodata, SWATH_PROFILE_COLUMNS[1:]] = np.nan
+    return swath
+
+def ReadSwathProfileFiles(file_list, n_threads = 8, NoDataValue = -9999):
+    """Reads many swath profile files at the same time in a pool of threads
+    (pandas releases the GIL while parsing) and stacks them into one long table.
+
+    Args:
+        file_list (list): The swath profile files
+        n_threads (int): The number of threads
+        NoDataValue (float): The nodata value of the files
+
+    Returns:
+        A pandas dataframe with a "file" column and the columns in SWATH_PROFILE_COLUMNS,
+        with the files in the order of file_list
+
+    Author: SMM
+    """
+    import pandas as pd
+    from multiprocessing.pool import ThreadPool
+
+    file_list = list(file_list)
+    if len(file_list) == 0:
+        return pd.DataFrame(columns = ["file"]+SWATH_PROFILE_COLUMNS)
+
+    n_threads = max(1, min(n_threads, len(file_list)))
+    if n_threads == 1:
+        swaths = [ReadSwathProfileFile(f, NoDataValue) for f in file_list]
+    else:
+        pool = ThreadPool(n_threads)
+        try:
+            swaths = pool.map(lambda f: ReadSwathProfileFile(f, NoDataValue), file_list)
+        finally:
+            pool.close()
+            pool.join()
+
+    for f, swath in zip(file_list, swaths):
+        swath.insert(0, "file", f)
+    return pd.concat(swaths, ignore_index = True)
+
+def LongitudinalSwathAnalysisPlot(full_file_path, ax, swath = None):
     """Longitudinal channel swath profiles from the swath analysis driver
         output.
 
+    Args:
+        full_file_path (str): The swath profile file
+        ax: The axes to plot on
+        swath (dataframe): The data of the file, if you have already read it with
+            ReadSwathProfileFile(s). If None the file is read.
+
     Author:
         DAV & DTM
     """
-
-    # FileList = dir +
-    f = open(full_file_path, 'r')
-    lines = f.readlines()
-    N_Segments = len(lines)-1
-
-    # Initialise a bunch of vectors
-    distance = np.zeros(N_Segments)
-    mean = np.zeros(N_Segments)
-    sd = np.zeros(N_Segments)
-    minimum = np.zeros(N_Segments)
-    LQ = np.zeros(N_Segments)
-    median = np.zeros(N_Segments)
-    UQ = np.zeros(N_Segments)
-    maximum = np.zeros(N_Segments)
-    for i in range (0, N_Segments):
-
-       line = lines[i+1].strip().split(" ")
-       distance[i] = float(line[0])
-       mean[i] = float(line[1])
-       sd[i] = float(line[2])
-       minimum[i] = float(line[3])
-       LQ[i] = float(line[4])
-       median[i] = float(line[5])
-       UQ[i] = float(line[6])
-       maximum[i] = float(line[7])
-
-       # if there is nodata (-9999) replace with the numpy nodata entry
-       if (mean[i] == -9999):
-         mean[i] = np.nan
-         sd[i] = np.nan
-         minimum[i] = np.nan
-         LQ[i] = np.nan
-         median[i] = np.nan
-         UQ[i] = np.nan
-         maximum[i] = np.nan
-
-    f.close()
+    if swath is None:
+        swath = ReadSwathProfileFile(full_file_path)
+    distance = swath["distance"].values
+    mean = swath["mean"].values
 
     #######################
     #                     #
@@ -1576,7 +1610,7 @@ def LongitudinalSwathAnalysisPlot(full_file_path, ax):
     plt.xlabel('Distance along channel longitudinal profile (m)')
     plt.subplots_adjust(bottom=0.15,left=0.18)
 
-def MultiLongitudinalSwathAnalysisPlot(data_dir, wildcard_fname, maximum=0):
+def MultiLongitudinalSwathAnalysisPlot(data_dir, wildcard_fname, maximum=0, n_threads=8):
     """For multiple overlaid channel swath profiles.
 
     Arguments:
@@ -1587,6 +1621,7 @@ def MultiLongitudinalSwathAnalysisPlot(data_dir, wildcard_fname, maximum=0):
         maximum (optional): Hacky solution, but give this a float value and it
                             will plot the 'zero' line on your swath profile.
                             C.f. maximum length of channel)
+        n_threads (optional): The number of threads used to read the files
 
     Author:
         DAV
@@ -1595,9 +1630,12 @@ def MultiLongitudinalSwathAnalysisPlot(data_dir, wildcard_fname, maximum=0):
 
     fig, ax = plt.subplots()
 
-    for f in sorted(glob.glob(data_dir + wildcard_fname)):
+    # read all the files at once
+    file_list = sorted(glob.glob(data_dir + wildcard_fname))
+    swaths = ReadSwathProfileFiles(file_list, n_threads = n_threads)
+    for f, swath in swaths.groupby("file", sort = False):
         print(f)
-        LongitudinalSwathAnalysisPlot(f, ax)
+        LongitudinalSwathAnalysisPlot(f, ax, swath = swath)
 
     # Plot the zero line on the graph, if length supplied.
     x, y = function_sketcher((lambda x: x*0), np.linspace(0, maximum, 100))
@@ -39,17 +39,10 @@ def ConvertBasinIndexToJunction(BasinPointData,BasinIndexList):
 
 
     these_data = BasinPointData.QueryData("outlet_junction")
-    these_data = [int(x) for x in these_data]
-
-    #print("The junctions are: ")
-
-
-
-
-    basin_junction_list = []
-    for basinindex in BasinIndexList:
-        basin_junction_list.append(these_data[basinindex])
+    these_data = np.asarray(these_data).astype(int)
 
+    # the basin index is the row of the basin in the basin info file, so this is just a lookup
+    basin_junction_list = these_data[np.asarray(BasinIndexList, dtype = int)].tolist()
 
     return basin_junction_list
 
@@ -69,57 +62,36 @@ def FindSourceInformation(thisPointData):
     """
 
     # Get the chi, m_chi, basin number, and source ID code
-    chi = thisPointData.QueryData('chi')
-    chi = [float(x) for x in chi]
-    elevation = thisPointData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    fdist = thisPointData.QueryData('flow distance')
-    fdist = [float(x) for x in fdist]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
-    latitude = thisPointData.GetLatitude()
-    longitude = thisPointData.GetLongitude()
-
-
+    Chi = np.asarray(thisPointData.QueryData('chi')).astype(float)
+    Elevation = np.asarray(thisPointData.QueryData('elevation')).astype(float)
+    Fdist = np.asarray(thisPointData.QueryData('flow distance')).astype(float)
+    Source = np.asarray(thisPointData.QueryData('source_key')).astype(int)
+    Latitude = np.asarray(thisPointData.GetLatitude())
+    Longitude = np.asarray(thisPointData.GetLongitude())
+    M_chi = np.asarray(thisPointData.QueryData('m_chi')).astype(float)
+    have_M_chi = len(M_chi) == len(Chi)
+
+    # Group the nodes by source once, and then get the node with the
+    # maximum and minimum chi of every source in a single pass
+    source_index = LSDStats.GroupIndex(Source)
+    print("N sources is: "+str(len(source_index)))
+    idx_of_max_chi = source_index.argmax(Chi)
+    idx_of_min_chi = source_index.argmin(Chi)
+    chi_length = Chi[idx_of_max_chi]-Chi[idx_of_min_chi]
 
-
-    Chi = np.asarray(chi)
-    Elevation = np.asarray(elevation)
-    Fdist = np.asarray(fdist)
-    Source = np.asarray(source)
-    Latitude = np.asarray(latitude)
-    Longitude = np.asarray(longitude)
-
-    n_sources = Source.max()+1
-    print("N sources is: "+str(n_sources))
-
-    # This loops through all the source indices, and then picks out the
-    # Elevation, chi coordinate and flow distance of each node
     # Then it returns a dictionary containing the elements of the node
     these_source_nodes = {}
-    for src_idx in range(0,n_sources):
-        m = np.ma.masked_where(Source!=src_idx, Source)
-
-        # Mask the unwanted values
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-        maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-        maskFlowDistance = np.ma.masked_where(np.ma.getmask(m), Fdist)
-        maskLatitude = np.ma.masked_where(np.ma.getmask(m), Latitude)
-        maskLongitude= np.ma.masked_where(np.ma.getmask(m), Longitude)
-
-        # get the locations of the source
+    for g,src_idx in enumerate(source_index.key_list()):
+        this_node = idx_of_max_chi[g]
         this_dict = {}
-        idx_of_max_FD = maskX.argmax()
-        this_dict["FlowDistance"]=maskFlowDistance[idx_of_max_FD]
-        this_dict["Chi"]=maskX[idx_of_max_FD]
-        this_dict["Elevation"]=maskElevation[idx_of_max_FD]
-        this_dict["Latitude"]=maskLatitude[idx_of_max_FD]
-        this_dict["Longitude"]=maskLongitude[idx_of_max_FD]
-
-        # get the minimum of the source
-        idx_of_min_Chi = maskX.argmin()
-        chi_length = maskX[idx_of_max_FD]-maskX[idx_of_min_Chi]
-        this_dict["SourceLength"]=chi_length
+        this_dict["FlowDistance"]=Fdist[this_node]
+        this_dict["Chi"]=Chi[this_node]
+        this_dict["Elevation"]=Elevation[this_node]
+        this_dict["Latitude"]=Latitude[this_node]
+        this_dict["Longitude"]=Longitude[this_node]
+        if have_M_chi:
+            this_dict["M_chi"]=M_chi[this_node]
+        this_dict["SourceLength"]=chi_length[g]
 
         these_source_nodes[src_idx] = this_dict
 
@@ -146,6 +118,97 @@ def FindShortSourceChannels(these_source_nodes,threshold_length):
     return long_sources
 
 
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+def DecimateProfileNodes(x_data, source_keys, x_resolution):
+    """This thins the nodes of channel profiles so each source keeps one node per x_resolution along the profile.
+
+    It is used to decimate profiles to the resolution of the screen or figure: there is no point drawing many nodes in the same pixel.
+
+    Args:
+        x_data (array): The position of the nodes along the profile (i.e. chi or flow distance)
+        source_keys (array): The source key of each node
+        x_resolution (float): The spacing along the profile to keep. No thinning if 0.
+
+    Return:
+        An array with the indices of the nodes to keep
+
+    Author: SMM
+    """
+    x_data = np.asarray(x_data, dtype = float)
+    if x_resolution <= 0 or x_data.size == 0:
+        return np.arange(x_data.size)
+
+    source_index = LSDStats.GroupIndex(source_keys, np.floor(x_data/x_resolution).astype(np.int64))
+    return np.sort(source_index.argmin(x_data))
+
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+def PlotProfileCollection(ax, x_data, y_data, source_keys, colour_data,
+                          this_cmap, this_norm = None, profile_style = "scatter",
+                          x_resolution = 0, point_size = 2.0, linewidth = 1.0):
+    """This draws all the channel profiles of a plot with a single artist.
+
+    Rather than one scatter per basin or source, the nodes are sorted by source
+    and along the profile once and drawn either as one rasterised scatter or as
+    one LineCollection with a segment between each pair of consecutive nodes of
+    a source.
+
+    Args:
+        ax (axis): The axis to draw on
+        x_data (array): The x location of the nodes (i.e. chi, with any stacking offset added)
+        y_data (array): The y location of the nodes (i.e. elevation)
+        source_keys (array): The source key of each node. Lines only join nodes of the same source.
+        colour_data (array): The value used to colour each node (i.e. basin, source or M_chi)
+        this_cmap (colormap): The colourmap
+        this_norm (Normalize): The colour normalisation. If None, it is scaled to the data.
+        profile_style (str): "scatter" or "lines"
+        x_resolution (float): If > 0 the profiles are decimated so that each source only has one node per x_resolution.
+        point_size (float): The size of the points for the scatter style
+        linewidth (float): The width of the lines for the lines style
+
+    Return:
+        The artist that was drawn (it can be used for a colourbar)
+
+    Author: SMM
+    """
+    from matplotlib.collections import LineCollection
+
+    x_data = np.asarray(x_data, dtype = float)
+    y_data = np.asarray(y_data, dtype = float)
+    source_keys = np.asarray(source_keys)
+    colour_data = np.asarray(colour_data)
+
+    keep = DecimateProfileNodes(x_data, source_keys, x_resolution)
+    if keep.size != x_data.size:
+        print("I decimated the profiles from "+str(x_data.size)+" to "+str(keep.size)+" nodes")
+        x_data = x_data[keep]
+        y_data = y_data[keep]
+        source_keys = source_keys[keep]
+        colour_data = colour_data[keep]
+
+    if profile_style == "lines":
+        # order the nodes by source and then along the profile
+        source_index = LSDStats.GroupIndex(source_keys)
+        order = source_index.order_within(x_data)
+        sorted_x = x_data[order]
+        sorted_y = y_data[order]
+        same_source = source_index.group_ids[order][1:] == source_index.group_ids[order][:-1]
+
+        # each segment runs from a node to the next node of the same source
+        starts = np.column_stack((sorted_x[:-1],sorted_y[:-1]))[same_source]
+        ends = np.column_stack((sorted_x[1:],sorted_y[1:]))[same_source]
+        segments = np.stack((starts,ends), axis = 1)
+
+        artist = LineCollection(segments, cmap = this_cmap, norm = this_norm, linewidths = linewidth)
+        artist.set_array(colour_data[order][:-1][same_source])
+        ax.add_collection(artist)
+    else:
+        if profile_style != "scatter":
+            print("I did not understand the profile style. Choices are scatter and lines. Defaulting to scatter.")
+        artist = ax.scatter(x_data, y_data, s = point_size, c = colour_data, norm = this_norm,
+                            cmap = this_cmap, edgecolors = 'none', rasterized = True)
+
+    return artist
+
 ##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 ## This function plots the chi slope on a shaded relief map
 ## It uses the Kirby and Whipple colour scheme
@@ -988,7 +1051,8 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
                 elevation_threshold = 0,
                 source_thinning_threshold = 0, plot_M_chi = False,
                 size_format = "ESURF",
-                plot_segments = False):
+                plot_segments = False,
+                profile_style = "scatter", decimation_pixels = 0):
     """This function plots the chi vs elevation: lumps everything onto the same axis. This tends to make a mess.
 
     Args:
@@ -1002,6 +1066,8 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
         source_thinning_threshold (float) = Minimum chi length of a source segment. No thinning if 0
         plot_MChi (bool): If true, plots chi against MChi
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        profile_style (str): "scatter" (one rasterised scatter for all profiles) or "lines" (one LineCollection for all profiles)
+        decimation_pixels (int): If > 0, the profiles are decimated to this number of nodes across the x axis. No decimation if 0.
 
     Returns:
          Does not return anything but makes a plot.
@@ -1116,7 +1182,11 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
 
     this_cmap = plt.cm.Set1
     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
-    Basin_colors = [x % NUM_COLORS for x in Basin]
+    Basin_colors = Basin % NUM_COLORS
+
+    # Group the nodes by basin and by source so we can slice them out rather than masking
+    basin_index = LSDStats.GroupIndex(Basin)
+    source_index = LSDStats.GroupIndex(Source)
 
 
     dot_pos = FigFileName.rindex('.')
@@ -1130,47 +1200,29 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
 
     texts = []
     bbox_props = dict(boxstyle="circle,pad=0.1", fc="w", ec="k", lw=0.5,alpha = 0.25)
+    plot_nodes = []
     for basin_number in basin_order_list:
 
         print(("This basin is: " +str(basin_number)))
 
-        m = np.ma.masked_where(Basin!=basin_number, Basin)
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-        if plot_M_chi:
-            maskElevation = np.ma.masked_where(np.ma.getmask(m), M_chi)
-        else:
-            maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-
-        maskBasin = np.ma.masked_where(np.ma.getmask(m), Basin_colors)
-        maskSource = np.ma.masked_where(np.ma.getmask(m), Source)
+        these_nodes = basin_index.indices(basin_number)
+        maskSource = Source[these_nodes]
 
         if(have_segmented_elevation):
             # We need to loop through the sources.
-            # We can do that by converting the sources to a set and then looping through the set
-            sources_list = maskSource.tolist()
-            myset = set(sources_list)
+            sources_list = np.unique(maskSource).tolist()
             print("The sources are: ")
-            print(myset)
-            sources_list = list(myset)
+            print(sources_list)
             for source in sources_list:
-                m_mask = np.ma.masked_where(Source!=source, Source)
-                mask_maskX = np.ma.masked_where(np.ma.getmask(m_mask), Chi)
-                maskSegmentedElevation = np.ma.masked_where(np.ma.getmask(m_mask), Segmented_elevation)
-                a_line, = ax.plot(mask_maskX,maskSegmentedElevation,'b',alpha = 0.6)
+                source_nodes = source_index.indices(source)
+                a_line, = ax.plot(Chi[source_nodes],Segmented_elevation[source_nodes],'b',alpha = 0.6)
                 a_line.set_dashes([3,1])
 
 
         # logic for source labeling
         if label_sources:
 
-            # Convert the masked data to a list and then that list to a set and
-            # back to a list (phew!)
-            list_source = maskSource.tolist()
-            set_source = set(list_source)
-            list_source = list(set_source)
-
-            # Now we have to get rid of stupid non values
-            list_source = [x for x in list_source if x is not None]
+            list_source = np.unique(maskSource).tolist()
 
             print("these sources are: ")
             print(list_source)
@@ -1190,7 +1242,22 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
                         verticalalignment='bottom', horizontalalignment='left',fontsize=8,bbox=bbox_props))
 
 
-        ax.scatter(maskX,maskElevation,s=2.0, c=maskBasin,norm=cNorm,cmap=this_cmap,edgecolors='none')
+        plot_nodes.append(these_nodes)
+
+    # Now draw all the basins in one go
+    if len(plot_nodes) == 0:
+        print("There are no basins to plot, the figure will be empty")
+    else:
+        plot_nodes = np.concatenate(plot_nodes)
+        if plot_M_chi:
+            Z_data = M_chi
+        else:
+            Z_data = Elevation
+        x_resolution = 0
+        if decimation_pixels > 0:
+            x_resolution = chi_axis_max/float(decimation_pixels)
+        PlotProfileCollection(ax, Chi[plot_nodes], Z_data[plot_nodes], Source[plot_nodes], Basin_colors[plot_nodes],
+                              this_cmap, cNorm, profile_style = profile_style, x_resolution = x_resolution)
 
 
 
@@ -1236,7 +1303,8 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
                        basin_order_list = [],basin_rename_list = [],
                        X_offset = 5,label_sources = False,
                        source_thinning_threshold = 0,
-                       size_format = "ESURF"):
+                       size_format = "ESURF",
+                       profile_style = "scatter", decimation_pixels = 0):
     """This function plots the chi vs elevation: It stacks profiles (so the basins are spaced out) and colours them by the source number.
 
     Args:
@@ -1252,6 +1320,8 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
         label_sources (bool): If true, label the sources.
         source_thinning_threshold (float) = Minimum chi length of a source segment. No thinning if 0.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        profile_style (str): "scatter" (one rasterised scatter for all profiles) or "lines" (one LineCollection for all profiles)
+        decimation_pixels (int): If > 0, the profiles are decimated to this number of nodes across the x axis. No decimation if 0.
 
     Returns:
          Does not return anything but makes a plot.
@@ -1362,9 +1432,12 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
     this_cmap = plt.cm.Set1
     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
     #scalarMap = plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
-    Source_colors = [x % NUM_COLORS for x in Source]
+    Source_colors = Source % NUM_COLORS
     plt.hold(True)
 
+    # Group the nodes by basin so we can slice them out rather than masking
+    basin_index = LSDStats.GroupIndex(Basin)
+
     # Logic for stacked labels. You need to run this after source thinning to
     # get an updated source dict
     if label_sources:
@@ -1377,14 +1450,19 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
     # Format the bounding box of source labels
     bbox_props = dict(boxstyle="round,pad=0.1", fc="w", ec="b", lw=0.5,alpha = 0.5)
 
+    # the nodes of each basin and their offsets are collected so they can be drawn in one go
+    plot_nodes = []
+    plot_offsets = []
     for basin_number in basins_list:
 
         print(("This basin is: " +str(basin_number)))
 
-        m = np.ma.masked_where(Basin!=basin_number, Basin)
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-        maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-        maskSource = np.ma.masked_where(np.ma.getmask(m), Source_colors)
+        these_nodes = basin_index.indices(basin_number)
+        if len(these_nodes) == 0:
+            print("There are no nodes in this basin, I am skipping it.")
+            this_X_offset = this_X_offset+X_offset
+            continue
+        maskX = Chi[these_nodes]
 
         print(("adding an offset of: "+str(this_X_offset)))
 
@@ -1420,14 +1498,8 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
         # logic for source labeling
         if label_sources:
 
-            # Convert the masked data to a list and then that list to a set and
-            # back to a list (phew!)
-            list_source = maskSource.tolist()
-            set_source = set(list_source)
-            list_source = list(set_source)
-
-            # Now we have to get rid of stupid non values
-            list_source = [x for x in list_source if x is not None]
+            # the labels use the source keys, not the source colours
+            list_source = np.unique(Source[these_nodes]).tolist()
 
             print("these sources are: ")
             print(list_source)
@@ -1443,9 +1515,22 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
                         verticalalignment='bottom', horizontalalignment='left',fontsize=8,bbox=bbox_props))
 
 
-        ax.scatter(maskX,maskElevation,s=2.0, c=maskSource,norm=cNorm,cmap=this_cmap,edgecolors='none')
+        plot_nodes.append(these_nodes)
+        plot_offsets.append(np.full(len(these_nodes),this_X_offset,dtype=float))
         this_X_offset = this_X_offset+X_offset
 
+    # Now draw all the basins in one go
+    if len(plot_nodes) == 0:
+        print("There are no basins to plot, the figure will be empty")
+    else:
+        plot_nodes = np.concatenate(plot_nodes)
+        plot_offsets = np.concatenate(plot_offsets)
+        x_resolution = 0
+        if decimation_pixels > 0:
+            x_resolution = X_axis_max/float(decimation_pixels)
+        PlotProfileCollection(ax, Chi[plot_nodes]+plot_offsets, Elevation[plot_nodes], Source[plot_nodes], Source_colors[plot_nodes],
+                              this_cmap, cNorm, profile_style = profile_style, x_resolution = x_resolution)
+
 
     ax.spines['top'].set_linewidth(1)
     ax.spines['left'].set_linewidth(1)
@@ -1486,7 +1571,8 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
                        this_cmap = plt.cm.cubehelix,data_name = 'chi', X_offset = 5,
                        plotting_data_format = 'log',
                        label_sources = False, source_thinning_threshold = 0,
-                       size_format = "ESURF"):
+                       size_format = "ESURF",
+                       profile_style = "scatter", decimation_pixels = 0):
     """This function plots the chi vs elevation or flow distance vs elevation.
 
     It stacks profiles (so the basins are spaced out).
@@ -1508,6 +1594,8 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
         label_sources (bool): If true, label the sources.
         source_thinning_threshold (float) = Minimum chi length of a source segment. No thinning if 0.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        profile_style (str): "scatter" (one rasterised scatter for all profiles) or "lines" (one LineCollection for all profiles)
+        decimation_pixels (int): If > 0, the profiles are decimated to this number of nodes across the x axis. No decimation if 0.
 
     Returns:
          Does not return anything but makes a plot.
@@ -1615,6 +1703,8 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
 
     plt.hold(True)
 
+    # Group the nodes by basin so we can slice them out rather than masking
+    basin_index = LSDStats.GroupIndex(Basin)
 
     # Now calculate the spacing of the stacks
     this_X_offset = 0
@@ -1655,15 +1745,20 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
     # Format the bounding box of source labels
     bbox_props = dict(boxstyle="round,pad=0.1", fc="w", ec="b", lw=0.5,alpha = 0.5)
 
+    # the nodes of each basin and their offsets are collected so they can be drawn in one go
+    plot_nodes = []
+    plot_offsets = []
     for basin_number in basins_list:
 
         print(("This basin is: " +str(basin_number)))
 
-        m = np.ma.masked_where(Basin!=basin_number, Basin)
-        maskX = np.ma.masked_where(np.ma.getmask(m), Xdata)
-        maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-        maskMChi = np.ma.masked_where(np.ma.getmask(m), M_chi)
-        maskSource = np.ma.masked_where(np.ma.getmask(m), Source)
+        these_nodes = basin_index.indices(basin_number)
+        if len(these_nodes) == 0:
+            print("There are no nodes in this basin, I am skipping it.")
+            this_X_offset = this_X_offset+2*X_offset
+            continue
+        maskX = Xdata[these_nodes]
+        maskSource = Source[these_nodes]
 
         print("adding an offset of: "+str(this_X_offset))
 
@@ -1679,6 +1774,8 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
 
         # Now add the offset to the data
         maskX = np.add(maskX,this_X_offset)
+        plot_nodes.append(these_nodes)
+        plot_offsets.append(np.full(len(these_nodes),this_X_offset,dtype=float))
         this_X_offset = this_X_offset+X_offset
 
         print("Min: "+str(this_min_x)+" Max: "+str(this_max_x))
@@ -1706,14 +1803,7 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
         # logic for source labeling
         if label_sources:
 
-            # Convert the masked data to a list and then that list to a set and
-            # back to a list (phew!)
-            list_source = maskSource.tolist()
-            set_source = set(list_source)
-            list_source = list(set_source)
-
-            # Now we have to get rid of stupid non values
-            list_source = [x for x in list_source if x is not None]
+            list_source = np.unique(maskSource).tolist()
 
             #print("these sources are: ")
             #print list_source
@@ -1738,11 +1828,23 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
                 texts.append(ax.text(source_X+this_X_offset, source_Elevation, str(this_source), style='italic',
                         verticalalignment='bottom', horizontalalignment='left',fontsize=8,bbox=bbox_props))
 
-        sc = ax.scatter(maskX,maskElevation,s=2.0, c=maskMChi,cmap=this_cmap,edgecolors='none')
-
         # increment the offset
         this_X_offset = this_X_offset+X_offset
 
+    # Now draw all the basins in one go
+    if len(plot_nodes) == 0:
+        # an empty artist still gives the colourbar
+        print("There are no basins to plot, the figure will be empty")
+        sc = ax.scatter([], [], c = [], cmap = this_cmap)
+    else:
+        plot_nodes = np.concatenate(plot_nodes)
+        plot_offsets = np.concatenate(plot_offsets)
+        x_resolution = 0
+        if decimation_pixels > 0:
+            x_resolution = X_axis_max/float(decimation_pixels)
+        sc = PlotProfileCollection(ax, Xdata[plot_nodes]+plot_offsets, Elevation[plot_nodes], Source[plot_nodes], M_chi[plot_nodes],
+                                   this_cmap, profile_style = profile_style, x_resolution = x_resolution)
+
     # set the colour limits
     sc.set_clim(0, M_chi_axis_max)
     #bounds = (0, M_chi_axis_max)
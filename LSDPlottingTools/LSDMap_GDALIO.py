@@ -577,6 +577,109 @@ def ReadRasterArrayBlocks_numpy(raster_file,raster_band=1):
     return data_array
 #==============================================================================
 
+#==============================================================================
+def ReadRasterRowBlocks(raster_file, raster_band = 1, block_rows = None, window = None):
+    """Reads a raster a strip of rows at a time, so you can go through a big raster
+    without holding all of it in memory.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster
+        block_rows (int): The number of rows in each strip. Default is the block height
+            of the raster (at least 64 rows).
+        window (tuple): Only read the window (x_offset, y_offset, n_cols, n_rows) of the raster
+
+    Yields:
+        first_row (int), block (np.array of floats): the first row of the strip (in the raster)
+        and its data, with the nodata values as nan. If the raster has no nodata value,
+        -9999 (the LSDTopoTools nodata value) is used.
+
+    Author: SMM
+    """
+    if exists(raster_file) is False:
+        raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+
+    dataset = gdal.Open(raster_file, GA_ReadOnly )
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+
+    band = dataset.GetRasterBand(raster_band)
+    NoDataValue = band.GetNoDataValue()
+    if NoDataValue is None:
+        NoDataValue = -9999
+    if window is None:
+        x_offset, y_offset, xsize, ysize = 0, 0, band.XSize, band.YSize
+    else:
+        x_offset, y_offset, xsize, ysize = [int(w) for w in window]
+
+    if block_rows is None:
+        block_rows = max(band.GetBlockSize()[1], 64)
+
+    for i in range(y_offset, y_offset + ysize, block_rows):
+        rows = min(block_rows, y_offset + ysize - i)
+        block = band.ReadAsArray(x_offset, i, xsize, rows).astype(float)
+        block[block == NoDataValue] = np.nan
+        yield i, block
+#==============================================================================
+
+#==============================================================================
+def ReadRasterWindow(raster_file, x_offset, y_offset, n_cols, n_rows, raster_band = 1):
+    """Reads a rectangular window of a raster. The window is clipped to the raster.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        x_offset, y_offset (int): The column and row of the top left corner of the window
+        n_cols, n_rows (int): The size of the window
+        raster_band (int): the band of the raster
+
+    Return:
+        x_offset, y_offset, block: the top left corner of the (clipped) window and its data
+        as floats, with nodata as nan
+
+    Author: SMM
+    """
+    if exists(raster_file) is False:
+        raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+
+    dataset = gdal.Open(raster_file, GA_ReadOnly )
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    band = dataset.GetRasterBand(raster_band)
+    NoDataValue = band.GetNoDataValue()
+
+    x_end = min(int(x_offset) + int(n_cols), band.XSize)
+    y_end = min(int(y_offset) + int(n_rows), band.YSize)
+    x_offset = max(int(x_offset), 0)
+    y_offset = max(int(y_offset), 0)
+    if x_end <= x_offset or y_end <= y_offset:
+        return x_offset, y_offset, np.zeros((0,0))
+
+    block = band.ReadAsArray(x_offset, y_offset, x_end - x_offset, y_end - y_offset).astype(float)
+    if NoDataValue is not None:
+        block[block == NoDataValue] = np.nan
+    return x_offset, y_offset, block
+#==============================================================================
+
+#==============================================================================
+def GetRasterMinMax(raster_file, raster_band = 1):
+    """Gets the exact minimum and maximum of a raster (ignoring nodata), computed by GDAL.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster
+
+    Return:
+        min_value, max_value
+
+    Author: SMM
+    """
+    dataset = gdal.Open(raster_file, GA_ReadOnly )
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    min_value, max_value = dataset.GetRasterBand(raster_band).ComputeRasterMinMax(False)
+    return min_value, max_value
+#==============================================================================
+
 #==============================================================================
 def array2raster(rasterfn,newRasterfn,array,driver_name = "ENVI", noDataValue = -9999):
     """Takes an array and writes to a GDAL compatible raster. It needs another raster to map the dimensions.
@@ -616,6 +719,155 @@ def array2raster(rasterfn,newRasterfn,array,driver_name = "ENVI", noDataValue =
 #==============================================================================
 
 
+#==============================================================================
+def _ReadPixelsByBlock(band, rows, cols, NoDataValue = None):
+    """Reads the values of a list of pixels, decoding only the raster blocks that contain them.
+
+    Args:
+        band (gdal band): The raster band
+        rows (np.array): The rows of the pixels
+        cols (np.array): The columns of the pixels
+        NoDataValue (float): The nodata value. These pixels are returned as nan.
+
+    Return:
+        np.array: The pixel values (float), nan where the pixel is nodata or outside the raster
+
+    Author: SMM
+    """
+    rows = np.asarray(rows, dtype = np.int64)
+    cols = np.asarray(cols, dtype = np.int64)
+    values = np.full(rows.shape, np.nan)
+
+    xsize = band.XSize
+    ysize = band.YSize
+    inside = (rows >= 0) & (rows < ysize) & (cols >= 0) & (cols < xsize)
+    if not np.any(inside):
+        return values
+
+    x_block_size, y_block_size = band.GetBlockSize()
+    n_x_blocks = (xsize + x_block_size - 1)//x_block_size
+
+    # sort the pixels by block so each block is read once
+    idx = np.nonzero(inside)[0]
+    block_keys = (rows[idx]//y_block_size)*n_x_blocks + cols[idx]//x_block_size
+    order = np.argsort(block_keys, kind = "mergesort")
+    idx = idx[order]
+    block_keys = block_keys[order]
+    unique_keys, starts = np.unique(block_keys, return_index = True)
+    ends = np.append(starts[1:], idx.size)
+
+    for key, start, end in zip(unique_keys, starts, ends):
+        i = (key//n_x_blocks)*y_block_size
+        j = (key % n_x_blocks)*x_block_size
+        n_rows = min(y_block_size, ysize - i)
+        n_cols = min(x_block_size, xsize - j)
+        block = band.ReadAsArray(int(j), int(i), int(n_cols), int(n_rows))
+        these = idx[start:end]
+        values[these] = block[rows[these]-i, cols[these]-j]
+
+    if NoDataValue is not None:
+        values[values == NoDataValue] = np.nan
+
+    return values
+#==============================================================================
+
+#==============================================================================
+def SampleRasterAtPoints(raster_file, x, y, method = "nearest", raster_band = 1):
+    """Samples a raster at a set of point locations.
+
+    Only the raster blocks that contain points are read, so this is efficient
+    even for big rasters with few points.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        x (np.array): The x locations (i.e. easting) in the coordinate system of the raster
+        y (np.array): The y locations (i.e. northing) in the coordinate system of the raster
+        method (str): "nearest" or "bilinear". Bilinear interpolation ignores nodata neighbours.
+        raster_band (int): the band of the raster
+
+    Return:
+        np.array: The raster values at the points. Points outside the raster or on nodata are nan.
+
+    Author: SMM
+    """
+
+    if exists(raster_file) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+
+    dataset = gdal.Open(raster_file, GA_ReadOnly )
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+
+    band = dataset.GetRasterBand(raster_band)
+    NoDataValue = band.GetNoDataValue()
+    GeoT = dataset.GetGeoTransform()
+
+    # fractional pixel coordinates, measured from the top left corner of the raster
+    col_f = (np.asarray(x, dtype = np.float64) - GeoT[0])/GeoT[1]
+    row_f = (np.asarray(y, dtype = np.float64) - GeoT[3])/GeoT[5]
+    outside = ~((col_f >= 0) & (col_f < band.XSize) & (row_f >= 0) & (row_f < band.YSize))
+    col_f = np.nan_to_num(col_f)
+    row_f = np.nan_to_num(row_f)
+
+    if method == "nearest":
+        values = _ReadPixelsByBlock(band, np.floor(row_f), np.floor(col_f), NoDataValue)
+    elif method == "bilinear":
+        # interpolate between pixel centres
+        col_c = col_f - 0.5
+        row_c = row_f - 0.5
+        c0 = np.floor(col_c)
+        r0 = np.floor(row_c)
+        dc = col_c - c0
+        dr = row_c - r0
+        n = col_c.size
+
+        # read the four neighbours in one go
+        rows = np.concatenate((r0, r0, r0+1, r0+1))
+        cols = np.concatenate((c0, c0+1, c0, c0+1))
+        weights = np.concatenate(((1-dr)*(1-dc), (1-dr)*dc, dr*(1-dc), dr*dc))
+        corner_values = _ReadPixelsByBlock(band, rows, cols, NoDataValue).reshape(4,n)
+        weights = weights.reshape(4,n)
+
+        # nodata neighbours are left out and the weights renormalised
+        valid = ~np.isnan(corner_values)
+        weights = np.where(valid, weights, 0)
+        weight_sum = weights.sum(axis = 0)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            values = (np.where(valid, corner_values, 0)*weights).sum(axis = 0)/weight_sum
+        values[weight_sum == 0] = np.nan
+    else:
+        raise Exception("The sampling method must be nearest or bilinear, you gave me: "+str(method))
+
+    values[outside] = np.nan
+    return values
+#==============================================================================
+
+#==============================================================================
+def SampleRastersAtPoints(raster_files, x, y, method = "nearest", raster_band = 1):
+    """Samples several rasters at the same point locations.
+
+    Args:
+        raster_files (list): The filenames (with path and extension) of the rasters.
+        x (np.array): The x locations (i.e. easting) in the coordinate system of the rasters
+        y (np.array): The y locations (i.e. northing) in the coordinate system of the rasters
+        method (str): "nearest" or "bilinear"
+        raster_band (int): the band of the rasters
+
+    Return:
+        dict: The sampled values, with the raster filenames as keys
+
+    Author: SMM
+    """
+    if isinstance(raster_files, str):
+        raster_files = [raster_files]
+
+    sampled = {}
+    for raster_file in raster_files:
+        sampled[raster_file] = SampleRasterAtPoints(raster_file, x, y, method = method, raster_band = raster_band)
+    return sampled
+#==============================================================================
+
+
 def RasterDifference(RasterFile1, RasterFile2, raster_band=1, OutFileName="Test.outfile", OutFileType="ENVI"):
     """
     Takes two rasters of same size and subtracts second from first,
@@ -22,6 +22,10 @@ import LSDPlottingTools as LSDP
 import sys
 import pandas as pd
 from scipy.stats import norm
+from LSDPlottingTools import LSDMap_ResultsCache as RC
+
+# Densities already calculated in this session, keyed like the cache files
+_density_cache = {}
 
 def plot_knickpoint_elevations(PointData, DataDirectory, basin_key=0, kp_threshold=0,
                                FigFileName='Image.pdf', FigFormat='pdf', size_format='ESURF', kp_type = "diff"):
@@ -1053,7 +1057,8 @@ def pdf_from_bin_one_col(ldf, DataDirectory, saveName = "BasicPDF_", column = "e
 
         print(data.shape)
         if(data.shape[0]>0):
-            ax1.hist(data, 100, normed=1, facecolor='green', alpha=0.75)
+            pdf, edges = get_density(ldf[inch], [pdf_col], bins = 100, method = "histogram")
+            ax1.hist(edges[0][:-1], bins = edges[0], weights = pdf, facecolor='green', alpha=0.75)
 
 
 
@@ -1065,20 +1070,96 @@ def pdf_from_bin_one_col(ldf, DataDirectory, saveName = "BasicPDF_", column = "e
         ax1.set_xlim(-100,100)
         plt.savefig(DataDirectory+saveName+inch+"_"+column+".png",dpi=500)
 
-def plot_2d_density_map(dataframe, DataDirectory, columns = ["drainage area", "diff"], bin = 50,   saveName = "BasicPDF_", size_format = "ESURF",):
+def get_density(dataframe, columns, bins = 50, method = "kde", bandwidth = None, log = None,
+                DataDirectory = None, fname_prefix = "knickpoints", use_cache = False):
+    """
+    Gets the density of one or two columns of a dataframe, either as a histogram or as a
+    binned (FFT) kernel density estimate (see statsutilities.fast_histogram and binned_kde).
+    If use_cache is True, the kernel density estimates are cached by the data, the columns, bins,
+    bandwidth and log options, in memory and, if DataDirectory is given, on disk, so that re-styling
+    or re-exporting a density plot doesn't recompute it. Histograms are quicker to recount than to hash the
+    data, so they aren't cached.
+
+    Args:
+        dataframe: a Pandas dataframe
+        columns (list of str): The columns
+        bins (int): number of bins (histogram) or grid nodes (kde) in each dimension
+        method (str): "histogram" or "kde"
+        bandwidth (float or list): The kernel bandwidth of each column. Default is Scott's rule.
+        log (list of bool): log10 the column before getting the density. Default is no log.
+        DataDirectory (str): Where to save the cache file. If None the cache is only kept in memory.
+        fname_prefix (str): The prefix of the cache file
+        use_cache (bool): Use (and save) the cached kde densities. Default is False.
+
+    Returns:
+        density (a probability density with one axis per column), coordinates (list of arrays:
+        the bin edges for a histogram or the grid nodes for a kde)
+
+    Author: SMM
+    """
+    if log is None:
+        log = [False]*len(columns)
+    data = []
+    for column, log_this in zip(columns, log):
+        values = np.asarray(dataframe[column].values, dtype = float)
+        if log_this:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.log10(values)
+            values = np.where(np.isfinite(values), values, np.nan)
+        data.append(values)
+
+    use_cache = use_cache and method == "kde"
+    if use_cache:
+        cache_key = RC.MakeCacheKey(RC.HashArrays(data), columns = list(columns), bins = bins, method = method,
+                                    bandwidth = bandwidth, log = [bool(l) for l in log])
+        if cache_key in _density_cache:
+            return _density_cache[cache_key]
+        if DataDirectory is not None:
+            cached = RC.LoadCachedArrays(RC.CacheFileName(DataDirectory, fname_prefix, "density", cache_key), cache_key)
+            if cached is not None:
+                result = (cached["density"], RC.UnpackRaggedArrays(cached["coordinates"], cached["offsets"]))
+                _density_cache[cache_key] = result
+                return result
+
+    if method == "histogram":
+        density, coordinates = LSDP.lsdstatsutilities.fast_histogram(data, bins = bins, density = True)
+    elif method == "kde":
+        density, coordinates = LSDP.lsdstatsutilities.binned_kde(data, n_grid = bins, bandwidth = bandwidth)
+    else:
+        raise ValueError("The density method should be histogram or kde, not "+str(method))
+
+    if use_cache:
+        _density_cache[cache_key] = (density, coordinates)
+        if DataDirectory is not None:
+            packed, offsets = RC.PackRaggedArrays(coordinates)
+            RC.SaveCachedArrays(RC.CacheFileName(DataDirectory, fname_prefix, "density", cache_key), cache_key,
+                                {"density": density, "coordinates": packed, "offsets": offsets})
+    return density, coordinates
+
+def plot_2d_density_map(dataframe, DataDirectory, columns = ["drainage area", "diff"], bin = 50,   saveName = "BasicPDF_", size_format = "ESURF",
+                        method = "kde", bandwidth = None, log = [False, False], cmap = "viridis", save_fmt = ".png", use_cache = False):
 
     """
     Plots a 2d histogram or density plot or heatmap depending how you name it of two variables.
+    A kde density comes from get_density, so it is only computed once for each dataset and set of options.
 
     Args:
         dataframe: a Pandas dataframe
         columns (list of str): The x,y columns to plot
         bin (int): number of bins
+        method (str): "histogram" or "kde" (a binned kernel density estimate)
+        bandwidth (float or list): The kernel bandwidth. Default is Scott's rule.
+        log (list of bool): plot the log10 of the x and/or y column
+        cmap (str or colourmap): The colourmap
+        save_fmt (str): The extension of the figure
+        use_cache (bool): Use the cached kde density (in memory and in DataDirectory)
 
     returns:
-        Nothing yet, plot a figure.
-    """
+        The density and the coordinates from get_density, and plot a figure.
 
+    Author: BG/SMM
+    """
+    plt.clf()
     if size_format == "geomorphology":
         fig = plt.figure(1, facecolor='white',figsize=(6.25,3.5))
         l_pad = -40
@@ -1089,15 +1170,28 @@ def plot_2d_density_map(dataframe, DataDirectory, columns = ["drainage area", "d
         fig = plt.figure(1, facecolor='white',figsize=(4.92126,3.5))
         l_pad = -35
 
-    X_data = dataframe[columns[0]]
-    Y_data = dataframe[columns[1]]
-
-
-
-
+    density, coordinates = get_density(dataframe, columns, bins = bin, method = method, bandwidth = bandwidth, log = log,
+                                       DataDirectory = DataDirectory, fname_prefix = saveName, use_cache = use_cache)
 
+    # the extent of the image: the bin edges, or half a node beyond the kde grid
+    extent = []
+    for coords in coordinates:
+        if method == "histogram":
+            extent.extend([coords[0], coords[-1]])
+        else:
+            half_spacing = 0.5*(coords[1]-coords[0])
+            extent.extend([coords[0]-half_spacing, coords[-1]+half_spacing])
 
+    ax = fig.add_subplot(111)
+    im = ax.imshow(density.T, origin = "lower", extent = extent, aspect = "auto", cmap = cmap, interpolation = "nearest")
+    cbar = fig.colorbar(im, ax = ax)
+    cbar.set_label("Density")
 
+    labels = ["log "+c if l else c for c, l in zip(columns, log)]
+    ax.set_xlabel(labels[0])
+    ax.set_ylabel(labels[1])
 
+    plt.savefig(DataDirectory+saveName+"_".join(columns).replace(" ","_")+save_fmt, dpi=500)
+    return density, coordinates
 
 #
@@ -15,6 +15,7 @@
 import matplotlib
 matplotlib.use('Agg')
 
+import os
 import numpy as np
 import LSDPlottingTools as LSDP
 import matplotlib.pyplot as plt
@@ -26,6 +27,7 @@ import math
 from LSDMapFigure import PlottingHelpers as Helper
 from LSDMapFigure.PlottingRaster import MapFigure
 from LSDMapFigure.PlottingRaster import BaseRaster
+from LSDPlottingTools import LSDMap_ResultsCache as RC
 
 
 #=============================================================================
@@ -130,7 +132,318 @@ def CompareChiAndSAMOverN(DataDirectory, fname_prefix, basin_list=[0], start_mov
     # Now plot the figure
     PlotMOverNDicts(DataDirectory, fname_prefix, SA_movern_dict,best_fit_movern_dict, FigFormat = "png", size_format = "ESURF")
 
-def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7):
+class MOverNFullStats(object):
+    """
+    This object loads the _fullstats files for all the m/n values once and keeps
+    the MLE and RMSE values in (m/n, tributary) arrays, so the outlier and
+    MLE calculations for every basin can be done without going back to the csv files.
+    The tributaries of each basin are kept in the order they appear in the files.
+
+    MLE products are calculated as sums of logs so that the product of many small
+    likelihoods does not underflow to zero.
+
+    Args:
+        DataDirectory (str): the data directory with the m/n csv files
+        fname_prefix (str): The prefix for the m/n csv files
+        start_movern (float): the starting m/n value. Default is 0.2
+        d_movern (float): the increment between the m/n values. Default is 0.1
+        n_movern (float): the number of m/n values analysed. Default is 7.
+
+    Author: SMM
+    """
+    def __init__(self, DataDirectory, fname_prefix, start_movern=0.2, d_movern=0.1, n_movern=7):
+
+        end_movern = start_movern+d_movern*(n_movern-1)
+        self.m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
+
+        # The first file sets the order of the rows
+        FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,self.m_over_n_values[0])
+        self.basin_keys = np.asarray(FirstDF['basin_key'])
+        self.test_source_keys = np.asarray(FirstDF['test_source_key'])
+        self.reference_source_keys = np.asarray(FirstDF['reference_source_key'])
+
+        n_rows = len(self.basin_keys)
+        self.MLE = np.empty((n_movern,n_rows))
+        self.RMSE = np.empty((n_movern,n_rows))
+        for i,m_over_n in enumerate(self.m_over_n_values):
+            if i == 0:
+                FullStatsDF = FirstDF
+            else:
+                FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,m_over_n)
+
+                # The files should all have the same rows. If they don't, line them up on the keys
+                if (len(FullStatsDF) != n_rows or
+                    not np.array_equal(np.asarray(FullStatsDF['basin_key']),self.basin_keys) or
+                    not np.array_equal(np.asarray(FullStatsDF['test_source_key']),self.test_source_keys)):
+                    print("The rows of the m/n = "+str(m_over_n)+" file don't match the first file, I am lining them up.")
+                    FullStatsDF = FullStatsDF.set_index(['basin_key','test_source_key'])
+                    FullStatsDF = FullStatsDF.reindex(list(zip(self.basin_keys,self.test_source_keys)))
+            self.MLE[i,:] = np.asarray(FullStatsDF['MLE'], dtype = float)
+            self.RMSE[i,:] = np.asarray(FullStatsDF['RMSE'], dtype = float)
+
+        # Group the tributaries by basin. The sort is stable so within each basin
+        # the tributaries keep the order of the files
+        self.basin_index = LSDP.lsdstatsutilities.GroupIndex(self.basin_keys)
+
+        # The files these came from (for the results cache), and the outlier
+        # analyses already done with them
+        self.fullstats_files = [DataDirectory+fname_prefix+'_movernstats_%s_fullstats.csv' % str(m_over_n)
+                                for m_over_n in self.m_over_n_values]
+        self.outlier_results = {}
+        self.log_MLEs_dict = {}
+
+    @classmethod
+    def FromArrays(cls, m_over_n_values, basin_keys, test_source_keys, reference_source_keys, MLE, RMSE):
+        """
+        Makes the object from arrays rather than the fullstats files, for example from SweepMOverN.
+
+        Args:
+            m_over_n_values (array): The m/n values
+            basin_keys, test_source_keys, reference_source_keys (arrays): The keys of each tributary
+            MLE, RMSE (arrays): The (m/n, tributary) MLE and RMSE values
+
+        Author: SMM
+        """
+        self = cls.__new__(cls)
+        self.m_over_n_values = np.asarray(m_over_n_values, dtype = float)
+        self.basin_keys = np.asarray(basin_keys)
+        self.test_source_keys = np.asarray(test_source_keys)
+        self.reference_source_keys = np.asarray(reference_source_keys)
+        self.MLE = np.asarray(MLE, dtype = float).reshape(len(self.m_over_n_values),-1)
+        self.RMSE = np.asarray(RMSE, dtype = float).reshape(len(self.m_over_n_values),-1)
+        self.basin_index = LSDP.lsdstatsutilities.GroupIndex(self.basin_keys)
+        self.fullstats_files = None
+        self.outlier_results = {}
+        self.log_MLEs_dict = {}
+        return self
+
+    def basin_list(self):
+        """Returns the list of basins in the files"""
+        return [int(i) for i in self.basin_index.key_list()]
+
+    def basin_rows(self, basin_number):
+        """Returns the rows of the tributaries of a basin, in file order"""
+        return self.basin_index.indices(basin_number)
+
+    def outlier_counts(self, basin_number, thresh=3.5):
+        """
+        This counts, for each tributary of a basin, the number of m/n values for
+        which it is an outlier. It uses the same MAD-based test as is_outlier, done
+        on all the m/n values at once.
+
+        Args:
+            basin_number (int): The basin you want
+            thresh (float): The modified z-score threshold
+
+        Returns:
+            An array with the outlier count of each tributary in the basin
+
+        Author: SMM
+        """
+        rows = self.basin_rows(basin_number)
+        RMSE = self.RMSE[:,rows]
+        MLE = self.MLE[:,rows]
+        if len(rows) == 0:
+            return np.zeros(0)
+
+        # modified z-score of each tributary, for every m/n at once
+        diff = np.abs(RMSE - np.median(RMSE,axis=1)[:,None])
+        med_abs_deviation = np.median(diff,axis=1)[:,None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            modified_z_score = np.where(med_abs_deviation == 0, 0, 0.6745*diff/med_abs_deviation)
+        outliers = modified_z_score > thresh
+
+        # if the max MLE is an outlier, flip the outlier vector
+        flip = outliers[np.arange(outliers.shape[0]),np.argmax(MLE,axis=1)]
+        outliers[flip,:] = ~outliers[flip,:]
+
+        return outliers.sum(axis=0).astype(float)
+
+    def all_outlier_counts(self, thresh=3.5):
+        """
+        This is outlier_counts for every tributary of every basin at once: the
+        tributaries are grouped by m/n value and basin and the outliers of all the
+        groups are found in one pass (see statsutilities.grouped_is_outlier).
+
+        Args:
+            thresh (float): The modified z-score threshold
+
+        Returns:
+            An array with the outlier count of each tributary (in the order of the files)
+
+        Author: SMM
+        """
+        n_movern, n_rows = self.RMSE.shape
+        movern_index = np.repeat(np.arange(n_movern), n_rows)
+        groups = LSDP.lsdstatsutilities.GroupIndex(movern_index, np.tile(self.basin_keys, n_movern))
+        outliers = LSDP.lsdstatsutilities.grouped_is_outlier(groups, self.RMSE.ravel(), thresh)
+
+        # if the max MLE of a group is an outlier, flip the outliers of the group.
+        # argmin of -MLE gives the first of tied maxima, like np.argmax
+        flip = outliers[groups.argmin(-self.MLE.ravel())]
+        outliers ^= groups.broadcast(flip)
+
+        return outliers.reshape(n_movern, n_rows).sum(axis=0).astype(float)
+
+    def removal_sequence(self, outlier_counter):
+        """
+        Gets the sequence of tributaries to remove from an outlier counter:
+        the tributaries with the most outlier counts go first, and tributaries with the
+        same count are removed together. Tributaries with zero counts are never removed.
+
+        Args:
+            outlier_counter (array): the outlier counts of the tributaries of a basin
+
+        Returns:
+            remove_list_index (list of lists): The indices (within the basin) of the tributaries removed at each step
+
+        Author: SMM
+        """
+        sort_index = np.argsort(outlier_counter)[::-1]
+        sorted_outliers = np.asarray(outlier_counter)[sort_index]
+
+        remove_list_index = []
+        last_count = -1
+        for idx,sorted_outlier_count in enumerate(sorted_outliers):
+            if sorted_outlier_count == 0:
+                break
+            if sorted_outlier_count != last_count:
+                remove_list_index.append([])
+            remove_list_index[-1].append(sort_index[idx])
+            last_count = sorted_outlier_count
+        return remove_list_index
+
+    def log_MLEs_with_removal(self, basin_number, remove_list_index):
+        """
+        Calculates the log of the total MLE of a basin for every m/n, first with all the tributaries
+        and then incrementally removing the tributaries in remove_list_index (a removed
+        tributary has an MLE of 1).
+
+        Args:
+            basin_number (int): The basin you want
+            remove_list_index (list of lists): The tributaries removed at each step
+
+        Returns:
+            An array (n_movern, n_steps+1) with the log MLEs. Column 0 has no tributaries removed.
+
+        Author: SMM
+        """
+        MLE = self.MLE[:,self.basin_rows(basin_number)]
+
+        # zero MLEs are counted separately so we don't get -inf minus -inf
+        is_zero = MLE <= 0
+        log_MLE = np.log(np.where(is_zero,1.0,MLE))
+
+        # the contribution of each removal step, then cumulatively removed
+        n_steps = len(remove_list_index)
+        step_log = np.zeros((MLE.shape[0],n_steps+1))
+        step_zeros = np.zeros((MLE.shape[0],n_steps+1))
+        step_log[:,0] = log_MLE.sum(axis=1)
+        step_zeros[:,0] = is_zero.sum(axis=1)
+        for step,these_tribs in enumerate(remove_list_index):
+            step_log[:,step+1] = -log_MLE[:,these_tribs].sum(axis=1)
+            step_zeros[:,step+1] = -is_zero[:,these_tribs].sum(axis=1)
+        log_MLEs = np.cumsum(step_log,axis=1)
+        log_MLEs[np.cumsum(step_zeros,axis=1) > 0] = -np.inf
+
+        return log_MLEs
+
+    def best_fit_movern(self, log_MLEs):
+        """
+        Gets the m/n values with the biggest MLE for each column of a log MLE array
+
+        Args:
+            log_MLEs (array): The (n_movern, n_steps) log MLE array from log_MLEs_with_removal
+
+        Returns:
+            The m/n values of the maximum MLE. These are rounded because linspace gives floating point errors
+
+        Author: SMM
+        """
+        return np.around(self.m_over_n_values[np.argmax(log_MLEs,0)],4)
+
+    def AnalyseBasins(self, basin_list=[]):
+        """
+        This does the outlier counting and the iterative removal of outlying tributaries
+        for a list of basins. See CheckMLEOutliers for the details of the analysis.
+
+        Args:
+            basin_list: a list of the basins to analyse. If an empty list is passed then
+            all the basins will be analysed.
+
+        Returns:
+            Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict, as in CheckMLEOutliers.
+            The log MLEs are also added to the dict self.log_MLEs_dict, since the MLEs of basins
+            with many tributaries can underflow to zero. The basins of earlier calls are kept.
+
+        Author: SMM
+        """
+        if basin_list == []:
+            basin_list = self.basin_list()
+
+        Outlier_counter = {}
+        best_fit_movern_dict = {}
+        removed_sources_dict = {}
+        MLEs_dict = {}
+        all_outlier_counts = self.all_outlier_counts()
+        for basin_number in basin_list:
+            Outlier_counter[basin_number] = all_outlier_counts[self.basin_rows(basin_number)]
+            remove_list_index = self.removal_sequence(Outlier_counter[basin_number])
+            log_MLEs = self.log_MLEs_with_removal(basin_number, remove_list_index)
+
+            best_fit_movern_dict[basin_number] = self.best_fit_movern(log_MLEs)
+            removed_sources_dict[basin_number] = remove_list_index
+            MLEs_dict[basin_number] = np.exp(log_MLEs)
+            self.log_MLEs_dict[basin_number] = log_MLEs
+
+        return Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict
+
+def _PackMLEResults(basin_list, Outlier_counter, removed_sources_dict, best_fit_movern_dict, log_MLEs_dict):
+    """
+    Packs the results of CheckMLEOutliers into flat arrays for the results cache.
+
+    Author: SMM
+    """
+    basin_list = list(basin_list)
+    arrays = {"basins": np.asarray(basin_list, dtype = np.int64)}
+    arrays["outlier_values"], arrays["outlier_offsets"] = RC.PackRaggedArrays([Outlier_counter[b] for b in basin_list])
+
+    # the removed sources are lists of steps, so the steps are packed and then the basins
+    steps = [step for b in basin_list for step in removed_sources_dict[b]]
+    arrays["removed_values"], arrays["removed_offsets"] = RC.PackRaggedArrays(steps)
+    arrays["removed_basin_offsets"] = np.cumsum([0]+[len(removed_sources_dict[b]) for b in basin_list])
+
+    arrays["best_fit_values"], arrays["best_fit_offsets"] = RC.PackRaggedArrays([best_fit_movern_dict[b] for b in basin_list])
+    arrays["log_MLE_values"], arrays["log_MLE_offsets"] = RC.PackRaggedArrays([log_MLEs_dict[b] for b in basin_list])
+    return arrays
+
+def _UnpackMLEResults(arrays):
+    """
+    Reverses _PackMLEResults, returning the dicts of CheckMLEOutliers and the dict of the log MLEs.
+
+    Author: SMM
+    """
+    basin_list = [int(b) for b in arrays["basins"]]
+    outliers = RC.UnpackRaggedArrays(arrays["outlier_values"], arrays["outlier_offsets"])
+    steps = RC.UnpackRaggedArrays(arrays["removed_values"], arrays["removed_offsets"])
+    best_fits = RC.UnpackRaggedArrays(arrays["best_fit_values"], arrays["best_fit_offsets"])
+    log_MLEs = RC.UnpackRaggedArrays(arrays["log_MLE_values"], arrays["log_MLE_offsets"])
+    basin_offsets = arrays["removed_basin_offsets"]
+
+    Outlier_counter = {}
+    removed_sources_dict = {}
+    best_fit_movern_dict = {}
+    MLEs_dict = {}
+    log_MLEs_dict = {}
+    for i,b in enumerate(basin_list):
+        Outlier_counter[b] = outliers[i]
+        removed_sources_dict[b] = [[int(idx) for idx in step] for step in steps[basin_offsets[i]:basin_offsets[i+1]]]
+        best_fit_movern_dict[b] = best_fits[i]
+        log_MLEs_dict[b] = log_MLEs[i]
+        MLEs_dict[b] = np.exp(log_MLEs[i])
+    return Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict, log_MLEs_dict
+
+def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7, FullStats=None, use_cache=False):
     """
     This function uses the fullstats files to search for outliers in the
     channels. It loops through m/n values and for each m/n value calculates which
@@ -156,6 +469,11 @@ def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0
         start_movern (float): the starting m/n value. Default is 0.2
         d_movern (float): the increment between the m/n values. Default is 0.1
         n_movern (float): the number of m/n values analysed. Default is 7.
+        FullStats (MOverNFullStats): The loaded fullstats files. If None, the files are loaded here.
+        Pass this in if you are going to use the same files more than once: the results are kept
+        in it, so each list of basins is only analysed once however many plots use it.
+        use_cache (bool): If True the results are also saved to (and later read from) a cache file in
+        the data directory, keyed by the contents of the fullstats files and the parameters.
 
     Returns:
         Outlier_counter (dict): This is a dictionary where the key is the basin
@@ -178,108 +496,49 @@ def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0
     Author: SMM
     """
 
-    # Get a vector of the m over n values
-    end_movern = start_movern+d_movern*(n_movern-1)
-    m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
-
-    # we open the first file just so that we can get a counter list
-    FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,m_over_n_values[0])
-
-    # get the number of basins
-    basin_keys = list(FirstDF['basin_key'])
-    basin_keys = [float(x) for x in basin_keys]
+    # See if we have already done this analysis, with these files
+    results_key = tuple(int(i) for i in basin_list)
+    if FullStats is not None and results_key in FullStats.outlier_results:
+        return FullStats.outlier_results[results_key]
+
+    cache_file = None
+    if use_cache:
+        if FullStats is None:
+            end_movern = start_movern+d_movern*(n_movern-1)
+            fullstats_files = [DataDirectory+fname_prefix+'_movernstats_%s_fullstats.csv' % str(m_over_n)
+                               for m_over_n in np.linspace(start_movern,end_movern,n_movern)]
+        else:
+            # the fullstats of SweepMOverN don't come from files, so they aren't cached on disk
+            fullstats_files = FullStats.fullstats_files
+        if fullstats_files is not None:
+            cache_key = RC.MakeCacheKey(RC.HashFiles(fullstats_files), start_movern=start_movern, d_movern=d_movern,
+                                        n_movern=n_movern, basin_list=list(results_key))
+            cache_file = RC.CacheFileName(DataDirectory, fname_prefix, "MLE_outliers", cache_key)
+            cached = RC.LoadCachedArrays(cache_file, cache_key)
+            if cached is not None:
+                print("I found the results of this analysis in "+cache_file)
+                results = _UnpackMLEResults(cached)
+                if FullStats is not None:
+                    FullStats.log_MLEs_dict.update(results[4])
+                    FullStats.outlier_results[results_key] = results[:4]
+                return results[:4]
+
+    # Load all the fullstats files, once
+    if FullStats is None:
+        FullStats = MOverNFullStats(DataDirectory, fname_prefix, start_movern, d_movern, n_movern)
 
     # get the list of basins
     if basin_list == []:
         print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-        basin_set = set(basin_list)
-        basin_list = list(basin_set)
-        basin_list = [int(i) for i in basin_list]
-
-    # make a data object that will hold the counters
-    Outlier_counter = {}
-    # loop through the basins
-    for basin in basin_list:
-        # mask the data so you only get the correct basin
-        FirstDF_basin = FirstDF[FirstDF['basin_key'] == basin]
-
-        trib_values = list(FirstDF_basin['test_source_key'])
-        n_nodes = len(trib_values)
-        # make the counter with zeros
-        this_counter = np.zeros(n_nodes)
-        Outlier_counter[basin] = this_counter
-
-    # Now we loop through all the files, calculating the outliers
-    for m_over_n in m_over_n_values:
-
-        #load the file
-        FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,m_over_n)
-
-        print("This_m_over_n is: "+str(m_over_n))
-
-        # loop through the basins
-        for basin in basin_list:
+        basin_list = FullStats.basin_list()
 
-            # mask the data so you only get the correct basin
-            FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin]
+    # Get the outlier counts and then calculate MLE by removing outliers
+    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = FullStats.AnalyseBasins(basin_list)
+    FullStats.outlier_results[results_key] = (Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict)
 
-            # extract the relevant data
-            MLE_values = list(FullStatsDF_basin['MLE'])
-            RMSE_values = list(FullStatsDF_basin['RMSE'])
-            trib_values = list(FullStatsDF_basin['test_source_key'])
-            print ('N values: '+str(len(MLE_values))+' '+str(len(RMSE_values))+' '+str(len(trib_values)))
-
-            # now get the outliers
-            MLE_array = np.asarray(MLE_values)
-            RMSE_array = np.asarray(RMSE_values)
-
-            # Get the outliers using the MAD-based outlier function
-            RMSE_outliers = LSDP.lsdstatsutilities.is_outlier(RMSE_array)
-            MLE_outliers = LSDP.lsdstatsutilities.is_outlier(RMSE_array)
-
-            # now check each of the outlier arrays to see if e need to flip the array
-            RMSE_index_min = np.argmin(RMSE_array)
-            #RMSE_min = np.min(RMSE_array)
-
-            # if the max MLE is an outlier, flip the outlier vector
-            if (RMSE_outliers[RMSE_index_min]):
-                RMSE_outliers = [not i for i in RMSE_outliers]
-
-            MLE_index_max = np.argmax(MLE_array)
-
-            # if the max MLE is an outlier, flip the outlier vector
-            if (MLE_outliers[MLE_index_max]):
-                MLE_outliers = [not i for i in MLE_outliers]
-
-            # turn the outliers vector into an integer
-            int_Outlier = [int(i) for i in MLE_outliers]
-            #print("Integer outliers are: ")
-            #print(int_Outlier)
-
-            # add this outlier counter to the outlier dict
-            Outlier_counter[basin] = Outlier_counter[basin]+int_Outlier
-
-    # Now try to calculate MLE by removing outliers
-
-    # Set up dicts where the keys are the basin numbers and the
-    # elements tell the m/n values of the best fit MLE, with each element
-    # representing incrementally removed tributaries
-    # The removed_sources_dict refers to the sources being removed each step
-    best_fit_movern_dict = {}
-    removed_sources_dict = {}
-    MLEs_dict = {}
-    for basin_number in basin_list:
-        remove_list_index,movern_of_max_MLE,MLEs = Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter,
-                                                                                DataDirectory,
-                                                                                fname_prefix,
-                                                                                basin_number,
-                                                                                start_movern,
-                                                                                d_movern,
-                                                                                n_movern)
-        best_fit_movern_dict[basin_number] = movern_of_max_MLE
-        removed_sources_dict[basin_number] = remove_list_index
-        MLEs_dict[basin_number] = MLEs
+    if cache_file is not None:
+        RC.SaveCachedArrays(cache_file, cache_key, _PackMLEResults(basin_list, Outlier_counter, removed_sources_dict,
+                                                                   best_fit_movern_dict, FullStats.log_MLEs_dict))
 
     print("Here are the vitalstatisix, chief: ")
     print(best_fit_movern_dict)
@@ -504,13 +763,481 @@ def RecalculateTotalMLEWithRemoveList(DataDirectory, fname_prefix,
 
     return MLE_vals
 
+def _GetNodeColumn(NodeDF, names):
+    """Returns the first of the column names that is in the node data frame as a float array"""
+    for name in names:
+        if name in NodeDF.columns:
+            return np.asarray(NodeDF[name], dtype = float)
+    raise KeyError("I can't find any of the columns "+str(names)+" in the node file.")
+
+def GetChannelReceivers(NodeDF):
+    """
+    This works out the receiver of every node in a channel network file such as the
+    _chi_data_map.csv, which doesn't have the flow routing. Within each source channel the receiver
+    of a node is the next node downstream. The bottom node of each channel drains to the nearest
+    node in the same basin that is on another channel and has a smaller flow distance. The lowest
+    node of each basin (the bottom of its trunk channel) is its own receiver.
+
+    If the file has "node" and "receiver_node" columns these are used instead.
+
+    Args:
+        NodeDF (pandas dataframe): The nodes, with basin_key, source_key, flow distance and
+        latitude and longitude (or x and y) columns
+
+    Returns:
+        receivers (int array): The index (row in NodeDF) of the receiver of each node
+        dx (float array): The flow distance from each node to its receiver
+
+    Author: SMM
+    """
+    flow_distance = _GetNodeColumn(NodeDF, ["flow_distance","flow distance"])
+    n_nodes = len(flow_distance)
+
+    if "node" in NodeDF.columns and "receiver_node" in NodeDF.columns:
+        node_index = pd.Series(np.arange(n_nodes), index = np.asarray(NodeDF["node"]))
+        receivers = node_index.reindex(np.asarray(NodeDF["receiver_node"])).values
+        # receivers that aren't in the file are treated as outlets
+        missing = np.isnan(receivers)
+        receivers[missing] = np.arange(n_nodes)[missing]
+        receivers = receivers.astype(int)
+        return receivers, flow_distance-flow_distance[receivers]
+
+    source = np.asarray(NodeDF["source_key"])
+    basin = np.asarray(NodeDF["basin_key"])
+
+    # sort by channel and then by flow distance, so each channel runs from its bottom node up
+    order = np.lexsort((flow_distance, source))
+    is_bottom = np.ones(n_nodes, dtype = bool)
+    is_bottom[1:] = source[order][1:] != source[order][:-1]
+
+    receivers = np.arange(n_nodes)
+    receivers[order[~is_bottom]] = order[np.nonzero(~is_bottom)[0]-1]
+
+    # now connect the bottom of each channel to the channel it drains into
+    if "latitude" in NodeDF.columns and "longitude" in NodeDF.columns:
+        latitude = np.asarray(NodeDF["latitude"], dtype = float)
+        x = np.asarray(NodeDF["longitude"], dtype = float)*np.cos(np.radians(np.mean(latitude)))
+        y = latitude
+    else:
+        x = _GetNodeColumn(NodeDF, ["x","easting"])
+        y = _GetNodeColumn(NodeDF, ["y","northing"])
+
+    from scipy.spatial import cKDTree
+    tree = cKDTree(np.column_stack((x,y)))
+
+    # the lowest node of each basin is its outlet, and is its own receiver
+    basins = LSDP.lsdstatsutilities.GroupIndex(basin)
+    is_outlet = np.zeros(n_nodes, dtype = bool)
+    is_outlet[basins.argmin(flow_distance)] = True
+    bottoms = order[is_bottom]
+    unconnected = bottoms[~is_outlet[bottoms]]
+
+    # look among the nearest k nodes, then a few more, up to max_k
+    max_k = min(512, n_nodes)
+    k = min(8, max_k)
+    while len(unconnected) > 0:
+        distances, neighbours = tree.query(np.column_stack((x[unconnected],y[unconnected])), k = k)
+        neighbours = neighbours.reshape(len(unconnected),-1)
+        # the candidates have to be downstream, on another channel in the same basin
+        candidates = ((basin[neighbours] == basin[unconnected][:,None]) &
+                      (source[neighbours] != source[unconnected][:,None]) &
+                      (flow_distance[neighbours] < flow_distance[unconnected][:,None]))
+        found = candidates.any(axis = 1)
+        first = np.argmax(candidates, axis = 1)
+        receivers[unconnected[found]] = neighbours[np.nonzero(found)[0],first[found]]
+        unconnected = unconnected[~found]
+        if k == max_k:
+            break
+        k = min(k*4, max_k)
+
+    # the few channels that are still unconnected are searched for in their own basin
+    for node in unconnected:
+        basin_nodes = basins.indices(basin[node])
+        basin_nodes = basin_nodes[(source[basin_nodes] != source[node]) &
+                                  (flow_distance[basin_nodes] < flow_distance[node])]
+        if len(basin_nodes) > 0:
+            squared_distance = (x[basin_nodes]-x[node])**2 + (y[basin_nodes]-y[node])**2
+            receivers[node] = basin_nodes[np.argmin(squared_distance)]
+
+    return receivers, flow_distance-flow_distance[receivers]
+
+def IntegrateChiForMOverNs(NodeDF, m_over_n_values, A_0 = 1, receivers = None, dx = None):
+    """
+    This integrates chi over the channel network for several m/n values at once, so you can
+    sweep m/n without rerunning the chi mapping tool. Chi is zero at the outlet of each basin and
+    increases upstream by dx*(A_0/A)^(m/n) at each node.
+
+    The integral within each channel is a cumulative sum over the nodes sorted by flow distance. Each
+    channel is then offset by the chi of the node it drains into, working up from the trunk channels.
+
+    Args:
+        NodeDF (pandas dataframe): The nodes, i.e. from ReadChiDataMapCSV. It needs basin_key, source_key, flow distance,
+        drainage area and coordinate columns (see GetChannelReceivers).
+        m_over_n_values (array): The m/n values
+        A_0 (float): The reference drainage area
+        receivers, dx (arrays): The receivers and flow distance to the receivers from GetChannelReceivers.
+        These are calculated if they are not given.
+
+    Returns:
+        An array (n_movern, n_nodes) with the chi values
+
+    Author: SMM
+    """
+    if receivers is None or dx is None:
+        receivers, dx = GetChannelReceivers(NodeDF)
+    drainage_area = _GetNodeColumn(NodeDF, ["drainage_area","drainage area"])
+    flow_distance = _GetNodeColumn(NodeDF, ["flow_distance","flow distance"])
+    source = np.asarray(NodeDF["source_key"])
+    m_over_n_values = np.asarray(m_over_n_values, dtype = float)
+
+    # the chi increment of every node for all the m/n values
+    increments = dx[None,:]*np.power(A_0/drainage_area[None,:], m_over_n_values[:,None])
+
+    # the cumulative sum within each channel, from its bottom node up
+    channels = LSDP.lsdstatsutilities.GroupIndex(source)
+    order = channels.order_within(flow_distance)
+    cumulative = np.cumsum(increments[:,order], axis = 1)
+    channel_start = cumulative[:,channels.starts]-increments[:,order[channels.starts]]
+    within = np.empty_like(increments)
+    within[:,order] = cumulative-np.repeat(channel_start, channels.sizes, axis = 1)
+
+    # offset each channel by the chi of the node it drains into. The channel a channel
+    # drains into always has a lower bottom node so we go through them in that order
+    bottoms = order[channels.starts]
+    base = np.zeros((len(m_over_n_values),channels.n_groups))
+    group_of_node = channels.group_ids
+    for g in np.argsort(flow_distance[bottoms], kind = "mergesort"):
+        receiver = receivers[bottoms[g]]
+        if receiver != bottoms[g]:
+            base[:,g] = base[:,group_of_node[receiver]]+within[:,receiver]
+
+    return within+base[:,group_of_node]
+
+def CalculateCollinearityMLE(NodeDF, chi, m_over_n_values, sigma = 1000):
+    """
+    This calculates the collinearity MLE and RMSE of every tributary against the trunk channel of
+    its basin for each m/n, from chi values calculated with IntegrateChiForMOverNs. The trunk elevation
+    is interpolated at the chi of each tributary node and the residuals give
+    MLE = exp(-sum(residuals^2)/(2 sigma^2)). Tributary nodes outside the chi range of the trunk are not used,
+    and tributaries with no nodes in the trunk range are left out.
+
+    Args:
+        NodeDF (pandas dataframe): The nodes, with basin_key, source_key, elevation and flow distance columns
+        chi (array): The (n_movern, n_nodes) chi values
+        m_over_n_values (array): The m/n values
+        sigma (float): The sigma of the MLE, which should be the same as collinearity_MLE_sigma in the chi mapping tool
+
+    Returns:
+        A MOverNFullStats object with the MLE and RMSE of every tributary, which can be passed to CheckMLEOutliers
+
+    Author: SMM
+    """
+    elevation = np.asarray(NodeDF["elevation"], dtype = float)
+    flow_distance = _GetNodeColumn(NodeDF, ["flow_distance","flow distance"])
+    source = np.asarray(NodeDF["source_key"])
+    basins = LSDP.lsdstatsutilities.GroupIndex(np.asarray(NodeDF["basin_key"]))
+    n_movern = len(m_over_n_values)
+
+    basin_keys = []
+    test_source_keys = []
+    reference_source_keys = []
+    MLEs = []
+    RMSEs = []
+    for basin_key in basins.key_list():
+        rows = basins.indices(basin_key)
+
+        # the trunk is the channel with the basin outlet
+        reference_source = source[rows[np.argmin(flow_distance[rows])]]
+        is_trunk = source[rows] == reference_source
+        trunk_rows = rows[is_trunk]
+        trib_rows = rows[~is_trunk]
+        if len(trib_rows) == 0:
+            continue
+        tribs = LSDP.lsdstatsutilities.GroupIndex(source[trib_rows])
+
+        sum_squares = np.zeros((n_movern,tribs.n_groups))
+        n_used = np.zeros((n_movern,tribs.n_groups))
+        for i in range(n_movern):
+            trunk_chi = chi[i,trunk_rows]
+            trunk_order = np.argsort(trunk_chi)
+            trib_chi = chi[i,trib_rows]
+            in_range = (trib_chi >= trunk_chi[trunk_order[0]]) & (trib_chi <= trunk_chi[trunk_order[-1]])
+            residuals = elevation[trib_rows]-np.interp(trib_chi,trunk_chi[trunk_order],elevation[trunk_rows][trunk_order])
+            sum_squares[i,:] = tribs.sum(np.where(in_range,residuals*residuals,0))
+            n_used[i,:] = tribs.sum(in_range.astype(float))
+
+        keep = np.all(n_used > 0, axis = 0)
+        basin_keys.extend([basin_key]*int(keep.sum()))
+        test_source_keys.extend(list(tribs.keys[0][keep]))
+        reference_source_keys.extend([reference_source]*int(keep.sum()))
+        MLEs.append(np.exp(-0.5*sum_squares[:,keep]/(sigma*sigma)))
+        RMSEs.append(np.sqrt(sum_squares[:,keep]/n_used[:,keep]))
+
+    if len(MLEs) == 0:
+        MLEs = [np.zeros((n_movern,0))]
+        RMSEs = [np.zeros((n_movern,0))]
+    return MOverNFullStats.FromArrays(m_over_n_values, basin_keys, test_source_keys, reference_source_keys,
+                                      np.hstack(MLEs), np.hstack(RMSEs))
+
+def SweepMOverN(DataDirectory, fname_prefix, m_over_n_values, A_0 = 1, sigma = 1000):
+    """
+    This calculates the collinearity statistics for a list of m/n values from the _chi_data_map.csv file,
+    without running the chi mapping tool for each m/n. The result can be used in place of the fullstats files,
+    for example CheckMLEOutliers(DataDirectory, fname_prefix, [], FullStats=SweepMOverN(...)).
+
+    Args:
+        DataDirectory (str): the data directory with the csv files
+        fname_prefix (str): The prefix for the csv files
+        m_over_n_values (array): The m/n values, i.e. np.arange(0.1,0.95,0.05)
+        A_0 (float): The reference drainage area
+        sigma (float): The sigma of the MLE
+
+    Returns:
+        A MOverNFullStats object
+
+    Author: SMM
+    """
+    NodeDF = Helper.ReadChiDataMapCSV(DataDirectory, fname_prefix)
+    receivers, dx = GetChannelReceivers(NodeDF)
+    chi = IntegrateChiForMOverNs(NodeDF, m_over_n_values, A_0, receivers, dx)
+    return CalculateCollinearityMLE(NodeDF, chi, m_over_n_values, sigma)
+
+#=============================================================================
+#=============================================================================
+# BASIN SCHEDULER
+# These functions farm out the per-basin analysis and plotting to a pool of
+# processes. The data shared by all the basins is sent to each process once.
+#=============================================================================
+_basin_shared_data = {}
+
+class _MemmappedArray(object):
+    """A placeholder for an array that has been saved to disk so workers can memory map it"""
+    def __init__(self, filename):
+        self.filename = filename
+
+class _MemmappedDataFrame(object):
+    """A placeholder for a dataframe whose numeric columns have been saved to disk"""
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+def _SaveSharedValue(value, temp_directory, name, depth=0):
+    """
+    Saves the numpy arrays of a value of the shared data to temp_directory and returns
+    the value with placeholders for them: the value itself if it is an array, the numeric
+    columns of a dataframe, or the array attributes of an object (i.e. MOverNFullStats,
+    and the GroupIndex in it).
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return value
+        filename = os.path.join(temp_directory, name+".npy")
+        np.save(filename, value)
+        return _MemmappedArray(filename)
+    if isinstance(value, pd.DataFrame):
+        columns = [(column, _SaveSharedValue(np.asarray(value[column]), temp_directory, name+"_"+str(i)))
+                   for i, column in enumerate(value.columns)]
+        return _MemmappedDataFrame(columns, value.index)
+    if depth < 2 and hasattr(value, "__dict__") and not isinstance(value, type):
+        import copy
+        value = copy.copy(value)
+        for attribute, attribute_value in list(vars(value).items()):
+            setattr(value, attribute, _SaveSharedValue(attribute_value, temp_directory,
+                                                       name+"_"+attribute, depth+1))
+    return value
+
+def _OpenSharedValue(value, depth=0):
+    """Reverses _SaveSharedValue, opening the saved arrays as read only memory maps"""
+    if isinstance(value, _MemmappedArray):
+        return np.load(value.filename, mmap_mode='r')
+    if isinstance(value, _MemmappedDataFrame):
+        return pd.DataFrame(dict((column, _OpenSharedValue(data)) for column, data in value.columns),
+                            index=value.index, columns=[column for column, data in value.columns], copy=False)
+    if depth < 2 and hasattr(value, "__dict__") and not isinstance(value, type):
+        for attribute, attribute_value in list(vars(value).items()):
+            setattr(value, attribute, _OpenSharedValue(attribute_value, depth+1))
+    return value
+
+def _InitBasinWorker(shared_data):
+    """
+    This is run once in each worker process. It keeps the shared data in a
+    module level dict and opens any arrays that have been saved to disk as read only memory maps.
+
+    Author: SMM
+    """
+    global _basin_shared_data
+    _basin_shared_data = {}
+    for key in shared_data:
+        _basin_shared_data[key] = _OpenSharedValue(shared_data[key])
+
+def _RunBasinWorker(basin_worker, basin_key):
+    """Calls the basin worker with the shared data of this process"""
+    return basin_worker(basin_key, _basin_shared_data)
+
+def RunBasinJobs(basin_worker, basin_list, shared_data, n_processes=1):
+    """
+    This runs a function for every basin in a list, splitting the basins over
+    a pool of processes. The shared data is given to each process once (rather than with every basin):
+    if the processes are forked it is simply inherited, otherwise (i.e. the spawn start method
+    of Windows and macOS) the numpy arrays in it, the numeric columns of its dataframes and
+    the array attributes of its objects (i.e. the MLE and RMSE of MOverNFullStats) are saved
+    to a temporary directory and memory mapped by the workers.
+
+    Args:
+        basin_worker (function): A module level function called as basin_worker(basin_key, shared_data)
+        basin_list (list): The basins to run
+        shared_data (dict): The read only data used by all the basins
+        n_processes (int): The number of processes. If 1 the basins are run in this process. If 0 or None all the cores are used.
+
+    Returns:
+        A list with the result for each basin, in the order of basin_list
+
+    Author: SMM
+    """
+    import multiprocessing
+    from functools import partial
+
+    basin_list = list(basin_list)
+    if not n_processes:
+        n_processes = multiprocessing.cpu_count()
+    n_processes = min(n_processes, len(basin_list))
+
+    if n_processes <= 1:
+        return [basin_worker(basin_key, shared_data) for basin_key in basin_list]
+
+    if hasattr(multiprocessing, "get_start_method"):
+        forked = multiprocessing.get_start_method() == "fork"
+    else:
+        # python 2 forks wherever it can
+        forked = hasattr(os, "fork")
+
+    temp_directory = None
+    if not forked:
+        # the workers won't inherit our memory, so save the arrays for memory mapping
+        import tempfile
+        temp_directory = tempfile.mkdtemp(prefix="basin_jobs_")
+        shared_data = dict((key, _SaveSharedValue(value, temp_directory, str(key)))
+                           for key, value in shared_data.items())
+
+    # Give each process a few chunks of basins so slow basins even out
+    chunksize = max(1, len(basin_list)//(n_processes*4))
+    pool = multiprocessing.Pool(n_processes, initializer=_InitBasinWorker, initargs=(shared_data,))
+    try:
+        # map keeps the results in the order of the basin list
+        results = pool.map(partial(_RunBasinWorker, basin_worker), basin_list, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+        if temp_directory is not None:
+            import shutil
+            shutil.rmtree(temp_directory, ignore_errors=True)
+
+    return results
+
+def _FormatMOverNAxes(ax):
+    """Sets the spines and labels of a chi-elevation plot"""
+    ax.spines['top'].set_linewidth(1)
+    ax.spines['left'].set_linewidth(1)
+    ax.spines['right'].set_linewidth(1)
+    ax.spines['bottom'].set_linewidth(1)
+
+    # make the lables
+    ax.set_xlabel("$\chi$ (m)")
+    ax.set_ylabel("Elevation (m)")
+
+def _MOverNFigure(size_format, label_size=10):
+    """Makes the figure used by the m/n plots. Called inside the workers so each process sets its own fonts."""
+    rcParams['font.family'] = 'sans-serif'
+    rcParams['font.sans-serif'] = ['arial']
+    rcParams['font.size'] = label_size
+
+    if size_format == "geomorphology":
+        fig = plt.figure(facecolor='white',figsize=(6.25,3.5))
+    elif size_format == "big":
+        fig = plt.figure(facecolor='white',figsize=(16,9))
+    else:
+        fig = plt.figure(facecolor='white',figsize=(4.92126,3.2))
+    return fig
+
+def _PadTicks(ax):
+    """This gets all the ticks, and pads them away from the axis so that the corners don't overlap"""
+    ax.tick_params(axis='both', width=1, pad = 2)
+    for tick in ax.xaxis.get_major_ticks():
+        tick.set_pad(2)
+
 #=============================================================================
 # PLOTTING FUNCTIONS
 # Make plots of the m/n analysis
 #=============================================================================
 
+def _PlotMLEStatsForBasin(basin_key, shared_data):
+    """
+    Makes the chi-elevation plots of one basin for every m/n value. This is the
+    basin worker of MakePlotsWithMLEStats.
+
+    Author: SMM, modified by FJC
+    """
+    DataDirectory = shared_data["DataDirectory"]
+    m_over_n_values = shared_data["m_over_n_values"]
+    max_MLEs_index = shared_data["max_MLEs_index"]
+
+    # the nodes of this basin
+    rows = shared_data["basin_index"].indices(basin_key)
+    Elevation = np.asarray(shared_data["Elevation"][rows])
+
+    fig = _MOverNFigure(shared_data["size_format"], label_size=12)
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
+    ax = fig.add_subplot(gs[5:100,10:95])
+
+    filenames = []
+    for idx,mn in enumerate(m_over_n_values):
+        counter = str(idx).zfill(3)
+
+        MLE = shared_data["MLE"][idx][basin_key]
+        short_MLE = str(round(MLE,3))
+        print("The short MLE is: "+short_MLE)
+
+        # the chi value of this basin
+        X = np.asarray(shared_data["Chi"][idx,rows])
+
+        # now plot the data with a colourmap
+        ax.scatter(X,Elevation,s=2.5, c=Elevation,cmap="terrain",edgecolors='none')
+
+        # some formatting of the figure
+        _FormatMOverNAxes(ax)
+
+        title_string = "Basin "+str(basin_key)+", $m/n$ = "+str(mn)
+        title_string2 = "MLE = "+short_MLE
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='black', fontsize=10)
+        print("The basin index is: "+str(basin_key)+" and the max index is: "+str(max_MLEs_index[basin_key]))
+        if( idx == max_MLEs_index[basin_key]):
+            print("This m/n is: "+str(mn)+" and it is the maximum MLE")
+            ax.text(0.05, 0.88, title_string2+", maximum MLE in basin.",
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='red', fontsize=10)
+        else:
+            ax.text(0.05, 0.88, title_string2,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='black', fontsize=10)
+
+        #save the plot
+        newFilename = DataDirectory+"Chi_profiles_basin_"+str(basin_key)+"_"+counter+".png"
+        _PadTicks(ax)
+
+        fig.savefig(newFilename,format="png",dpi=300)
+        filenames.append(newFilename)
+        ax.cla()
+
+    plt.close(fig)
+    return filenames
+
 def MakePlotsWithMLEStats(DataDirectory, fname_prefix, basin_list = [0],
-                  start_movern = 0.2, d_movern = 0.1, n_movern = 7):
+                  start_movern = 0.2, d_movern = 0.1, n_movern = 7, n_processes = 1):
     """
     This function makes a chi-elevation plot for each basin and each value of
     m/n and prints the MLE value between the tributaries and the main stem.
@@ -526,9 +1253,10 @@ def MakePlotsWithMLEStats(DataDirectory, fname_prefix, basin_list = [0],
         start_movern (float): the starting m/n value. Default is 0.2
         d_movern (float): the increment between the m/n values. Default is 0.1
         n_movern (float): the number of m/n values analysed. Default is 7.
+        n_processes (int): The number of processes used to make the basin plots. 0 uses all the cores. Default is 1.
 
     Returns:
-        Plot of each m/n value for each basin.
+        Plot of each m/n value for each basin. The list of the figure names is returned in basin order.
 
     Author: SMM, modified by FJC
     """
@@ -566,27 +1294,6 @@ def MakePlotsWithMLEStats(DataDirectory, fname_prefix, basin_list = [0],
 
     n_basins = len(max_MLEs)
 
-    label_size = 12
-
-    # Set up fonts for plots
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['arial']
-    rcParams['font.size'] = label_size
-    size_format = "default"
-    # make a figure,
-    if size_format == "geomorphology":
-        fig = plt.figure(1, facecolor='white',figsize=(6.25,3.5))
-        #l_pad = -40
-    elif size_format == "big":
-        fig = plt.figure(1, facecolor='white',figsize=(16,9))
-        #l_pad = -50
-    else:
-        fig = plt.figure(1, facecolor='white',figsize=(4.92126,3.2))
-        #l_pad = -35
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
-    ax = fig.add_subplot(gs[5:100,10:95])
-
     # load the m_over_n data file
     thisPointData = LSDP.LSDMap_PointData(DataDirectory+movern_profile_file)
     allBasinStatsData = LSDP.LSDMap_PointData(DataDirectory+movern_basin_stats_file)
@@ -606,131 +1313,122 @@ def MakePlotsWithMLEStats(DataDirectory, fname_prefix, basin_list = [0],
     elevation = [float(x) for x in elevation]
     basin = thisPointData.QueryData('basin_key')
     basin = [int(x) for x in basin]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
-
-    # get the basin keys
-    allstats_basinkeys = allBasinStatsData.QueryData("basin_key")
-    allstats_basinkeys = [int(x) for x in allstats_basinkeys]
 
-    # need to convert everything into arrays so we can mask different basins
+    # need to convert everything into arrays so we can get the nodes of different basins
     Elevation = np.asarray(elevation)
     Basin = np.asarray(basin)
-    #Source = np.asarray(source)
 
-    # Loop through m/n values aggregating data
-    for idx,mn in enumerate(m_over_n_values):
+    # get the chi values and MLEs of all the m/n values, one row per m/n
+    Chi = np.asarray([thisPointData.QueryData(mn_legend) for mn_legend in mn_legends], dtype=float)
+    MLE = [allBasinStatsData.QueryData(mn_legend) for mn_legend in mn_legends]
 
-        counter = str(idx).zfill(3)
-        print("Counter is: "+counter)
-        # first get the chi values for this m_over_n
-        #print ("mn is: " + str(mn))
-        #print("index is: "+str(idx))
-        mn_legend = "m_over_n = "+str(mn)
-        #print("I am looking for the data element: "+mn_legend)
-        this_chi = thisPointData.QueryData(mn_legend)
-
-        # get the MLE value for this m/n
-        this_MLE = allBasinStatsData.QueryData(mn_legend)
-
-        # convert to a numpy array for masking
-        Chi = np.asarray(this_chi)
-
-        # some info about the chi and elevation values
-        #max_chi = np.amax(Chi)
-        #max_Elevation = np.amax(Elevation)
-        #min_Elevation = np.amin(Elevation)
-
-        #z_axis_min = int(min_Elevation/10)*10
-        #z_axis_max = int(max_Elevation/10)*10+10
-        #chi_axis_max = int(max_chi/5)*5+5
-
-        # Now mask the data. Initially we will do only basin 0
-        if basin_list == []:
-            print("You didn't give me any basins so I assume you want all of them.")
-            basin_list = range(0,n_basins-1)
-
-        for basin_key in basin_list:
-            # now we need to find out if this basin is in the allstats file,
-            # and if so what index it is
-            #this_basin_index = -99
-            #for ii,bk in enumerate(allstats_basinkeys):
-            #    #print("index: "+str(ii)+" and basin_key is: "+str(bk))
-            #    if (bk == basin_key):
-            #        this_basin_index = idx
-
-            #if(this_basin_index != -99):
-            #    MLE = this_MLE[this_basin_index]
-            #else:
-            #    MLE = "NaN"
-            MLE = this_MLE[basin_key]
-            #MLE_str = str(MLE)
-            #short_MLE = str("%03.02e" % round(MLE,2))
-            short_MLE = str(round(MLE,3))
-            print("The short MLE is: "+short_MLE)
-
-            #print("The MLE of this basin for this m over n is: "+short_MLE)
-
-            # this gets the mask (for the chosen basin)
-            m = np.ma.masked_where(Basin!=basin_key, Basin)
-
-            # this is the masked chi value
-            maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-            maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-
-            # now plot the data with a colourmap
-            ax.scatter(maskX,maskElevation,s=2.5, c=maskElevation,cmap="terrain",edgecolors='none')
-
-            # some formatting of the figure
-            ax.spines['top'].set_linewidth(1)
-            ax.spines['left'].set_linewidth(1)
-            ax.spines['right'].set_linewidth(1)
-            ax.spines['bottom'].set_linewidth(1)
-
-            # make the lables
-            ax.set_xlabel("$\chi$ (m)")
-            ax.set_ylabel("Elevation (m)")
-
-            # This affects all axes because we set share_all = True.
-            #ax.set_ylim(z_axis_min,z_axis_max)
-            #ax.set_ylim(z_axis_min,z_axis_max)
-            #ax.set_xlim(0,chi_axis_max)
-            #plt.title("Basin = " +mn_legend+", MLE = "+short_MLE)
-
-            #newline = "\n"
-            title_string = "Basin "+str(basin_key)+", $m/n$ = "+str(mn)
-            title_string2 = "MLE = "+short_MLE
-            ax.text(0.05, 0.95, title_string,
-                    verticalalignment='top', horizontalalignment='left',
-                    transform=ax.transAxes,
-                    color='black', fontsize=10)
-            print("The basin index is: "+str(basin_key)+" and the max index is: "+str(max_MLEs_index[basin_key]))
-            if( idx == max_MLEs_index[basin_key]):
-                print("This m/n is: "+str(mn)+" and it is the maximum MLE")
-                ax.text(0.05, 0.88, title_string2+", maximum MLE in basin.",
-                    verticalalignment='top', horizontalalignment='left',
-                    transform=ax.transAxes,
-                    color='red', fontsize=10)
-            else:
-                ax.text(0.05, 0.88, title_string2,
-                    verticalalignment='top', horizontalalignment='left',
-                    transform=ax.transAxes,
-                    color='black', fontsize=10)
+    if basin_list == []:
+        print("You didn't give me any basins so I assume you want all of them.")
+        basin_list = range(0,n_basins-1)
+
+    shared_data = {"DataDirectory": DataDirectory,
+                   "m_over_n_values": m_over_n_values,
+                   "max_MLEs_index": max_MLEs_index,
+                   "basin_index": LSDP.lsdstatsutilities.GroupIndex(Basin),
+                   "Elevation": Elevation,
+                   "Chi": Chi,
+                   "MLE": MLE,
+                   "size_format": "default"}
+    filenames = RunBasinJobs(_PlotMLEStatsForBasin, basin_list, shared_data, n_processes)
+
+    return [fname for basin_filenames in filenames for fname in basin_filenames]
+
+def _PlotChiMLEForBasin(basin_key, shared_data):
+    """
+    Makes the chi-elevation plots of one basin for every m/n value, with the tributaries
+    coloured by MLE. This is the basin worker of MakeChiPlotsMLE.
+
+    Author: FJC
+    """
+    DataDirectory = shared_data["DataDirectory"]
+    FigFormat = shared_data["FigFormat"]
+    FullStats = shared_data["FullStats"]
+    print("This basin key is "+str(basin_key))
+
+    # get the tributaries of this basin from the full stats
+    rows = FullStats.basin_rows(basin_key)
+    if len(rows) == 0:
+        print("Basin "+str(basin_key)+" isn't in the full stats files, skipping it.")
+        return []
+    reference_source_key = FullStats.reference_source_keys[rows[0]]
+
+    # mask the profile data frame for this basin
+    ProfileDF = shared_data["ProfileDF"]
+    ProfileDF_basin = ProfileDF.iloc[shared_data["profile_basin_index"].indices(basin_key)]
+
+    # get the data frame for the main stem
+    ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == reference_source_key]
+
+    # get the data frame for the tributaries
+    ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != reference_source_key]
+
+    fig = _MOverNFigure(shared_data["size_format"])
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
+    ax = fig.add_subplot(gs[10:95,5:80])
+    #colorbar axis
+    ax2 = fig.add_subplot(gs[10:95,82:85])
+
+    filenames = []
+    for i,m_over_n in enumerate(shared_data["m_over_n_values"]):
+        # merge with the full data to get the MLE for the tributaries
+        FullStatsDF_basin = pd.DataFrame({"test_source_key": FullStats.test_source_keys[rows],
+                                          "MLE": FullStats.MLE[i,rows]})
+        ProfileDF_tribs = ProfileDF_basin.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+
+        # get the chi and elevation data for the main stem
+        movern_key = 'm_over_n = %s' %(str(m_over_n))
+        MainStemX = list(ProfileDF_MS[movern_key])
+        MainStemElevation = list(ProfileDF_MS['elevation'])
+
+        # get the chi, elevation, and MLE for the tributaries
+        TributariesX = list(ProfileDF_tribs[movern_key])
+        TributariesElevation = list(ProfileDF_tribs['elevation'])
+        TributariesMLE = list(ProfileDF_tribs['MLE'])
 
-            #save the plot
-            newFilename = DataDirectory+"Chi_profiles_basin_"+str(basin_key)+"_"+counter+".png"
+        # get the colourmap to colour channels by the MLE value
+        MLE_array = np.asarray(TributariesMLE)
+        this_cmap = plt.cm.Reds
+        cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
 
-            # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-            ax.tick_params(axis='both', width=1, pad = 2)
-            for tick in ax.xaxis.get_major_ticks():
-                tick.set_pad(2)
+        # now plot the data with a colourmap
+        sc = ax.scatter(TributariesX,TributariesElevation,c=TributariesMLE,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
+        ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
 
-            FigFormat = "png"
-            plt.savefig(newFilename,format=FigFormat,dpi=300)
-            ax.cla()
+        # some formatting of the figure
+        _FormatMOverNAxes(ax)
+
+        # label with the basin and m/n
+        title_string = "Basin "+str(basin_key)+", $m/n$ = "+str(m_over_n)
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='black', fontsize=10)
+
+        # add the colorbar
+        colorbarlabel = "$MLE$"
+        cbar = fig.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
+        cbar.set_label(colorbarlabel, fontsize=10)
+        ax2.set_ylabel(colorbarlabel, fontname='Arial', fontsize=10)
+
+        #save the plot
+        newFilename = DataDirectory+"MLE_profiles"+str(basin_key)+"_"+str(m_over_n)+".png"
+        _PadTicks(ax)
+
+        fig.savefig(newFilename,format=FigFormat,dpi=300)
+        filenames.append(newFilename)
+        ax.cla()
+        ax2.cla()
+
+    plt.close(fig)
+    return filenames
 
 def MakeChiPlotsMLE(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7,
-                    size_format='ESURF', FigFormat='png'):
+                    size_format='ESURF', FigFormat='png', n_processes=1, FullStats=None):
     """
     This function makes chi-elevation plots for each basin and each value of m/n
     where the channels are coloured by the MLE value compared to the main stem.
@@ -746,37 +1444,19 @@ def MakeChiPlotsMLE(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.
         n_movern (float): the number of m/n values analysed. Default is 7.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
+        n_processes (int): The number of processes used to make the basin plots. 0 uses all the cores. Default is 1.
+        FullStats (MOverNFullStats): The loaded fullstats files. If None, the files are loaded here.
 
     Returns:
-        Plot of each m/n value for each basin.
+        Plot of each m/n value for each basin. The list of the figure names is returned in basin order.
 
     Author: FJC
     """
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['arial']
-    rcParams['font.size'] = label_size
-
-    # make a figure
-    if size_format == "geomorphology":
-        fig = plt.figure(1, facecolor='white',figsize=(6.25,3.5))
-        #l_pad = -40
-    elif size_format == "big":
-        fig = plt.figure(1, facecolor='white',figsize=(16,9))
-        #l_pad = -50
-    else:
-        fig = plt.figure(1, facecolor='white',figsize=(4.92126,3.2))
-        #l_pad = -35
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
-    ax = fig.add_subplot(gs[10:95,5:80])
-    #colorbar axis
-    ax2 = fig.add_subplot(gs[10:95,82:85])
-
     # read in the csv files
     ProfileDF = Helper.ReadChiProfileCSV(DataDirectory, fname_prefix)
     BasinStatsDF = Helper.ReadBasinStatsCSV(DataDirectory, fname_prefix)
+    if FullStats is None:
+        FullStats = MOverNFullStats(DataDirectory, fname_prefix, start_movern, d_movern, n_movern)
 
     # get the number of basins
     basin_keys = list(BasinStatsDF['basin_key'])
@@ -787,95 +1467,148 @@ def MakeChiPlotsMLE(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.
         print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
         basin_list = basin_keys
 
-    # loop through each m over n value
-    end_movern = start_movern+d_movern*(n_movern-1)
-    m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
+    shared_data = {"DataDirectory": DataDirectory,
+                   "m_over_n_values": FullStats.m_over_n_values,
+                   "FullStats": FullStats,
+                   "ProfileDF": ProfileDF,
+                   "profile_basin_index": LSDP.lsdstatsutilities.GroupIndex(np.asarray(ProfileDF['basin_key'])),
+                   "size_format": size_format,
+                   "FigFormat": FigFormat}
+    filenames = RunBasinJobs(_PlotChiMLEForBasin, basin_list, shared_data, n_processes)
+
+    return [fname for basin_filenames in filenames for fname in basin_filenames]
+
+def _PlotProfilesRemovingOutliersForBasin(basin_number, shared_data):
+    """
+    Makes the chi profile plots of one basin as its outlying tributaries are removed.
+    This is the basin worker of PlotProfilesRemovingOutliers.
 
-    for m_over_n in m_over_n_values:
-        # read in the full stats file
-        print("This m/n is: "+str(m_over_n))
-        FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,m_over_n)
+    Author: SMM
+    """
+    DataDirectory = shared_data["DataDirectory"]
+    FigFormat = shared_data["FigFormat"]
+    FullStats = shared_data["FullStats"]
+
+    # Get the removed sources indices for this particular basin
+    these_removed_sources = shared_data["removed_sources_dict"][basin_number]
+
+    # The tributaries of this basin. The main stem source is always the reference source.
+    rows = FullStats.basin_rows(basin_number)
+    if len(rows) == 0:
+        print("Basin "+str(basin_number)+" isn't in the full stats files, skipping it.")
+        return []
+    trib_values = list(FullStats.test_source_keys[rows])
+    ref_values = list(FullStats.reference_source_keys[rows])
+
+    # mask the data frames for this basin
+    ProfileDF = shared_data["ProfileDF"]
+    ProfileDF_basin_all = ProfileDF.iloc[shared_data["profile_basin_index"].indices(basin_number)]
+
+    fig = _MOverNFigure(shared_data["size_format"])
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
+    ax = fig.add_subplot(gs[10:95,5:80])
+    #colorbar axis
+    ax2 = fig.add_subplot(gs[10:95,82:85])
+
+    # loop through the best fit moverns
+    # each value represents the MLE for a given number of removed outlying tributaries
+    filenames = []
+    removed_sources_list = []
+    for idx,best_fit_movern in enumerate(shared_data["best_fit_movern_dict"][basin_number]):
 
-        # loop through all the basins in the basin list
-        for basin_key in basin_list:
-            print("This basin key is %s") %str(basin_key)
+        print("The best fit m/n is: "+ str(best_fit_movern)+" and the index is "+str(idx))
 
-            # mask the data frames for this basin
-            ProfileDF_basin = ProfileDF[ProfileDF['basin_key'] == basin_key]
-            FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin_key]
+        # The MLEs of the best fit m/n, used to colour the tribs
+        movern_index = np.argmin(np.abs(FullStats.m_over_n_values-best_fit_movern))
+        FullStatsDF_basin = pd.DataFrame({"test_source_key": trib_values,
+                                          "MLE": FullStats.MLE[movern_index,rows]})
 
-            #print FullStatsDF_basin
-            print ("Getting the reference_source_key")
+        # Note that index 0 is the basin with no removed tributaries.
+        if idx != 0:
+            removed_sources_list.extend(these_removed_sources[idx-1])
 
-            print(FullStatsDF_basin.iloc[0]['reference_source_key'])
+        # now you need to get the actual source numbers by indexing into the source list
+        the_removed_sources = []
+        for source_index in removed_sources_list:
+            the_removed_sources.append( trib_values[source_index]  )
 
-            # get the data frame for the main stem
-            ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == FullStatsDF_basin.iloc[0]['reference_source_key']]
+        print("The main stem is: ")
+        print( ref_values[0])
 
-            # get the data frame for the tributaries
-            ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != FullStatsDF_basin.iloc[0]['reference_source_key']]
-            # merge with the full data to get the MLE for the tributaries
-            ProfileDF_tribs = ProfileDF_basin.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+        print("The removed tribs are: ")
+        print(the_removed_sources)
 
-            # get the chi and elevation data for the main stem
-            movern_key = 'm_over_n = %s' %(str(m_over_n))
-            MainStemX = list(ProfileDF_MS[movern_key])
-            MainStemElevation = list(ProfileDF_MS['elevation'])
+        # get the data frame for the main stem
+        ProfileDF_MS = ProfileDF_basin_all[ProfileDF_basin_all['source_key'] == ref_values[0]]
 
-            # get the chi, elevation, and MLE for the tributaries
-            TributariesX = list(ProfileDF_tribs[movern_key])
-            TributariesElevation = list(ProfileDF_tribs['elevation'])
-            TributariesMLE = list(ProfileDF_tribs['MLE'])
+        # get the data frame for the tributaries
+        ProfileDF_basin = ProfileDF_basin_all[ProfileDF_basin_all['source_key'] != ref_values[0]]
 
-            # get the colourmap to colour channels by the MLE value
-            #NUM_COLORS = len(MLE)
-            MLE_array = np.asarray(TributariesMLE)
-            this_cmap = plt.cm.Reds
-            cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
-            plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
+        # now split the tributaries into exluded and non excluded tribs
+        ProfileDF_outliers = ProfileDF_basin[ProfileDF_basin.source_key.isin(the_removed_sources)]
+        ProfileDF_kept = ProfileDF_basin[~ProfileDF_basin.source_key.isin(the_removed_sources)]
 
-            # now plot the data with a colourmap
-            sc = ax.scatter(TributariesX,TributariesElevation,c=TributariesMLE,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
-            ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
+        # merge with the full data to get the MLE for the tributaries
+        ProfileDF_trib_outliers = ProfileDF_outliers.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+        ProfileDF_trib_kept = ProfileDF_kept.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
 
-            # some formatting of the figure
-            ax.spines['top'].set_linewidth(1)
-            ax.spines['left'].set_linewidth(1)
-            ax.spines['right'].set_linewidth(1)
-            ax.spines['bottom'].set_linewidth(1)
+        # get the chi and elevation data for the main stem
+        movern_key = 'm_over_n = %s' %(str(best_fit_movern))
+        MainStemX = list(ProfileDF_MS[movern_key])
+        MainStemElevation = list(ProfileDF_MS['elevation'])
 
-            # make the lables
-            ax.set_xlabel("$\chi$ (m)")
-            ax.set_ylabel("Elevation (m)")
+        # get the chi, elevation, and MLE for the tributaries
+        TributariesX_outliers = list(ProfileDF_trib_outliers[movern_key])
+        TributariesElevation_outliers = list(ProfileDF_trib_outliers['elevation'])
 
-            # label with the basin and m/n
-            title_string = "Basin "+str(basin_key)+", $m/n$ = "+str(m_over_n)
-            ax.text(0.05, 0.95, title_string,
-                    verticalalignment='top', horizontalalignment='left',
-                    transform=ax.transAxes,
-                    color='black', fontsize=10)
+        TributariesX_kept = list(ProfileDF_trib_kept[movern_key])
+        TributariesElevation_kept = list(ProfileDF_trib_kept['elevation'])
+        TributariesMLE_kept = list(ProfileDF_trib_kept['MLE'])
 
-            # add the colorbar
-            colorbarlabel = "$MLE$"
-            cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
-            cbar.set_label(colorbarlabel, fontsize=10)
-            ax2.set_ylabel(colorbarlabel, fontname='Arial', fontsize=10)
+        # get the colourmap to colour channels by the MLE value
+        MLE_array = np.asarray(TributariesMLE_kept)
+        this_cmap = plt.cm.Reds
+        cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
 
-            #save the plot
-            newFilename = DataDirectory+"MLE_profiles"+str(basin_key)+"_"+str(m_over_n)+".png"
+        # now plot the data with a colourmap
+        sc = ax.scatter(TributariesX_kept,TributariesElevation_kept,c=TributariesMLE_kept,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
 
-            # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-            ax.tick_params(axis='both', width=1, pad = 2)
-            for tick in ax.xaxis.get_major_ticks():
-                tick.set_pad(2)
+        # Add the outliers if the basin has them
+        if(len(removed_sources_list)>0):
+            ax.scatter(TributariesX_outliers,TributariesElevation_outliers,c="b", norm=cNorm, s=2.5, edgecolors='none', alpha = 0.3)
 
-            plt.savefig(newFilename,format=FigFormat,dpi=300)
-            ax.cla()
-            ax2.cla()
+        ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
+
+        # some formatting of the figure
+        _FormatMOverNAxes(ax)
+
+        # label with the basin and m/n
+        title_string = "Basin "+str(basin_number)+", best fit $m/n$ = "+str(best_fit_movern)
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='black', fontsize=10)
+
+        # add the colorbar
+        colorbarlabel = "$MLE$"
+        cbar = fig.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
+        cbar.set_label(colorbarlabel, fontsize=10)
+        ax2.set_ylabel(colorbarlabel, fontname='Arial', fontsize=10)
+
+        #save the plot
+        newFilename = DataDirectory+"MLE_profiles"+str(basin_number)+"_"+str(best_fit_movern)+"_removed_"+str(idx)+".png"
+        _PadTicks(ax)
 
+        fig.savefig(newFilename,format=FigFormat,dpi=300)
+        filenames.append(newFilename)
+        ax.cla()
+        ax2.cla()
 
+    plt.close(fig)
+    return filenames
 
-def PlotProfilesRemovingOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7, size_format = "geomorphology"):
+def PlotProfilesRemovingOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7, size_format = "geomorphology",
+                                 FigFormat = "png", n_processes = 1, FullStats = None):
     """
     This function is used to plot the chi profiles as they have outliers removed.
     It calls thefunction CheckMLEOutliers, which you should read to get details
@@ -889,198 +1622,151 @@ def PlotProfilesRemovingOutliers(DataDirectory, fname_prefix, basin_list=[0], st
         start_movern (float): the starting m/n value. Default is 0.2
         d_movern (float): the increment between the m/n values. Default is 0.1
         n_movern (float): the number of m/n values analysed. Default is 7.
+        size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt geomorphology).
+        FigFormat (str): The format of the figure. Default 'png'.
+        n_processes (int): The number of processes used to make the basin plots. 0 uses all the cores. Default is 1.
+        FullStats (MOverNFullStats): The loaded fullstats files. If None, the files are loaded here.
 
     Returns:
-        Plots of chi profiles with basins removed
+        Plots of chi profiles with basins removed. The list of the figure names is returned in basin order.
 
     Author: SMM
     """
-
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['arial']
-    rcParams['font.size'] = label_size
-
-    # make a figure
-    if size_format == "geomorphology":
-        fig = plt.figure(1, facecolor='white',figsize=(6.25,3.5))
-        #l_pad = -40
-    elif size_format == "big":
-        fig = plt.figure(1, facecolor='white',figsize=(16,9))
-        #l_pad = -50
-    else:
-        fig = plt.figure(1, facecolor='white',figsize=(4.92126,3.2))
-        #l_pad = -35
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
-    ax = fig.add_subplot(gs[10:95,5:80])
-    #colorbar axis
-    ax2 = fig.add_subplot(gs[10:95,82:85])
-
-    # we open the first file just so that we can get a counter list
-    FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,start_movern)
-
-    # get the number of basins
-    basin_keys = list(FirstDF['basin_key'])
-    basin_keys = [float(x) for x in basin_keys]
+    # load the full stats files once
+    if FullStats is None:
+        FullStats = MOverNFullStats(DataDirectory, fname_prefix, start_movern, d_movern, n_movern)
 
     # get the list of basins
     if basin_list == []:
         print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-        basin_set = set(basin_list)
-        basin_list = list(basin_set)
-        basin_list = [int(i) for i in basin_list]
+        basin_list = FullStats.basin_list()
 
     # First we get all the information about outliers, m/n values and MLE
     # values from the CheckMLEOutliers function
-    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern)
+    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern, FullStats=FullStats)
 
     # Now get the chi profiles of all the basins and channels
     # Load from file and put into a pandas data frame
     ProfileDF = Helper.ReadChiProfileCSV(DataDirectory,fname_prefix)
 
     # now we need to get a plot for each basin, showing the incremental removal of outlying tribs
-    for basin_number in basin_list:
-
-        # Get the removed sources indices and the MLEs for this particular basin
-        these_removed_sources = removed_sources_dict[basin_number]
-        these_MLEs = MLEs_dict[basin_number]
-
-        # loop through the best fit moverns
-        # each value represents the MLE for a given number of removed outlying tributaries
-        removed_sources_list = []
-        for idx,best_fit_movern in enumerate(best_fit_movern_dict[basin_number]):
-
-            print("The best fit m/n is: "+ str(best_fit_movern)+" and the index is "+str(idx))
-
-            # mask the data frames for this basin
-            ProfileDF_basin = ProfileDF[ProfileDF['basin_key'] == basin_number]
-
-            # We also need to get the fullstats MLE file. This will be used
-            # to colour tribs as well as get the source numbers from
-            # the outlier list
-            FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,best_fit_movern)
-
-            # mask the data so you only get the correct basin
-            FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin_number]
-
-            # extract the relevant data
-            #MLE_values = list(FullStatsDF_basin['MLE'])
-            #RMSE_values = list(FullStatsDF_basin['RMSE'])
-            trib_values = list(FullStatsDF_basin['test_source_key'])
-            ref_values = list(FullStatsDF_basin['reference_source_key'])
-
-            # Now get the excluded tributaries for this iteration
-            #removed_MLE = these_MLEs[idx]
-
-            # Note that index 0 is the basin with no removed tributaries.
-            if idx != 0:
-                removed_sources_list.extend(these_removed_sources[idx-1])
-
-            # now you need to get the actual source numbers by indexing into the source list
-            the_removed_sources = []
-            for source_index in removed_sources_list:
-                the_removed_sources.append( trib_values[source_index]  )
-
-            print("The main stem is: ")
-            print( ref_values[0])
-
-            print("The removed tribs are: ")
-            print(the_removed_sources)
-
-
-
-            # get the data frame for the main stem
-            # It does this because the main stem source is always the 0 element in the trib_values list
-            ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == ref_values[0]]
-
-            # get the data frame for the tributaries
-            ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != ref_values[0]]
-
-            # now split the tributaries into exluded and non excluded tribs
-            #ProfileDF_outliers = ProfileDF_basin.filter(items=removed_sources_list)
-            #ProfileDF_kept = ProfileDF_basin.filter(items=removed_sources_list)
-            ProfileDF_outliers = ProfileDF_basin[ProfileDF_basin.source_key.isin(the_removed_sources)]
-            ProfileDF_kept = ProfileDF_basin[~ProfileDF_basin.source_key.isin(the_removed_sources)]
-
-            #ProfileDF_basin = ProfileDF_basin[ProfileDF_basin.source_key.isin(removed_sources_list)]
-            #ProfileDF_basin = ProfileDF_basin[ProfileDF_basin.source_key.isin([2,3,4])]
-            #print(ProfileDF_basin)
-
-            # merge with the full data to get the MLE for the tributaries
-            ProfileDF_trib_outliers = ProfileDF_outliers.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
-            ProfileDF_trib_kept = ProfileDF_kept.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
-
-            # get the chi and elevation data for the main stem
-            movern_key = 'm_over_n = %s' %(str(best_fit_movern))
-            MainStemX = list(ProfileDF_MS[movern_key])
-            MainStemElevation = list(ProfileDF_MS['elevation'])
-
-            # get the chi, elevation, and MLE for the tributaries
-            TributariesX_outliers = list(ProfileDF_trib_outliers[movern_key])
-            TributariesElevation_outliers = list(ProfileDF_trib_outliers['elevation'])
-            #TributariesMLE_outliers = list(ProfileDF_trib_outliers['MLE'])
-
-            TributariesX_kept = list(ProfileDF_trib_kept[movern_key])
-            TributariesElevation_kept = list(ProfileDF_trib_kept['elevation'])
-            TributariesMLE_kept = list(ProfileDF_trib_kept['MLE'])
-
-            # now reset the
-
-            # get the colourmap to colour channels by the MLE value
-            #NUM_COLORS = len(MLE)
-            MLE_array = np.asarray(TributariesMLE_kept)
-            this_cmap = plt.cm.Reds
-            cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
-            plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
-
-            # now plot the data with a colourmap
-            sc = ax.scatter(TributariesX_kept,TributariesElevation_kept,c=TributariesMLE_kept,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
-
-            # Add the outliers if the basin has them
-            if(len(removed_sources_list)>0):
-                ax.scatter(TributariesX_outliers,TributariesElevation_outliers,c="b", norm=cNorm, s=2.5, edgecolors='none', alpha = 0.3)
-
-            ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
-
-            # some formatting of the figure
-            ax.spines['top'].set_linewidth(1)
-            ax.spines['left'].set_linewidth(1)
-            ax.spines['right'].set_linewidth(1)
-            ax.spines['bottom'].set_linewidth(1)
-
-            # make the lables
-            ax.set_xlabel("$\chi$ (m)")
-            ax.set_ylabel("Elevation (m)")
+    shared_data = {"DataDirectory": DataDirectory,
+                   "FullStats": FullStats,
+                   "removed_sources_dict": removed_sources_dict,
+                   "best_fit_movern_dict": best_fit_movern_dict,
+                   "ProfileDF": ProfileDF,
+                   "profile_basin_index": LSDP.lsdstatsutilities.GroupIndex(np.asarray(ProfileDF['basin_key'])),
+                   "size_format": size_format,
+                   "FigFormat": FigFormat}
+    filenames = RunBasinJobs(_PlotProfilesRemovingOutliersForBasin, basin_list, shared_data, n_processes)
+
+    return [fname for basin_filenames in filenames for fname in basin_filenames]
+
+def _PlotMLEWithMOverNForBasin(basin_number, shared_data):
+    """
+    Makes the plot of MLE against m/n of one basin as the tributaries are removed.
+    This is the basin worker of PlotMLEWithMOverN.
 
-            # label with the basin and m/n
-            title_string = "Basin "+str(basin_number)+", best fit $m/n$ = "+str(best_fit_movern)
-            ax.text(0.05, 0.95, title_string,
-                    verticalalignment='top', horizontalalignment='left',
-                    transform=ax.transAxes,
-                    color='black', fontsize=10)
+    Author: FJC
+    """
+    import matplotlib.patches as patches
 
-            # add the colorbar
-            colorbarlabel = "$MLE$"
-            cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
-            cbar.set_label(colorbarlabel, fontsize=10)
-            ax2.set_ylabel(colorbarlabel, fontname='Arial', fontsize=10)
+    DataDirectory = shared_data["DataDirectory"]
+    FigFormat = shared_data["FigFormat"]
+    m_over_n_values = shared_data["m_over_n_values"]
+    ls = shared_data["line_styles"]
 
-            #save the plot
-            newFilename = DataDirectory+"MLE_profiles"+str(basin_number)+"_"+str(best_fit_movern)+"_removed_"+str(idx)+".png"
+    print ("This basin is: " +str(basin_number))
 
-            # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-            ax.tick_params(axis='both', width=1, pad = 2)
-            for tick in ax.xaxis.get_major_ticks():
-                tick.set_pad(2)
+    fig = _MOverNFigure(shared_data["size_format"])
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=0.85,top=0.9)
+    ax = fig.add_subplot(gs[5:100,10:95])
 
-            plt.savefig(newFilename,format=FigFormat,dpi=300)
-            ax.cla()
-            ax2.cla()
+    # Get the removed sources indices and the MLEs for this particular basin.
+    # We use the log of the MLEs so that basins with very small MLEs still get a ratio
+    basin_removed_sources = shared_data["removed_sources_dict"][basin_number]
+    n_removed_sources = len(basin_removed_sources)
+    basin_log_MLEs = shared_data["log_MLEs_dict"][basin_number]
+
+    # get the best fit m over ns for this basin
+    best_fit_moverns = shared_data["best_fit_movern_dict"][basin_number]
+    print(best_fit_moverns)
+
+    # loop through the number of removed tributaires and get the MLE for each m/n for each iteration
+    for i in range(n_removed_sources+1):
+
+        # get the MLE of the best fit m over n
+        best_fit_movern = best_fit_moverns[i]
+        # get the index in the MLE list
+        idx = int(round((best_fit_movern - shared_data["start_movern"])/shared_data["d_movern"],0))
+        best_fit_log_MLE = basin_log_MLEs[idx][i]
+        print ("The best fit MLE is: "+str(np.exp(best_fit_log_MLE))+", where m/n = " +str(best_fit_movern))
+
+        # get the ratio of the MLEs of this iteration to the best fit
+        with np.errstate(invalid='ignore'):
+            ratio_MLEs = list(np.exp(basin_log_MLEs[:,i]-best_fit_log_MLE))
+
+        # no removed tributaries
+        if i == 0:
+            # plot the data
+            ax.plot(m_over_n_values,ratio_MLEs, lw=1.5, label = str(i), c='k', linestyle = '-', zorder=100)
+
+            # get the limits for the arrow
+            max_MLE = max(ratio_MLEs)
+            min_MLE = min(ratio_MLEs)
+            dy = (max_MLE-min_MLE)/8
+            spacing = 1.1
+            # add arrow at best fit m/n
+            ax.add_patch(
+                patches.Arrow(
+                    best_fit_movern, #x
+                    max_MLE+(dy*spacing), #y
+                    0, #dx
+                    -dy, #dy
+                    width = 0.05,
+                    facecolor = 'r',
+                    edgecolor = 'r'
+                )
+            )
+        #remove tribs
+        else:
+            # plot the data
+            ax.plot(m_over_n_values,ratio_MLEs, lw=1, label = str(i), c='0.5', linestyle = ls[i % len(ls)]) # different linestyle for each iteration?
 
-def PlotMLEWithMOverN(DataDirectory, fname_prefix, basin_list = [0], size_format='ESURF', FigFormat='png', start_movern=0.2, d_movern = 0.1, n_movern = 7):
+    # set the axes labels
+    ax.set_xlabel('$m/n$')
+    ax.set_ylabel('$MLE$ ratio')
+
+    # set the ylim
+    ax.set_ylim(min_MLE,max_MLE+(dy*spacing))
+
+    # add the legend
+    ax.legend(loc='right', bbox_to_anchor=(1.25,0.5), title = 'Iterations', frameon=False)
+
+    # some formatting of the figure
+    ax.spines['top'].set_linewidth(1)
+    ax.spines['left'].set_linewidth(1)
+    ax.spines['right'].set_linewidth(1)
+    ax.spines['bottom'].set_linewidth(1)
+
+    # label with the basin and m/n
+    best_fit_movern = best_fit_moverns[0]
+    title_string = "Basin "+str(basin_number)+"; Best fit $m/n$: "+str(best_fit_movern)
+    ax.text(0, 1.1, title_string,
+        verticalalignment='top', horizontalalignment='left',
+        transform=ax.transAxes,
+        color='red', fontsize=10)
+
+    #save the plot
+    newFilename = DataDirectory+"MLE_fxn_movern_"+str(basin_number)+"."+FigFormat
+    _PadTicks(ax)
+
+    fig.savefig(newFilename,format=FigFormat,dpi=300)
+    plt.close(fig)
+    return newFilename
+
+def PlotMLEWithMOverN(DataDirectory, fname_prefix, basin_list = [0], size_format='ESURF', FigFormat='png', start_movern=0.2, d_movern = 0.1, n_movern = 7,
+                      n_processes = 1, FullStats = None):
     """
     This function makes a plot of the MLE values for each m/n showing how the MLE values change
     as you remove the tributaries.
@@ -1095,165 +1781,45 @@ def PlotMLEWithMOverN(DataDirectory, fname_prefix, basin_list = [0], size_format
         start_movern (float): the starting m/n value. Default is 0.2
         d_movern (float): the increment between the m/n values. Default is 0.1
         n_movern (float): the number of m/n values analysed. Default is 7.
+        n_processes (int): The number of processes used to make the basin plots. 0 uses all the cores. Default is 1.
+        FullStats (MOverNFullStats): The loaded fullstats files. If None, the files are loaded here.
 
     Returns:
-        Plots of MLE values for each m/n
+        Plots of MLE values for each m/n. The list of the figure names is returned in basin order.
 
     Author: FJC
     """
-    from cycler import cycler
     from matplotlib import lines
-    import matplotlib.patches as patches
 
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['arial']
-    rcParams['font.size'] = label_size
-
-    # set colours for tributaries
-    # plt.rc('axes', prop_cycle=(cycler('color', ['k', '0.5', '0.5', '0.5', '0.5']) +
-    #                        cycler('linestyle', ['-', '--', ':', '-.', '--'])))
-
-    # make a figure
-    if size_format == "geomorphology":
-        fig = plt.figure(1, facecolor='white',figsize=(6.25,3.5))
-        #l_pad = -40
-    elif size_format == "big":
-        fig = plt.figure(1, facecolor='white',figsize=(16,9))
-        #l_pad = -50
-    else:
-        fig = plt.figure(1, facecolor='white',figsize=(4.92126,3.2))
-        #l_pad = -35
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=0.85,top=0.9)
-    ax = fig.add_subplot(gs[5:100,10:95])
-
-    # we open the first file just so that we can get a counter list
-    FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,start_movern)
-
-    # get the list of m over n values
-    end_movern = start_movern+d_movern*(n_movern-1)
-    m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
-
-    # get the number of basins
-    basin_keys = list(FirstDF['basin_key'])
-    basin_keys = [float(x) for x in basin_keys]
+    # load the full stats files once
+    if FullStats is None:
+        FullStats = MOverNFullStats(DataDirectory, fname_prefix, start_movern, d_movern, n_movern)
 
     # get the list of basins
     if basin_list == []:
         print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-        basin_set = set(basin_list)
-        basin_list = list(basin_set)
-        basin_list = [int(i) for i in basin_list]
+        basin_list = FullStats.basin_list()
 
     # First we get all the information about outliers, m/n values and MLE
     # values from the CheckMLEOutliers function
-    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern)
-
-    # Now get the chi profiles of all the basins and channels
-    # Load from file and put into a pandas data frame
-    ProfileDF = Helper.ReadChiProfileCSV(DataDirectory,fname_prefix)
+    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern, FullStats=FullStats)
 
     # get list of line styles for plotting. This is hacky but not sure how else to do this.
-    ls = lines.lineStyles.keys()
+    ls = list(lines.lineStyles.keys())
     ls = ls[3:]
     ls = ls + ls
 
-    # loop through each basin and each number of removed tributaries
-    for basin_number in basin_list:
-
-        print ("This basin is: " +str(basin_number))
-
-        # Get the removed sources indices and the MLEs for this particular basin
-        basin_removed_sources = removed_sources_dict[basin_number]
-        n_removed_sources = len(basin_removed_sources)
-        basin_MLEs = MLEs_dict[basin_number]
-
-        # get the best fit m over ns for this basin
-        best_fit_moverns = best_fit_movern_dict[basin_number]
-        print best_fit_moverns
-
-        # loop through the number of removed tributaires and get the MLE for each m/n for each iteration
-        for i in range(n_removed_sources+1):
-
-            # get the MLE of the best fit m over n
-            best_fit_movern = best_fit_moverns[i]
-            # get the index in the MLE list
-            idx = int(round((best_fit_movern - start_movern)/d_movern,0))
-            print idx
-            best_fit_MLE = basin_MLEs[idx][i]
-            print ("The best fit MLE is: "+str(best_fit_MLE)+", where m/n = " +str(best_fit_movern))
-
-            # get the MLEs for this iteration
-            these_MLEs = basin_MLEs[:,i]
-
-            # get the ratio of these MLEs to the best fit
-            ratio_MLEs = [x/best_fit_MLE for x in these_MLEs]
-
-            # no removed tributaries
-            if i == 0:
-                # plot the data
-                ax.plot(m_over_n_values,ratio_MLEs, lw=1.5, label = str(i), c='k', linestyle = '-', zorder=100)
-
-                # get the limits for the arrow
-                max_MLE = max(ratio_MLEs)
-                min_MLE = min(ratio_MLEs)
-                dy = (max_MLE-min_MLE)/8
-                spacing = 1.1
-                # add arrow at best fit m/n
-                ax.add_patch(
-                    patches.Arrow(
-                        best_fit_movern, #x
-                        max_MLE+(dy*spacing), #y
-                        0, #dx
-                        -dy, #dy
-                        width = 0.05,
-                        facecolor = 'r',
-                        edgecolor = 'r'
-                    )
-                )
-            #remove tribs
-            else:
-                # plot the data
-                ax.plot(m_over_n_values,ratio_MLEs, lw=1, label = str(i), c='0.5', linestyle = ls[i]) # different linestyle for each iteration?
-
-        # set the axes labels
-        ax.set_xlabel('$m/n$')
-        ax.set_ylabel('$MLE$ ratio')
-
-        # set the ylim
-        ax.set_ylim(min_MLE,max_MLE+(dy*spacing))
-
-        # add the legend
-        ax.legend(loc='right', bbox_to_anchor=(1.25,0.5), title = 'Iterations', frameon=False)
-
-        # some formatting of the figure
-        ax.spines['top'].set_linewidth(1)
-        ax.spines['left'].set_linewidth(1)
-        ax.spines['right'].set_linewidth(1)
-        ax.spines['bottom'].set_linewidth(1)
-
-        # label with the basin and m/n
-        best_fit_movern = best_fit_movern_dict[basin_number][0]
-        title_string = "Basin "+str(basin_number)+"; Best fit $m/n$: "+str(best_fit_movern)
-        #ax.set_title(title_string)
-        ax.text(0, 1.1, title_string,
-            verticalalignment='top', horizontalalignment='left',
-            transform=ax.transAxes,
-            color='red', fontsize=10)
-
-        #save the plot
-        newFilename = DataDirectory+"MLE_fxn_movern_"+str(basin_number)+"."+FigFormat
-
-        # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-        ax.tick_params(axis='both', width=1, pad = 2)
-        for tick in ax.xaxis.get_major_ticks():
-            tick.set_pad(2)
-
-        plt.savefig(newFilename,format=FigFormat,dpi=300)
-        ax.cla()
+    shared_data = {"DataDirectory": DataDirectory,
+                   "m_over_n_values": FullStats.m_over_n_values,
+                   "start_movern": start_movern,
+                   "d_movern": d_movern,
+                   "removed_sources_dict": removed_sources_dict,
+                   "best_fit_movern_dict": best_fit_movern_dict,
+                   "log_MLEs_dict": dict((b, FullStats.log_MLEs_dict[b]) for b in basin_list),
+                   "line_styles": ls,
+                   "size_format": size_format,
+                   "FigFormat": FigFormat}
+    return RunBasinJobs(_PlotMLEWithMOverNForBasin, basin_list, shared_data, n_processes)
 
 #=============================================================================
 # RASTER PLOTTING FUNCTIONS
@@ -1521,9 +2087,184 @@ def PlotMOverNDicts(DataDirectory,fname_prefix,SA_based_dict,Chi_based_dict, Fig
     plt.savefig(ImageName, format=FigFormat, dpi=300)
     fig.clf()
 
-def plot_MCMC_analysis(DataDirectory,fname_prefix,basin_list=[],FigFormat='png',size_format='ESURF'):
+def _ExtendHistogram(counts, hist_min, bin_width, value_min, value_max):
+    """
+    Doubles the width of the bins of a histogram until it covers value_min to value_max. Each
+    doubling merges pairs of bins and adds the freed half of the bins on the side that is short,
+    so the old bin edges are kept and the counts stay exact.
+
+    Returns:
+        counts, hist_min, bin_width
+    """
+    n_bins = len(counts)
+    while value_min < hist_min or value_max >= hist_min+n_bins*bin_width:
+        merged = counts.reshape(-1,2).sum(axis = 1)
+        bin_width = 2*bin_width
+        empty = np.zeros(n_bins//2, dtype = counts.dtype)
+        if value_min < hist_min:
+            counts = np.concatenate((empty, merged))
+            hist_min = hist_min-(n_bins//2)*bin_width
+        else:
+            counts = np.concatenate((merged, empty))
+    return counts, hist_min, bin_width
+
+def SummariseMCMCChain(chain_file, burn_in = 0, chunksize = 100000, hist_range = None, n_bins = 4000,
+                       max_trace_points = 5000, value_column = 'movern_New', percentiles = [2.5,16,50,84,97.5]):
+    """
+    This reads an MCMC chain file in chunks and summarises it without keeping the chain in memory.
+    The state of the chain at each iteration is the last accepted value (an iteration is accepted when
+    NAccepted goes up). After the burn in, the states go into a running mean and variance and into a
+    histogram, from which the percentiles are interpolated. The histogram covers the values of the first
+    chunk, and its bins are doubled in width (merging pairs of bins, so no counts move) whenever the
+    chain goes outside its range, so no value is ever clipped. A decimated trace of the
+    accepted values is kept for plotting: every accepted value is kept until there are max_trace_points,
+    then every second one, and so on.
+
+    Args:
+        chain_file (str): The chain csv file, with the columns i, NAccepted and value_column
+        burn_in (int): The number of iterations to leave out of the statistics
+        chunksize (int): The number of rows read at a time
+        hist_range (tuple): The starting range of the histogram. Default is the range of the first chunk.
+        n_bins (int): The number of histogram bins (rounded up to an even number)
+        max_trace_points (int): The maximum number of accepted values kept for plotting
+        value_column (str): The column with the proposed values
+        percentiles (list): The percentiles to calculate
+
+    Returns:
+        A dict with the summary: n_iterations, n_samples, acceptance_rate, mean, std, min, max,
+        percentiles (a dict), first_i and last_i (the first and last iteration numbers),
+        and trace_i and trace_value, the decimated accepted values.
+
+    Author: FJC
     """
-    This function makes a plot of the MCMC uncertainty analysis for the MLE collinearity
+    n_bins = n_bins+n_bins % 2
+    counts = np.zeros(n_bins, dtype = np.int64)
+    hist_min = np.nan
+    bin_width = np.nan
+
+    n_iterations = 0
+    n_samples = 0
+    mean = 0.0
+    M2 = 0.0
+    min_value = np.inf
+    max_value = -np.inf
+    last_accepted_count = np.nan
+    accepted_at_burn_in = np.nan
+    state = np.nan
+    first_i = np.nan
+    last_i = np.nan
+
+    trace_i = np.zeros(0)
+    trace_value = np.zeros(0)
+    trace_stride = 1
+    n_accepted_seen = 0
+
+    for chunk in pd.read_csv(chain_file, chunksize = chunksize):
+        iterations = np.asarray(chunk['i'])
+        values = np.asarray(chunk[value_column], dtype = float)
+        n_accepted = np.asarray(chunk['NAccepted'], dtype = float)
+        row_number = n_iterations+np.arange(len(chunk))
+
+        # find the accepted values, carrying the last NAccepted over from the previous chunk
+        accepted = np.diff(np.concatenate(([last_accepted_count],n_accepted))) == 1.0
+
+        # the state of the chain is the last accepted value
+        accepted_index = np.where(accepted, np.arange(len(chunk)), -1)
+        accepted_index = np.maximum.accumulate(accepted_index)
+        states = np.where(accepted_index >= 0, values[np.maximum(accepted_index,0)], state)
+
+        # the number accepted at the burn in, for the acceptance rate
+        if np.isnan(accepted_at_burn_in) and row_number[-1] >= burn_in:
+            burn_in_row = max(burn_in-n_iterations,0)
+            if burn_in_row > 0:
+                accepted_at_burn_in = n_accepted[burn_in_row-1]
+            elif not np.isnan(last_accepted_count):
+                accepted_at_burn_in = last_accepted_count
+            else:
+                accepted_at_burn_in = n_accepted[0]
+
+        # add the states after the burn in to the statistics
+        use = (row_number >= burn_in) & ~np.isnan(states)
+        these_states = states[use]
+        if len(these_states) > 0:
+            # merge the mean and variance of this chunk (Chan et al.)
+            n_chunk = len(these_states)
+            chunk_mean = np.mean(these_states)
+            chunk_M2 = np.sum((these_states-chunk_mean)**2)
+            delta = chunk_mean-mean
+            total = n_samples+n_chunk
+            mean = mean+delta*n_chunk/total
+            M2 = M2+chunk_M2+delta*delta*n_samples*n_chunk/total
+            n_samples = total
+            min_value = min(min_value, np.min(these_states))
+            max_value = max(max_value, np.max(these_states))
+
+            if np.isnan(hist_min):
+                if hist_range is None:
+                    hist_range = (min_value, max_value)
+                span = max(hist_range[1]-hist_range[0], abs(hist_range[1])*1e-3, 1e-9)
+                hist_min = hist_range[0]-0.05*span
+                bin_width = 1.1*span/n_bins
+            counts, hist_min, bin_width = _ExtendHistogram(counts, hist_min, bin_width, min_value, max_value)
+            bins = np.clip(np.floor((these_states-hist_min)/bin_width).astype(np.int64), 0, n_bins-1)
+            counts += np.bincount(bins, minlength = n_bins)
+
+        # keep a decimated trace of the accepted values
+        accepted_rows = np.nonzero(accepted)[0]
+        keep = (n_accepted_seen+np.arange(len(accepted_rows))) % trace_stride == 0
+        trace_i = np.concatenate((trace_i, iterations[accepted_rows[keep]]))
+        trace_value = np.concatenate((trace_value, values[accepted_rows[keep]]))
+        n_accepted_seen += len(accepted_rows)
+        while len(trace_i) > max_trace_points:
+            trace_i = trace_i[::2]
+            trace_value = trace_value[::2]
+            trace_stride = trace_stride*2
+
+        if n_iterations == 0:
+            first_i = iterations[0]
+        last_i = iterations[-1]
+        n_iterations += len(chunk)
+        last_accepted_count = n_accepted[-1]
+        state = states[-1]
+
+    # interpolate the percentiles from the histogram
+    percentile_dict = {}
+    if n_samples > 0:
+        cumulative = np.concatenate(([0],np.cumsum(counts)))*100.0/n_samples
+        bin_edges = hist_min+bin_width*np.arange(n_bins+1)
+        for p in percentiles:
+            percentile_dict[p] = float(np.clip(np.interp(p, cumulative, bin_edges), min_value, max_value))
+
+    n_after_burn_in = n_iterations-burn_in
+    if n_after_burn_in > 0 and not np.isnan(accepted_at_burn_in):
+        acceptance_rate = (last_accepted_count-accepted_at_burn_in)/float(n_after_burn_in)
+    else:
+        acceptance_rate = np.nan
+
+    return {"n_iterations": n_iterations,
+            "n_samples": n_samples,
+            "acceptance_rate": acceptance_rate,
+            "mean": mean if n_samples > 0 else np.nan,
+            "std": np.sqrt(M2/n_samples) if n_samples > 0 else np.nan,
+            "min": min_value,
+            "max": max_value,
+            "percentiles": percentile_dict,
+            "first_i": first_i,
+            "last_i": last_i,
+            "trace_i": trace_i,
+            "trace_value": trace_value}
+
+def _SummariseMCMCChainForBasin(basin, shared_data):
+    """The basin worker of plot_MCMC_analysis"""
+    chain_file = shared_data["DataDirectory"]+shared_data["fname_prefix"]+'_Basin%s_chain.csv' %str(basin)
+    return SummariseMCMCChain(chain_file, **shared_data["summary_options"])
+
+def plot_MCMC_analysis(DataDirectory,fname_prefix,basin_list=[],FigFormat='png',size_format='ESURF',
+                       burn_in=0, n_processes=1, chunksize=100000, max_trace_points=5000):
+    """
+    This function makes a plot of the MCMC uncertainty analysis for the MLE collinearity.
+    The chain files are read in chunks (see SummariseMCMCChain) so only a summary and a decimated
+    trace of each chain are kept. The summaries are also written to the file with the suffix '_MCMC_summary.csv'.
 
     Args:
         DataDirectory (str): the data directory
@@ -1531,6 +2272,13 @@ def plot_MCMC_analysis(DataDirectory,fname_prefix,basin_list=[],FigFormat='png',
         basin_list: list of basins to analyse. If none are passed then all basins are plotted.
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        burn_in (int): The number of iterations at the start of each chain left out of the summary statistics
+        n_processes (int): The number of processes used to read the chains. 0 uses all the cores. Default is 1.
+        chunksize (int): The number of rows of a chain read at a time
+        max_trace_points (int): The maximum number of accepted values plotted for each chain
+
+    Returns:
+        A dict with the summary of the chain of each basin
 
     Author: FJC
     """
@@ -1563,27 +2311,27 @@ def plot_MCMC_analysis(DataDirectory,fname_prefix,basin_list=[],FigFormat='png',
     MOverNDict = SimpleMaxMLECheck(basin_stats_df)
 
     if basin_list == []:
-        print "You didn't give me a basin list so I'm going to plot all of them!"
+        print("You didn't give me a basin list so I'm going to plot all of them!")
         basin_list = basin_keys
+    basin_list = [int(basin) for basin in basin_list]
 
-    for basin in basin_list:
-        # read in the chain csv file
-        chain_df = Helper.ReadChainCSV(DataDirectory,fname_prefix,int(basin))
+    # summarise the chains
+    shared_data = {"DataDirectory": DataDirectory,
+                   "fname_prefix": fname_prefix,
+                   "summary_options": {"burn_in": burn_in, "chunksize": chunksize, "max_trace_points": max_trace_points}}
+    summaries = RunBasinJobs(_SummariseMCMCChainForBasin, basin_list, shared_data, n_processes)
+    summary_dict = dict(zip(basin_list, summaries))
 
-        best_fit_movern = MOverNDict[int(basin)]
-        print "The best fit m/n is:", best_fit_movern
-        n_iterations = len(chain_df['i'])
-        #print n_iterations
-        best_fit_line = [best_fit_movern] * len(chain_df['i'])
+    summary_rows = []
+    for basin in basin_list:
+        summary = summary_dict[basin]
 
-        # find the accepted values
-        chain_df['AcceptedMask'] = chain_df['NAccepted'].diff()
-        masked_df = chain_df.where(chain_df['AcceptedMask'] == 1.0)
-        #print chain_df
+        best_fit_movern = MOverNDict[basin]
+        print("The best fit m/n is: "+str(best_fit_movern))
 
         # plot the parameter with number of iterations
-        ax.plot(masked_df['i'], masked_df['movern_New'], c='0.5', lw=0.5, zorder=1)
-        ax.plot(chain_df['i'], best_fit_line, 'k--', zorder=100)
+        ax.plot(summary['trace_i'], summary['trace_value'], c='0.5', lw=0.5, zorder=1)
+        ax.plot([summary['first_i'],summary['last_i']], [best_fit_movern,best_fit_movern], 'k--', zorder=100)
 
         #set plot labels
         ax.set_xlabel('N iterations')
@@ -1595,51 +2343,151 @@ def plot_MCMC_analysis(DataDirectory,fname_prefix,basin_list=[],FigFormat='png',
         plt.savefig(ImageName, format=FigFormat, dpi=300)
         ax.cla()
 
+        this_row = {"basin_key": basin, "best_fit_movern": best_fit_movern,
+                    "n_iterations": summary["n_iterations"], "n_samples": summary["n_samples"],
+                    "acceptance_rate": summary["acceptance_rate"], "mean": summary["mean"], "std": summary["std"],
+                    "min": summary["min"], "max": summary["max"]}
+        for p in sorted(summary["percentiles"]):
+            this_row["percentile_"+str(p)] = summary["percentiles"][p]
+        summary_rows.append(this_row)
+
+    # write the summaries
+    if len(summary_rows) > 0:
+        SummaryDF = pd.DataFrame(summary_rows)
+        SummaryDF.to_csv(DataDirectory+fname_prefix+'_MCMC_summary.csv', index=False)
+
+    return summary_dict
+
 #=============================================================================
 # SENSITIVITY FUNCTIONS
 # Functions that make plots of sensitivity tests on the m/n analysis
 #=============================================================================
-def PlotSensitivityResultsSigma(DataDirectory,fname_prefix, FigFormat = "png", size_format = "ESURF"):
+def _ParseParameterValue(value_string):
+    """Turns the value at the end of a sweep directory name into an int or float if it is one"""
+    for parse in (int, float):
+        try:
+            return parse(value_string)
+        except ValueError:
+            pass
+    return value_string
+
+def _ReadSweepDirectory(this_dir, shared_data):
     """
-    This function makes a plot of the results of a sensitivity analysis on sigma in the MLE method
-    of calculating m/n.
-    You need to specify the base directory - will look in every folder in this base directory
-    with the prefix "Chi_analysis_sigma_" and get the m/n analysis in each sub-directory.
+    Gets the best fit m/n of every basin in one run directory of a parameter sweep.
+    This is the worker of ReadParameterSweepResults.
+
+    Author: FJC
+    """
+    print(this_dir)
+    parameter = shared_data["parameter"]
+
+    # get this value of the parameter from the directory name
+    this_value = _ParseParameterValue(os.path.basename(os.path.normpath(this_dir)).split("_")[-1])
+
+    # get the best fit m/n dataframe
+    BasinDF = Helper.ReadBasinStatsCSV(this_dir,shared_data["fname_prefix"])
+    MOverNDict = SimpleMaxMLECheck(BasinDF)
+    return pd.DataFrame({parameter: [this_value] * len(MOverNDict),
+                         "basin_key": list(MOverNDict.keys()),
+                         "m_over_n": list(MOverNDict.values())},
+                        columns = [parameter, "basin_key", "m_over_n"])
+
+def ReadParameterSweepResults(DataDirectory, fname_prefix, parameter = "sigma", n_processes = 1, use_cache = False):
+    """
+    This collects the best fit m/n of every basin from a parameter sweep, where each run is in a
+    sub-directory called "Chi_analysis_<parameter>_<value>" (i.e. Chi_analysis_sigma_10).
+
+    If use_cache is True, the results of each directory are cached in the file with the suffix '_<parameter>_sweep_cache.csv'
+    in the root directory, along with the modification time and size of the basin stats file they came from.
+    Only the directories that are new or have changed are read again, and these are read in parallel.
 
     Args:
         DataDirectory (str): the root data directory
         fname_prefix (str): the DEM name without extension
-        FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
-        size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        parameter (str): The name of the parameter in the directory names
+        n_processes (int): The number of processes used to read the directories. 0 uses all the cores.
+        use_cache (bool): If True, use and update the cache file. Default is False.
+
+    Returns:
+        A pandas dataframe with the columns parameter, basin_key and m_over_n
 
     Author: FJC
     """
-    import os
-
-    # Try doing this as a dataframe and masking?!?!
-    columns = ["sigma", "basin_key", "m_over_n"]
-    combined_DF = pd.DataFrame(columns=columns)
+    columns = [parameter, "basin_key", "m_over_n"]
 
-    # loop through each sub-directory with the sensitivity results
-    MLE_str = "Chi_analysis_sigma_"
+    # find the run directories
+    MLE_str = "Chi_analysis_"+parameter+"_"
+    run_dirs = []
     for subdir, dirs, files in os.walk(DataDirectory):
-        for dir in dirs:
+        for dir in sorted(dirs):
             if MLE_str in dir:
-                this_dir = DataDirectory+"/"+dir+'/'
-                print this_dir
-
-                this_df = pd.DataFrame(columns=columns)
+                run_dirs.append(os.path.join(subdir,dir)+'/')
+
+    # the time stamp of the file we read in each directory
+    stamps = {}
+    for this_dir in run_dirs:
+        this_file = this_dir+fname_prefix+"_movernstats_basinstats.csv"
+        if os.path.isfile(this_file):
+            this_stat = os.stat(this_file)
+            # the modification time is kept in integer microseconds so it survives the csv file
+            stamps[this_dir] = (int(round(this_stat.st_mtime*1e6)), int(this_stat.st_size))
+        else:
+            print("I can't find the basin stats file in "+this_dir+", skipping it.")
+    run_dirs = [this_dir for this_dir in run_dirs if this_dir in stamps]
+
+    # get the results that haven't changed from the cache
+    cache_file = os.path.join(DataDirectory, fname_prefix+"_"+parameter+"_sweep_cache.csv")
+    results = {}
+    if use_cache and os.path.isfile(cache_file):
+        CacheDF = pd.read_csv(cache_file)
+        for this_dir, this_df in CacheDF.groupby("directory"):
+            if this_dir in stamps and (this_df["mtime_us"].iloc[0], this_df["size"].iloc[0]) == stamps[this_dir]:
+                results[this_dir] = this_df[columns].copy()
+                results[this_dir][parameter] = [_ParseParameterValue(str(v)) for v in this_df[parameter]]
+
+    # now read the new directories
+    new_dirs = [this_dir for this_dir in run_dirs if this_dir not in results]
+    print("I have "+str(len(run_dirs)-len(new_dirs))+" cached runs and "+str(len(new_dirs))+" runs to read.")
+    shared_data = {"fname_prefix": fname_prefix, "parameter": parameter}
+    for this_dir, this_df in zip(new_dirs, RunBasinJobs(_ReadSweepDirectory, new_dirs, shared_data, n_processes)):
+        results[this_dir] = this_df
+
+    if len(run_dirs) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # update the cache
+    if use_cache and len(new_dirs) > 0:
+        cache_dfs = []
+        for this_dir in run_dirs:
+            this_df = results[this_dir].copy()
+            this_df["directory"] = this_dir
+            this_df["mtime_us"] = stamps[this_dir][0]
+            this_df["size"] = stamps[this_dir][1]
+            cache_dfs.append(this_df)
+        pd.concat(cache_dfs, ignore_index=True).to_csv(cache_file, index=False)
+
+    # one concatenation of all the runs
+    return pd.concat([results[this_dir] for this_dir in run_dirs], ignore_index=True)
+
+def PlotSensitivityResultsSigma(DataDirectory,fname_prefix, FigFormat = "png", size_format = "ESURF", n_processes = 1):
+    """
+    This function makes a plot of the results of a sensitivity analysis on sigma in the MLE method
+    of calculating m/n.
+    You need to specify the base directory - will look in every folder in this base directory
+    with the prefix "Chi_analysis_sigma_" and get the m/n analysis in each sub-directory
+    (see ReadParameterSweepResults).
 
-                # get this value of sigma
-                this_sigma = (dir.split("_"))[-1]
+    Args:
+        DataDirectory (str): the root data directory
+        fname_prefix (str): the DEM name without extension
+        FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
+        size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        n_processes (int): The number of processes used to read the sub-directories. 0 uses all the cores. Default is 1.
 
-                # get the best fit m/n dataframe
-                BasinDF = Helper.ReadBasinStatsCSV(this_dir,fname_prefix)
-                MOverNDict = SimpleMaxMLECheck(BasinDF)
-                this_df['sigma'] = [int(this_sigma)] * len(MOverNDict)
-                this_df['basin_key'] = MOverNDict.keys()
-                this_df['m_over_n'] = MOverNDict.values()
-                combined_DF = combined_DF.append(this_df, ignore_index=True)
+    Author: FJC
+    """
+    # get the best fit m/n of every basin for every sigma
+    combined_DF = ReadParameterSweepResults(DataDirectory, fname_prefix, "sigma", n_processes)
 
     # Set up fonts for plots
     label_size = 10
@@ -1672,8 +2520,8 @@ def PlotSensitivityResultsSigma(DataDirectory,fname_prefix, FigFormat = "png", s
     for key in basin_keys:
         this_df = combined_DF.loc[combined_DF['basin_key'] == key]
         #sort the data for plotting
-        this_df.sort_values('sigma',inplace=True)
-        this_df = this_df.loc[combined_DF['m_over_n'] > 0.2]
+        this_df = this_df.sort_values('sigma')
+        this_df = this_df.loc[this_df['m_over_n'] > 0.2]
         if not this_df.empty:
             keys.append(int(key))
             sigmas.append(this_df['sigma'].iloc[0])
@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from osgeo import osr
 from . import LSDMap_OSystemTools as LSDOst
+from . import LSDMap_GDALIO as LSDMap_IO
 import os
 import glob
 import pandas
@@ -86,6 +87,152 @@ def ConvertAllCSVToShapefile(path):
         thisPointData.TranslateToReducedShapefile(FileName)
 
 
+#==============================================================================
+# A spatial index over point data in projected coordinates
+#==============================================================================
+class LSDMap_PointSpatialIndex(object):
+    """This is a spatial index over a set of points in projected (i.e. UTM) coordinates.
+
+    The points are bucketed into a regular grid (sorted by cell so each cell is a
+    contiguous slice of the point indices), which makes bounding box queries cheap.
+    If scipy is available a KD-tree is also built and used for radius and
+    nearest neighbour queries; otherwise these fall back on the grid.
+
+    Args:
+        easting (float): An array of eastings
+        northing (float): An array of northings
+        method (str): "kdtree" to also build a KD-tree, or "grid" for the grid only
+        cell_size (float): The size of the grid cells. If 0 it is chosen so that there are about 16 points per cell.
+
+    Author: SMM
+    """
+    def __init__(self, easting, northing, method = "kdtree", cell_size = 0):
+
+        self.easting = np.asarray(easting, dtype = np.float64)
+        self.northing = np.asarray(northing, dtype = np.float64)
+        self.n_points = self.easting.size
+
+        if self.n_points == 0:
+            self.x_min = self.y_min = 0.0
+            x_range = y_range = 0.0
+        else:
+            self.x_min = np.nanmin(self.easting)
+            self.y_min = np.nanmin(self.northing)
+            x_range = np.nanmax(self.easting) - self.x_min
+            y_range = np.nanmax(self.northing) - self.y_min
+
+        # Pick a cell size that gives roughly 16 points per cell
+        if cell_size <= 0:
+            area = max(x_range,1.0)*max(y_range,1.0)
+            cell_size = np.sqrt(area*16.0/max(self.n_points,1))
+        self.cell_size = float(cell_size)
+        self.n_cols = int(x_range // self.cell_size) + 1
+        self.n_rows = int(y_range // self.cell_size) + 1
+
+        # Sort the points by cell; offsets[k]:offsets[k+1] are the points in cell k
+        cell_keys = self._cell_rows(self.northing)*self.n_cols + self._cell_cols(self.easting)
+        self.order = np.argsort(cell_keys, kind = "mergesort")
+        self.offsets = np.searchsorted(cell_keys[self.order], np.arange(self.n_rows*self.n_cols+1))
+
+        self.tree = None
+        if method == "kdtree" and self.n_points > 0:
+            try:
+                from scipy.spatial import cKDTree
+                self.tree = cKDTree(np.column_stack((self.easting,self.northing)))
+            except ImportError:
+                print("I could not import scipy so I will only use a grid index.")
+
+    def __len__(self):
+        return self.n_points
+
+    def _cell_cols(self, x):
+        cols = np.floor((np.asarray(x, dtype = np.float64)-self.x_min)/self.cell_size)
+        return np.clip(np.nan_to_num(cols),0,self.n_cols-1).astype(np.int64)
+
+    def _cell_rows(self, y):
+        rows = np.floor((np.asarray(y, dtype = np.float64)-self.y_min)/self.cell_size)
+        return np.clip(np.nan_to_num(rows),0,self.n_rows-1).astype(np.int64)
+
+    def query_bbox(self, x_min, x_max, y_min, y_max):
+        """Gets the indices of the points within a bounding box.
+
+        Args:
+            x_min (float): The minimum easting
+            x_max (float): The maximum easting
+            y_min (float): The minimum northing
+            y_max (float): The maximum northing
+
+        Returns:
+            An array of point indices, in the original order of the points
+
+        Author: SMM
+        """
+        x_min, x_max = min(x_min,x_max), max(x_min,x_max)
+        y_min, y_max = min(y_min,y_max), max(y_min,y_max)
+
+        # only visit the grid rows and columns that overlap the box
+        c0 = self._cell_cols(x_min)
+        c1 = self._cell_cols(x_max)
+        rows = np.arange(self._cell_rows(y_min), self._cell_rows(y_max)+1)
+        starts = self.offsets[rows*self.n_cols+c0]
+        ends = self.offsets[rows*self.n_cols+c1+1]
+        if rows.size == 0 or np.sum(ends-starts) == 0:
+            return np.array([], dtype = np.int64)
+        candidates = self.order[np.concatenate([np.arange(s,e) for s,e in zip(starts,ends)])]
+
+        ea = self.easting[candidates]
+        no = self.northing[candidates]
+        inside = (ea >= x_min) & (ea <= x_max) & (no >= y_min) & (no <= y_max)
+        return np.sort(candidates[inside])
+
+    def query_radius(self, x, y, radius):
+        """Gets the indices of the points within a radius of a location.
+
+        Args:
+            x (float): The easting of the location
+            y (float): The northing of the location
+            radius (float): The search radius
+
+        Returns:
+            An array of point indices, in the original order of the points
+
+        Author: SMM
+        """
+        if self.tree is not None:
+            return np.sort(np.asarray(self.tree.query_ball_point([x,y],radius), dtype = np.int64))
+
+        candidates = self.query_bbox(x-radius,x+radius,y-radius,y+radius)
+        dist2 = (self.easting[candidates]-x)**2+(self.northing[candidates]-y)**2
+        return candidates[dist2 <= radius*radius]
+
+    def query_nearest(self, x, y, n_neighbours = 1):
+        """Gets the nearest points to a location.
+
+        Args:
+            x (float): The easting of the location
+            y (float): The northing of the location
+            n_neighbours (int): The number of neighbours to find
+
+        Returns:
+            Two arrays: the distances and the point indices, sorted by distance
+
+        Author: SMM
+        """
+        n_neighbours = min(n_neighbours, self.n_points)
+        if n_neighbours < 1:
+            return np.array([]), np.array([], dtype = np.int64)
+
+        if self.tree is not None:
+            dist, idx = self.tree.query([x,y], k = n_neighbours)
+            return np.atleast_1d(dist), np.atleast_1d(idx).astype(np.int64)
+
+        # Without a tree we do a brute force partial sort
+        dist = np.sqrt((self.easting-x)**2+(self.northing-y)**2)
+        idx = np.argpartition(dist, n_neighbours-1)[:n_neighbours]
+        idx = idx[np.argsort(dist[idx])]
+        return dist[idx], idx.astype(np.int64)
+
+
 class LSDMap_PointData(object):
 
     # The constructor: it needs a filename to read
@@ -108,6 +255,10 @@ class LSDMap_PointData(object):
 
         self.PANDEX = PANDEX
 
+        # The spatial index is built on demand (see BuildSpatialIndex)
+        self._SpatialIndex = None
+        self._SpatialIndexEPSG = ""
+
         ######################### THIS PART OF THE CODE IS ONLY USING PANDAS #########################
         if(self.PANDEX == True):
             print("Warning, you are using an experimental version of LSDMT that is implementing Pandas dataframe to improve the performance. It is still unstable, switch PANDEX to False in your PointData parameters to use the regular way")
@@ -481,6 +632,7 @@ class LSDMap_PointData(object):
 
         if(self.PANDEX):
             self.PointData = self.PointData[self.PointData[data_name]<Threshold_value]
+            self._SpatialIndex = None
             self.Longitude = self.PointData["longitude"]
             self.Latitude = self.PointData["latitude"]
         else:
@@ -512,6 +664,7 @@ class LSDMap_PointData(object):
             self.PointData = NewDataDict
             self.Latitude = NewLat
             self.Longitude = NewLon
+            self._SpatialIndex = None
 
 
 ##==============================================================================
@@ -544,6 +697,7 @@ class LSDMap_PointData(object):
                 this_data = self.PointData[data_name]
         if(self.PANDEX):
             self.PointData = self.PointData[self.PointData[data_name].isin(data_for_selection_list)]
+            self._SpatialIndex = None
             self.Longitude = self.PointData["longitude"]
             self.Latitude = self.PointData["latitude"]
         else:
@@ -582,6 +736,7 @@ class LSDMap_PointData(object):
             self.PointData = NewDataDict
             self.Latitude = NewLat
             self.Longitude = NewLon
+            self._SpatialIndex = None
 
         #print("The updated data is:")
         #print(self.PointData[data_name])
@@ -634,6 +789,7 @@ class LSDMap_PointData(object):
                             self.PointData = self.PointData[~self.PointData[data_name].isin(value)]
                         else:
                             print("Something wrong happened, are you trying to select your data using < or > with a list rather than a single value??? in this case I cannot do it yet I am so sorry.")
+            self._SpatialIndex = None
             self.Longitude = self.PointData["longitude"]
             self.Latitude = self.PointData["latitude"]
 
@@ -696,9 +852,139 @@ class LSDMap_PointData(object):
         self.PointData = NewDataDict
         self.Latitude = NewLat
         self.Longitude = NewLon
+        self._SpatialIndex = None
 
 
 
+##==============================================================================
+##==============================================================================
+## Spatial indexing
+##==============================================================================
+##==============================================================================
+    def BuildSpatialIndex(self, EPSG_string, method = "kdtree", cell_size = 0):
+        """This builds a spatial index over the points in projected coordinates.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates you want (i.e. epsg:326XX)
+            method (str): "kdtree" or "grid". The kdtree needs scipy.
+            cell_size (float): Cell size of the grid index. If 0 it is chosen from the point density.
+
+        Returns:
+            An LSDMap_PointSpatialIndex object. It is also kept in the object until the data is thinned.
+
+        Author: SMM
+        """
+        [easting,northing] = self.GetUTMEastingNorthing(EPSG_string)
+        self._SpatialIndex = LSDMap_PointSpatialIndex(easting, northing, method = method, cell_size = cell_size)
+        self._SpatialIndexEPSG = EPSG_string
+        return self._SpatialIndex
+
+    def GetSpatialIndex(self, EPSG_string, method = "kdtree"):
+        """Returns the spatial index for this EPSG code, building it only if it does not already exist.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates you want (i.e. epsg:326XX)
+            method (str): "kdtree" or "grid", used if the index has to be built.
+
+        Returns:
+            An LSDMap_PointSpatialIndex object
+
+        Author: SMM
+        """
+        if self._SpatialIndex is None or self._SpatialIndexEPSG != EPSG_string:
+            self.BuildSpatialIndex(EPSG_string, method = method)
+        return self._SpatialIndex
+
+    def QueryBoundingBox(self, EPSG_string, x_min, x_max, y_min, y_max):
+        """Returns the indices of the points within a bounding box given in projected coordinates.
+
+        Args:
+            EPSG_string (str): The EPSG code of the bounding box coordinates
+            x_min (float): The minimum easting
+            x_max (float): The maximum easting
+            y_min (float): The minimum northing
+            y_max (float): The maximum northing
+
+        Returns:
+            An array of point indices
+
+        Author: SMM
+        """
+        return self.GetSpatialIndex(EPSG_string).query_bbox(x_min, x_max, y_min, y_max)
+
+    def QueryRadius(self, EPSG_string, x, y, radius):
+        """Returns the indices of the points within a radius of a location in projected coordinates.
+
+        Args:
+            EPSG_string (str): The EPSG code of the location coordinates
+            x (float): The easting of the location
+            y (float): The northing of the location
+            radius (float): The search radius
+
+        Returns:
+            An array of point indices
+
+        Author: SMM
+        """
+        return self.GetSpatialIndex(EPSG_string).query_radius(x, y, radius)
+
+    def QueryNearest(self, EPSG_string, x, y, n_neighbours = 1):
+        """Returns the nearest points to a location in projected coordinates.
+
+        Args:
+            EPSG_string (str): The EPSG code of the location coordinates
+            x (float): The easting of the location
+            y (float): The northing of the location
+            n_neighbours (int): The number of neighbours
+
+        Returns:
+            Two arrays: the distances and the point indices, sorted by distance
+
+        Author: SMM
+        """
+        return self.GetSpatialIndex(EPSG_string).query_nearest(x, y, n_neighbours)
+
+    def SampleRasters(self, raster_files, column_names = [], method = "nearest", EPSG_string = ""):
+        """Samples one or more rasters at the locations of the points and adds the values as new data columns.
+
+        Only the raster blocks that contain points are read.
+
+        Args:
+            raster_files (list or str): The filenames (with path and extension) of the rasters.
+            column_names (list): The names of the new columns. If empty, the raster file prefixes are used.
+            method (str): "nearest" or "bilinear"
+            EPSG_string (str): The EPSG code of the rasters. If empty it is read from the first raster.
+
+        Returns:
+            None, but the point data gets new columns. Points outside the rasters or on nodata get nan.
+
+        Author: SMM
+        """
+        if isinstance(raster_files, str):
+            raster_files = [raster_files]
+        if len(column_names) == 0:
+            column_names = [LSDOst.GetFilePrefix(raster_file) for raster_file in raster_files]
+        if len(column_names) != len(raster_files):
+            print("You need one column name per raster, I am not sampling anything.")
+            return
+
+        if EPSG_string == "":
+            EPSG_string = LSDMap_IO.GetUTMEPSG(raster_files[0])
+
+        # the projected coordinates are cached with the spatial index
+        spatial_index = self.GetSpatialIndex(EPSG_string)
+        sampled = LSDMap_IO.SampleRastersAtPoints(raster_files, spatial_index.easting, spatial_index.northing, method = method)
+
+        for raster_file, name in zip(raster_files, column_names):
+            print("Adding the column " + name + " sampled from " + raster_file)
+            self.PointData[name] = sampled[raster_file]
+            if name not in self.VariableList:
+                self.VariableList.append(name)
+                if(self.PANDEX == False):
+                    self.DataTypes.append(float)
+        if(self.PANDEX):
+            self.DataTypes = self.PointData.dtypes
+
 ##==============================================================================
 ##==============================================================================
 ## Format conversion
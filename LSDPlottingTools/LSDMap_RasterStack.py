@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+A store for time series of rasters that all have the same shape (i.e. the water depths
+or elevations written at each timestep of a flood or landscape evolution model run).
+
+The rasters are converted once into a 3D stack (time x rows x cols) split into chunks,
+each saved as a numpy file in a directory. Uncompressed chunks are memory mapped when
+they are read; compressed chunks (zlib, in .npz files) take less space but are read
+whole. The chunks span several frames and a block of rows and columns, so reading
+one frame and reading the time series of one pixel both only touch a few chunks.
+
+@author: smudd
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import json
+import numpy as np
+
+# Increase this if the layout of the stack changes
+STACK_SCHEMA_VERSION = 1
+
+def _ChunkFileName(stack_directory, chunk_index, compress):
+    """The file of the chunk with index (time, row, col)"""
+    extension = ".npz" if compress else ".npy"
+    return os.path.join(stack_directory, "chunk_%d_%d_%d%s" % (tuple(chunk_index)+(extension,)))
+
+def ConvertRastersToStack(raster_files, stack_directory, chunks = (32,256,256),
+                          compress = False, dtype = "float32", timesteps = None):
+    """
+    Converts a list of rasters with the same shape into a chunked stack. The rasters
+    are read one at a time, and only one chunk of frames is in memory at once.
+
+    Args:
+        raster_files (list): The rasters, in time order
+        stack_directory (str): The directory of the stack. It is made if it doesn't exist.
+        chunks (tuple): The number of frames, rows and columns in each chunk
+        compress (bool): If True the chunks are compressed (and can't be memory mapped)
+        dtype (str): The data type of the stack. Nodata is stored as nan so it should be a float type.
+        timesteps (list): The time of each raster. Default is 0,1,2...
+
+    Returns:
+        The RasterStack
+
+    Author: SMM
+    """
+    from LSDPlottingTools import LSDMap_GDALIO as LSDMap_IO
+
+    raster_files = list(raster_files)
+    if len(raster_files) == 0:
+        raise ValueError("You need to give me at least one raster")
+    if timesteps is None:
+        timesteps = list(range(len(raster_files)))
+
+    NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(raster_files[0])
+    shape = (len(raster_files), ysize, xsize)
+    chunks = tuple(int(min(c, s)) for c, s in zip(chunks, shape))
+
+    if not os.path.isdir(stack_directory):
+        os.makedirs(stack_directory)
+
+    # fill a slab of frames, then cut it into chunks
+    for t0 in range(0, shape[0], chunks[0]):
+        these_files = raster_files[t0:t0+chunks[0]]
+        slab = np.empty((len(these_files), ysize, xsize), dtype = dtype)
+        for i, raster_file in enumerate(these_files):
+            print("Adding "+raster_file+" to the stack")
+            frame = LSDMap_IO.ReadRasterArrayBlocks(raster_file)
+            if frame.shape != (ysize, xsize):
+                raise ValueError("The raster "+raster_file+" doesn't have the same shape as "+raster_files[0])
+            slab[i] = frame
+            if NDV is not None:
+                slab[i][frame == NDV] = np.nan
+
+        for r0 in range(0, ysize, chunks[1]):
+            for c0 in range(0, xsize, chunks[2]):
+                chunk = slab[:, r0:r0+chunks[1], c0:c0+chunks[2]]
+                chunk_index = (t0//chunks[0], r0//chunks[1], c0//chunks[2])
+                filename = _ChunkFileName(stack_directory, chunk_index, compress)
+                if compress:
+                    np.savez_compressed(filename, chunk = chunk)
+                else:
+                    np.save(filename, chunk)
+
+    metadata = {"schema_version": STACK_SCHEMA_VERSION,
+                "shape": list(shape),
+                "chunks": list(chunks),
+                "dtype": str(np.dtype(dtype)),
+                "compress": bool(compress),
+                "timesteps": [float(t) for t in timesteps],
+                "raster_files": [os.path.basename(f) for f in raster_files],
+                "GeoTransform": list(GeoT) if GeoT is not None else None,
+                "Projection": Projection}
+    with open(os.path.join(stack_directory, "stack.json"), "w") as f:
+        json.dump(metadata, f, indent = 1)
+
+    return RasterStack(stack_directory)
+
+class RasterStack(object):
+    """
+    Reads a stack made by ConvertRastersToStack. Only the chunks that cover the part of
+    the stack you ask for are read.
+
+    Args:
+        stack_directory (str): The directory of the stack
+
+    Author: SMM
+    """
+    def __init__(self, stack_directory):
+        self.stack_directory = stack_directory
+        with open(os.path.join(stack_directory, "stack.json"), "r") as f:
+            metadata = json.load(f)
+        if metadata["schema_version"] != STACK_SCHEMA_VERSION:
+            raise ValueError("The stack in "+stack_directory+" is from another version, please convert the rasters again.")
+
+        self.shape = tuple(metadata["shape"])
+        self.chunks = tuple(metadata["chunks"])
+        self.dtype = np.dtype(metadata["dtype"])
+        self.compress = metadata["compress"]
+        self.timesteps = np.asarray(metadata["timesteps"])
+        self.raster_files = metadata["raster_files"]
+        self.GeoTransform = metadata["GeoTransform"]
+        self.Projection = metadata["Projection"]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _load_chunk(self, chunk_index):
+        filename = _ChunkFileName(self.stack_directory, chunk_index, self.compress)
+        if self.compress:
+            with np.load(filename) as chunk_file:
+                return chunk_file["chunk"]
+        return np.load(filename, mmap_mode = "r")
+
+    def read(self, frames = slice(None), rows = slice(None), cols = slice(None)):
+        """
+        Reads a block of the stack.
+
+        Args:
+            frames, rows, cols (slice): The part of the stack (steps of 1 only)
+
+        Returns:
+            A (frames, rows, cols) numpy array
+
+        Author: SMM
+        """
+        ranges = []
+        for s, n in zip((frames, rows, cols), self.shape):
+            start, stop, step = s.indices(n)
+            if step != 1:
+                raise ValueError("RasterStack.read only takes slices with a step of 1")
+            ranges.append((start, max(stop, start)))
+
+        out = np.empty([stop-start for start, stop in ranges], dtype = self.dtype)
+        chunk_ranges = [range(start//c, (stop-1)//c+1) if stop > start else range(0)
+                        for (start, stop), c in zip(ranges, self.chunks)]
+        for ti in chunk_ranges[0]:
+            for ri in chunk_ranges[1]:
+                for ci in chunk_ranges[2]:
+                    chunk = self._load_chunk((ti, ri, ci))
+                    # the overlap of the chunk and the block, in stack coordinates
+                    lo = [max(start, i*c) for (start, stop), i, c in zip(ranges, (ti, ri, ci), self.chunks)]
+                    hi = [min(stop, (i+1)*c) for (start, stop), i, c in zip(ranges, (ti, ri, ci), self.chunks)]
+                    out[lo[0]-ranges[0][0]:hi[0]-ranges[0][0],
+                        lo[1]-ranges[1][0]:hi[1]-ranges[1][0],
+                        lo[2]-ranges[2][0]:hi[2]-ranges[2][0]] = chunk[lo[0]-ti*self.chunks[0]:hi[0]-ti*self.chunks[0],
+                                                                       lo[1]-ri*self.chunks[1]:hi[1]-ri*self.chunks[1],
+                                                                       lo[2]-ci*self.chunks[2]:hi[2]-ci*self.chunks[2]]
+        return out
+
+    def _index(self, i, axis):
+        # an index along one axis, counting from the end if it is negative
+        n = self.shape[axis]
+        if i < -n or i >= n:
+            raise IndexError("index "+str(i)+" is out of range for a stack of shape "+str(self.shape))
+        return i+n if i < 0 else i
+
+    def frame(self, i):
+        """Returns the raster of frame i (negative i counts from the last frame)"""
+        i = self._index(i, 0)
+        return self.read(frames = slice(i, i+1))[0]
+
+    def pixel_series(self, row, col):
+        """Returns the time series of one pixel"""
+        row = self._index(row, 1)
+        col = self._index(col, 2)
+        return self.read(rows = slice(row, row+1), cols = slice(col, col+1))[:,0,0]
+
+    def reduce_over_time(self, ufunc = np.fmax, frames = slice(None)):
+        """
+        Reduces the frames to one raster, one chunk of frames at a time (i.e. the
+        maximum water depth over a flood).
+
+        Args:
+            ufunc (numpy ufunc): The reduction. np.fmax and np.fmin ignore nan.
+            frames (slice): The frames to reduce
+
+        Returns:
+            The reduced raster
+
+        Author: SMM
+        """
+        start, stop, step = frames.indices(self.shape[0])
+        result = None
+        t0 = start
+        while t0 < stop:
+            # to the end of this chunk of frames
+            t1 = min(stop, (t0//self.chunks[0]+1)*self.chunks[0])
+            reduced = ufunc.reduce(self.read(frames = slice(t0, t1)), axis = 0)
+            result = reduced if result is None else ufunc(result, reduced)
+            t0 = t1
+        return result
+
+    def max_over_time(self, frames = slice(None)):
+        """Returns the maximum of each pixel over the frames, ignoring nodata"""
+        return self.reduce_over_time(np.fmax, frames)
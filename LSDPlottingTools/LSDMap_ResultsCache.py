@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+A simple on-disk store for analysis results, so that plotting functions that need
+the same statistics (i.e. the best fit m/n values of each basin) don't recompute them.
+
+Results are saved as compressed numpy .npz files next to the input data. Each file is
+keyed by a hash of the input files and the analysis parameters, and records the
+version of the cache layout so that old files are ignored if the layout changes.
+
+@author: smudd
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import hashlib
+import numpy as np
+
+# Increase this if the layout of the cached arrays changes
+CACHE_SCHEMA_VERSION = 1
+
+def HashFiles(filenames, block_size = 2**20):
+    """
+    Makes a hash of the contents of a list of files.
+
+    Args:
+        filenames (list): The files
+        block_size (int): The number of bytes read at a time
+
+    Returns:
+        The hex digest of the files
+
+    Author: SMM
+    """
+    file_hash = hashlib.sha1()
+    for filename in filenames:
+        file_hash.update(os.path.basename(filename).encode("utf-8"))
+        with open(filename, "rb") as f:
+            block = f.read(block_size)
+            while block:
+                file_hash.update(block)
+                block = f.read(block_size)
+    return file_hash.hexdigest()
+
+def HashArrays(arrays):
+    """
+    Makes a hash of the contents of a list of numpy arrays (i.e. the columns of a
+    dataframe), for results that don't come straight from files.
+
+    Args:
+        arrays (list): The arrays
+
+    Returns:
+        The hex digest of the arrays
+
+    Author: SMM
+    """
+    array_hash = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        array_hash.update((str(a.dtype)+str(a.shape)).encode("utf-8"))
+        array_hash.update(a.tobytes() if a.dtype != object else repr(a.tolist()).encode("utf-8"))
+    return array_hash.hexdigest()
+
+def MakeCacheKey(file_hash, **parameters):
+    """
+    Combines the hash of the input files with the analysis parameters.
+
+    Args:
+        file_hash (str): The hash from HashFiles
+        parameters: The parameters of the analysis. Lists are used in the order given.
+
+    Returns:
+        The cache key (str)
+
+    Author: SMM
+    """
+    key = hashlib.sha1(file_hash.encode("utf-8"))
+    for name in sorted(parameters):
+        key.update((name+"="+repr(parameters[name])).encode("utf-8"))
+    return key.hexdigest()
+
+def CacheFileName(DataDirectory, fname_prefix, analysis_name, cache_key):
+    """Returns the name of the cache file for an analysis and key"""
+    return DataDirectory+fname_prefix+"_"+analysis_name+"_cache_"+cache_key[:16]+".npz"
+
+def SaveCachedArrays(filename, cache_key, arrays):
+    """
+    Saves a dict of numpy arrays to a cache file. The file is written to a
+    temporary name first so a half written file is never read.
+
+    Args:
+        filename (str): The cache file, from CacheFileName
+        cache_key (str): The cache key, from MakeCacheKey
+        arrays (dict): The arrays to save
+
+    Author: SMM
+    """
+    temp_filename = filename+".tmp.npz"
+    try:
+        np.savez_compressed(temp_filename, schema_version = np.array(CACHE_SCHEMA_VERSION),
+                            cache_key = np.array(cache_key), **arrays)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp_filename, filename)
+    except (IOError, OSError) as e:
+        print("I couldn't save the results cache "+filename+": "+str(e))
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+def LoadCachedArrays(filename, cache_key):
+    """
+    Loads the arrays from a cache file.
+
+    Args:
+        filename (str): The cache file, from CacheFileName
+        cache_key (str): The cache key, from MakeCacheKey
+
+    Returns:
+        A dict of arrays, or None if there is no usable cache (missing, from an
+        old schema version, for another key or unreadable).
+
+    Author: SMM
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with np.load(filename) as cached:
+            if int(cached["schema_version"]) != CACHE_SCHEMA_VERSION:
+                print("The results cache "+filename+" is from an old version, I'll recalculate.")
+                return None
+            if str(cached["cache_key"]) != cache_key:
+                return None
+            return dict((name, cached[name]) for name in cached.files if name not in ("schema_version","cache_key"))
+    except Exception as e:
+        print("I couldn't read the results cache "+filename+": "+str(e))
+        return None
+
+def PackRaggedArrays(arrays):
+    """
+    Packs a list of arrays (which can have different lengths along their last axis)
+    into one array concatenated along the last axis and an array of offsets.
+
+    Returns:
+        values, offsets: the arrays are values[...,offsets[i]:offsets[i+1]]
+
+    Author: SMM
+    """
+    offsets = np.zeros(len(arrays)+1, dtype = np.int64)
+    offsets[1:] = np.cumsum([np.shape(a)[-1] for a in arrays])
+    if len(arrays) == 0:
+        return np.zeros(0), offsets
+    return np.concatenate([np.asarray(a, dtype = float) for a in arrays], axis = -1), offsets
+
+def UnpackRaggedArrays(values, offsets):
+    """Reverses PackRaggedArrays"""
+    return [values[...,offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
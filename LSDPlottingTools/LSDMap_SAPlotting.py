@@ -59,7 +59,7 @@ def TestSARegression(DataDirectory, DEM_prefix):
 def SAPlotDriver(DataDirectory, DEM_prefix, FigFormat = 'show', size_format = "ESURF",
                  show_raw = True, show_segments = True,
                  cmap = plt.cm.Set1, n_colours = 10,
-                 basin_keys = []):
+                 basin_keys = [], log_A_bin_width = None):
     """
     This is a driver function that manages plotting of Slope-Area data
 
@@ -73,6 +73,9 @@ def SAPlotDriver(DataDirectory, DEM_prefix, FigFormat = 'show', size_format = "E
         cmap (string or colourmap): the colourmap use to colour tributaries
         n_colours (int): The number of coulours used in plotting tributaries
         basin_keys (list): A list of the basin keys to plot. If empty, plot all the basins.
+        log_A_bin_width (float): If given, the binned data are recalculated from the raw data
+        with this bin width (see BinSlopeAreaData) rather than read from the "_SAbinned.csv" file.
+        The segments still come from the "_SAsegmented.csv" file.
 
     Returns:
         Slope-area plot for each basin
@@ -84,15 +87,21 @@ def SAPlotDriver(DataDirectory, DEM_prefix, FigFormat = 'show', size_format = "E
     print("These basin keys are: ")
     print(basin_keys)
 
+    all_csv_fname = DataDirectory+DEM_prefix+'_SAvertical.csv'
+
     # read in binned data
-    binned_csv_fname = DataDirectory+DEM_prefix+'_SAbinned.csv'
-    print("I'm reading in the csv file "+binned_csv_fname)
-    binnedPointData = PointTools.LSDMap_PointData(binned_csv_fname)
+    if log_A_bin_width is None:
+        binned_csv_fname = DataDirectory+DEM_prefix+'_SAbinned.csv'
+        print("I'm reading in the csv file "+binned_csv_fname)
+        binnedPointData = PointTools.LSDMap_PointData(binned_csv_fname)
+    else:
+        print("I'm binning the raw data in "+all_csv_fname+" with a bin width of "+str(log_A_bin_width))
+        BinnedDF = BinSlopeAreaData(all_csv_fname, log_A_bin_width = log_A_bin_width)
+        binnedPointData = PointTools.LSDMap_PointData(BinnedDF, data_type = "pandas")
 
     # Read in the raw data
     if(show_raw):
         print("I am going to show the raw data.")
-        all_csv_fname = DataDirectory+DEM_prefix+'_SAvertical.csv'
         allPointData = PointTools.LSDMap_PointData(all_csv_fname)
 
     # Read in the segmented data
@@ -103,9 +112,7 @@ def SAPlotDriver(DataDirectory, DEM_prefix, FigFormat = 'show', size_format = "E
 
 
     # get the basin keys and check if the basins in the basin list exist
-    basin = binnedPointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    Basin = np.asarray(basin)
+    Basin = np.asarray(binnedPointData.QueryData('basin_key'), dtype = float).astype(int)
     these_basin_keys = np.unique(Basin)
 
     print("The unique basin keys are: ")
@@ -157,7 +164,144 @@ def SAPlotDriver(DataDirectory, DEM_prefix, FigFormat = 'show', size_format = "E
                 print("You selected an option that doesn't produce any plots. Turn either show raw or show segments to True.")
 
 
-def BinnedRegressionDriver(DataDirectory, DEM_prefix, basin_keys = []):
+def BinSlopeAreaData(RawData, log_A_bin_width = 0.1, minimum_points_per_bin = 1):
+    """
+    This bins the raw slope-area data (from the "_SAvertical.csv" file) in log drainage
+    area, for each source in each basin, so you can try different bin widths without
+    rerunning the chi mapping tool. The data are sorted once by basin, source and bin
+    and the statistics of every bin are taken from the sorted arrays with reduceat.
+
+    The bins are multiples of log_A_bin_width in log10 drainage area, so bins line up
+    between sources. Nodes with a slope or drainage area that is not positive are left out,
+    since they have no log.
+
+    Args:
+        RawData : A pandas dataframe, or the name of the "_SAvertical.csv" file
+        log_A_bin_width (float): The width of the bins in log10 drainage area
+        minimum_points_per_bin (int): Bins with fewer nodes than this are dropped
+
+    Returns:
+        A pandas dataframe with one row per bin, with the same columns the plotting functions
+        use from the "_SAbinned.csv" file (median_log_A, median_log_S, logS_FirstQuartile, etc.),
+        plus the number of nodes in each bin (n_nodes). The latitude and longitude are those of
+        the node at the median drainage area of the bin. It can be turned into point data with
+        LSDMap_PointData(df, data_type = "pandas").
+
+    Author: SMM
+    """
+    if not isinstance(RawData, pd.DataFrame):
+        RawData = pd.read_csv(RawData, sep=",")
+
+    S = RawData["slope"].values.astype(float)
+    A = RawData["drainage area"].values.astype(float)
+    Basin = RawData["basin_key"].values.astype(int)
+    SourceNumber = RawData["source_key"].values.astype(int)
+    Latitude = RawData["latitude"].values
+    Longitude = RawData["longitude"].values
+
+    # leave out the nodes without a log
+    valid = (S > 0) & (A > 0)
+    if not np.all(valid):
+        print("I am leaving out "+str(np.count_nonzero(~valid))+" nodes with zero or negative slope or area.")
+    logS = np.log10(S[valid])
+    logA = np.log10(A[valid])
+    Basin = Basin[valid]
+    SourceNumber = SourceNumber[valid]
+    Latitude = Latitude[valid]
+    Longitude = Longitude[valid]
+
+    # one sort for the bins of all the sources
+    bin_number = np.floor(logA/log_A_bin_width).astype(np.int64)
+    bins = LSDStats.GroupIndex(Basin, SourceNumber, bin_number)
+
+    # sort the nodes within each bin by area and by slope
+    A_order = bins.order_within(logA)
+    S_order = bins.order_within(logS)
+    median_node = A_order[bins.starts + (bins.sizes-1)//2]
+
+    BinnedDF = pd.DataFrame({"latitude": Latitude[median_node],
+                             "longitude": Longitude[median_node],
+                             "basin_key": bins.keys[0],
+                             "source_key": bins.keys[1],
+                             "n_nodes": bins.sizes,
+                             "median_log_A": bins.quantile(logA, 0.5, A_order),
+                             "mean_log_A": bins.mean(logA),
+                             "logA_FirstQuartile": bins.quantile(logA, 0.25, A_order),
+                             "logA_ThirdQuartile": bins.quantile(logA, 0.75, A_order),
+                             "median_log_S": bins.quantile(logS, 0.5, S_order),
+                             "mean_log_S": bins.mean(logS),
+                             "logS_FirstQuartile": bins.quantile(logS, 0.25, S_order),
+                             "logS_ThirdQuartile": bins.quantile(logS, 0.75, S_order)},
+                            columns = ["latitude", "longitude", "basin_key", "source_key", "n_nodes",
+                                       "median_log_A", "mean_log_A", "logA_FirstQuartile", "logA_ThirdQuartile",
+                                       "median_log_S", "mean_log_S", "logS_FirstQuartile", "logS_ThirdQuartile"])
+
+    if minimum_points_per_bin > 1:
+        BinnedDF = BinnedDF[BinnedDF["n_nodes"] >= minimum_points_per_bin].reset_index(drop = True)
+
+    return BinnedDF
+
+def BatchBinnedRegression(BinnedPointData, basin_keys = []):
+    """
+    This does the regressions of BinnedRegression for all the basins at once. The data are
+    read from the point data once and grouped by basin with a single sort, and the fits
+    are done with sums within each basin (see statsutilities.grouped_linregress).
+    The main stem of each basin is the source of the first row of the basin in the file.
+
+    Args:
+        BinnedPointData : LSDPointData object from the "_SAbinned.csv" file
+        basin_keys (list): A list of the basin keys. If empty, all the basins are used.
+
+    Returns:
+        A pandas dataframe with one row per basin, with the columns basin_key, mainstem_source_key,
+        and the number of points (n_), slope (m_) and intercept (b_) of the mainstem and all data fits,
+        with and without outlying residuals (suffix _no_outliers).
+
+    Author: SMM
+    """
+    # Get the slope, drainage area, basin ID and source ID, once
+    MedianLogSlope = np.asarray(BinnedPointData.QueryData('median_log_S'), dtype = float)
+    MedianLogArea = np.asarray(BinnedPointData.QueryData('median_log_A'), dtype = float)
+    Basin = np.asarray(BinnedPointData.QueryData('basin_key'), dtype = float).astype(int)
+    SourceNumber = np.asarray(BinnedPointData.QueryData('source_key'), dtype = float).astype(int)
+
+    if len(basin_keys) > 0:
+        these_rows = np.in1d(Basin, np.asarray(basin_keys, dtype = int))
+        MedianLogSlope = MedianLogSlope[these_rows]
+        MedianLogArea = MedianLogArea[these_rows]
+        Basin = Basin[these_rows]
+        SourceNumber = SourceNumber[these_rows]
+
+    # The sort is stable so the first row of each basin is the first in the file
+    basins = LSDStats.GroupIndex(Basin)
+    mainstem_source = SourceNumber[basins.order[basins.starts]]
+
+    results = {"basin_key": basins.keys[0], "mainstem_source_key": mainstem_source}
+
+    def fit_with_outliers(index, x, y, label):
+        # get the regression, then refit without the outlying residuals
+        m, b, n = LSDStats.grouped_linregress(index, x, y)
+        residuals = index.broadcast(m)*x + index.broadcast(b) - y
+        is_outlier_vec = LSDStats.grouped_is_outlier(index, residuals)
+        m_ro, b_ro, n_ro = LSDStats.grouped_linregress(index, x, y, ~is_outlier_vec)
+        results["n_"+label], results["m_"+label], results["b_"+label] = n.astype(int), m, b
+        results["n_"+label+"_no_outliers"], results["m_"+label+"_no_outliers"], results["b_"+label+"_no_outliers"] = n_ro.astype(int), m_ro, b_ro
+
+    # the main stem of every basin. Every basin has one so the groups line up with the basins
+    is_mainstem = SourceNumber == basins.broadcast(mainstem_source)
+    mainstem = LSDStats.GroupIndex(Basin[is_mainstem])
+    fit_with_outliers(mainstem, MedianLogArea[is_mainstem], MedianLogSlope[is_mainstem], "mainstem")
+
+    # all the data
+    fit_with_outliers(basins, MedianLogArea, MedianLogSlope, "all")
+
+    columns = ["basin_key", "mainstem_source_key"]
+    for label in ["mainstem", "all"]:
+        for suffix in ["", "_no_outliers"]:
+            columns.extend(["n_"+label+suffix, "m_"+label+suffix, "b_"+label+suffix])
+    return pd.DataFrame(results, columns = columns)
+
+def BinnedRegressionDriver(DataDirectory, DEM_prefix, basin_keys = [], use_cache = False):
     """
     This function goes through a basin list and reports back the best fit
     m/n values for mainstem data, all data, and both of these with outliers removed
@@ -166,28 +310,36 @@ def BinnedRegressionDriver(DataDirectory, DEM_prefix, basin_keys = []):
         DataDirectory (str): the path to the directory with the csv file
         DEM_prefix (str): name of your DEM without extension
         basin_keys (list): A list of the basin keys to plot. If empty, plot all the basins.
+        use_cache (bool): If True the results are saved to (and later read from) a cache file
+        in the data directory, keyed by the contents of the binned file and the basin keys. Default is False.
 
     Author: SMM
     """
     from LSDPlottingTools import LSDMap_PointTools as PointTools
+    from LSDPlottingTools import LSDMap_ResultsCache as RC
 
     print("These basin keys are: ")
     print(basin_keys)
 
     # read in binned data
     binned_csv_fname = DataDirectory+DEM_prefix+'_SAbinned.csv'
+
+    # See if we have already done this analysis
+    if use_cache:
+        cache_key = RC.MakeCacheKey(RC.HashFiles([binned_csv_fname]), basin_keys=[int(i) for i in basin_keys])
+        cache_file = RC.CacheFileName(DataDirectory, DEM_prefix, "SA_regression", cache_key)
+        cached = RC.LoadCachedArrays(cache_file, cache_key)
+        if cached is not None:
+            print("I found the results of this analysis in "+cache_file)
+            return dict((int(basin_key),list(values)) for basin_key,values in zip(cached["basins"],cached["movern"]))
+
     print("I'm reading in the csv file "+binned_csv_fname)
     binnedPointData = PointTools.LSDMap_PointData(binned_csv_fname)
 
     # get the basin keys and check if the basins in the basin list exist
-    basin = binnedPointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    Basin = np.asarray(basin)
+    Basin = np.asarray(binnedPointData.QueryData('basin_key'), dtype = float).astype(int)
     these_basin_keys = np.unique(Basin)
 
-    #print("The unique basin keys are: ")
-    #print(these_basin_keys)
-
     final_basin_keys = []
     # A bit of logic for checking keys
     if (len(basin_keys) == 0):
@@ -199,23 +351,22 @@ def BinnedRegressionDriver(DataDirectory, DEM_prefix, basin_keys = []):
             else:
                 final_basin_keys.append(basin)
 
-    #print("The final basin keys are:")
-    #print(final_basin_keys)
-
     print("There are "+str(len(final_basin_keys))+"basins that I will plot")
-    mn_by_basin_dict = {}
-    #basin_keys.append(0)
-    # Loop through the basin keys, making a plot for each one
-    for basin_key in final_basin_keys:
 
-        (m1,m2,m3,m4) = BinnedRegression(binnedPointData, basin_key)
-        this_basin_SA_mn = []
-        this_basin_SA_mn.append(m1)
-        this_basin_SA_mn.append(m2)
-        this_basin_SA_mn.append(m3)
-        this_basin_SA_mn.append(m4)
+    # Do the regressions for all the basins at once
+    RegressionDF = BatchBinnedRegression(binnedPointData, basin_keys = final_basin_keys)
+    RegressionDF = RegressionDF.set_index("basin_key")
 
-        mn_by_basin_dict[basin_key] = this_basin_SA_mn
+    mn_by_basin_dict = {}
+    for basin_key in final_basin_keys:
+        this_row = RegressionDF.loc[int(basin_key)]
+        mn_by_basin_dict[basin_key] = [this_row["m_mainstem"], this_row["m_mainstem_no_outliers"],
+                                       this_row["m_all"], this_row["m_all_no_outliers"]]
+
+    if use_cache:
+        RC.SaveCachedArrays(cache_file, cache_key,
+                            {"basins": np.asarray(list(mn_by_basin_dict.keys()), dtype = np.int64),
+                             "movern": np.asarray(list(mn_by_basin_dict.values()), dtype = float).reshape(-1,4)})
 
     return mn_by_basin_dict
 
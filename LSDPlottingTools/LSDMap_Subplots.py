@@ -311,41 +311,124 @@ def findmaxval_multirasters(FileList):
     """
     Loops through a list or array of rasters (np arrays)
     and finds the maximum single value in the set of arrays.
+    The maximum of each raster is computed by GDAL, without
+    reading the raster into an array.
     """
-    overall_max_val = 0
+    return max(LSDMap_IO.GetRasterMinMax(raster_file)[1] for raster_file in FileList)
 
-    for i in range (len(FileList)):
+def findminval_multirasters(FileList):
+    """
+    Loops through a list or array of rasters (np arrays)
+    and finds the minimum single value in the set of arrays.
+    The minimum of each raster is computed by GDAL, without
+    reading the raster into an array.
+    """
+    return min(LSDMap_IO.GetRasterMinMax(raster_file)[0] for raster_file in FileList)
 
-        raster_as_array = LSDMap_IO.ReadRasterArrayBlocks(FileList[i])
-        this_max_val = np.nanmax(raster_as_array)
+# Hillshades already made in this session, keyed by the file and its modification time
+_hillshade_cache = {}
 
-        if this_max_val > overall_max_val:
-            overall_max_val = this_max_val
-            print(overall_max_val)
+def SharedHillshade(elev_raster_file):
+    """
+    Returns the hillshade of an elevation raster, made only once per raster so
+    every panel (and every figure) with the same base raster shares it.
 
-    return overall_max_val
+    Author: SMM
+    """
+    key = (os.path.abspath(elev_raster_file), os.path.getmtime(elev_raster_file))
+    if key not in _hillshade_cache:
+        _hillshade_cache[key] = LSDMap_BP.Hillshade(elev_raster_file)
+    return _hillshade_cache[key]
+
+def _ReadDrapeRaster(raster_file):
+    """Reads a drape raster as floats, with nodata as nan so it isn't plotted"""
+    NDV = LSDMap_IO.GetGeoInfo(raster_file)[0]
+    drape = LSDMap_IO.ReadRasterArrayBlocks(raster_file).astype(float)
+    if NDV is not None:
+        drape[drape == NDV] = np.nan
+    return drape
+
+def ReadDrapeRasters(FileList, n_threads = 4):
+    """
+    Reads a list of drape rasters at the same time in a pool of threads
+    (GDAL releases the GIL while it reads). Nodata is set to nan.
 
-def findminval_multirasters(FileList):
+    Args:
+        FileList (list): The rasters
+        n_threads (int): The number of threads
+
+    Returns:
+        A list of arrays, in the order of FileList
+
+    Author: SMM
     """
-    Loops through a list or array of rasters (np arrays)
-    and finds the minimum single value in the set of arrays.
+    from multiprocessing.pool import ThreadPool
+
+    if len(FileList) < 2 or n_threads < 2:
+        return [_ReadDrapeRaster(raster_file) for raster_file in FileList]
+    pool = ThreadPool(min(n_threads, len(FileList)))
+    try:
+        return pool.map(_ReadDrapeRaster, FileList)
+    finally:
+        pool.close()
+        pool.join()
+
+def _RenderMultiDrape(DataDir, ElevationRaster, FPFiles, drapes, cmap,
+                      drape_min, drape_max, cbar_label, n_cols):
     """
-    overall_min_val = 0
+    Draws the drapes over the shared hillshade of the elevation raster, one panel
+    each, with the same colour limits, and adds the colourbar and axis labels.
 
-    for i in range (len(FileList)):
+    Author: DAV & SMM
+    """
+    n_files = len(FPFiles)
+    n_rows = max(2, int(np.ceil(n_files/float(n_cols))))
+    f, ax_arr = pp.subplots(n_rows, n_cols, figsize=(5*n_cols, 2.5*n_rows), sharex=True, sharey=True)
+    ax_arr = ax_arr.ravel()
 
-        raster_as_array = LSDMap_IO.ReadRasterArrayBlocks(FileList[i])
-        this_min_val = np.nanmin(raster_as_array)
+    elev_raster_file = DataDir + ElevationRaster
+    hillshade = SharedHillshade(elev_raster_file)
 
-        if this_min_val > overall_min_val:
-            overall_min_val = this_min_val
-            print(overall_min_val)
+    # now get the extent
+    extent_raster = LSDMap_IO.GetRasterExtent(elev_raster_file)
+    print("xmax: " + str(extent_raster[1]))
+    print("xmin: " + str(extent_raster[0]))
+    print("ymax: " + str(extent_raster[3]))
+    print("ymin: " + str(extent_raster[2]))
 
-    return overall_min_val
+    im = None
+    for i in range(n_files):
+        filename = os.path.basename(FPFiles[i])
+        title = lsdlabels.make_line_label(filename)
+        print(title)
+
+        ax_arr[i].imshow(hillshade, "gray", extent=extent_raster, interpolation="nearest")
+        """
+        Now we can set vmax to be the maximum water depth we calcualted earlier, making our separate
+        subplots all have the same colourscale
+        """
+        im = ax_arr[i].imshow(drapes[i], cmap, extent=extent_raster,
+                                alpha=1.0, interpolation="nearest",
+                                vmin=drape_min,
+                                vmax=drape_max)
+        ax_arr[i].set_title(title)
+        pp.setp( ax_arr[i].xaxis.get_majorticklabels(), rotation=70 )
+
+    f.subplots_adjust(right=0.85)
+    cax = f.add_axes([0.9, 0.1, 0.03, 0.8])
+
+    if im is not None:
+        cbar = f.colorbar(im, cax=cax)
+        cbar.set_label(cbar_label)
+
+    f.text(0.5, 0.04, 'Easting (m)', ha='center', fontsize=17)
+    f.text(0.04, 0.5, 'Northing (m)', va='center', rotation='vertical', fontsize=17)
+    return f, ax_arr
 
 
 def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
-                        drape_min_threshold=None, drape_max=None, cbar_label=None):
+                        drape_min_threshold=None, drape_max=None, cbar_label=None,
+                        n_cols=2, n_threads=4):
     """Creates a figure with multiple drape maps over a hillshade.
 
     Plots flood extents from water depth rasters
@@ -368,6 +451,8 @@ def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
 		above this value will be masked and not plotted.
 	cbar_label (str, optional): Label for the colourbar on the figure. This
 		is the colourbar for the drape colourmap.
+	n_cols (int, optional): The number of columns of panels.
+	n_threads (int, optional): The number of threads reading the drapes.
 
     Notes:
         Consider, if plotting multiple datasets, how you
@@ -380,108 +465,43 @@ def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
     Note: If `drape_max` is not set, the function searches for the maximum value
 	in the range of rasters found by expanding the `DrapeRasterWild` argument
 	and searching for the maximum value out of all rasters found.
+	Each drape is read once and the hillshade is made once (see SharedHillshade).
 
-    Raises:
-	Exception: If the maximum value in the drape maps could not be found.
+    Returns:
+	The figure and the array of axes.
 
     """
 
-
-    f, ax_arr = pp.subplots(2, 2, figsize=(10, 5), sharex=True, sharey=True)
-    ax_arr = ax_arr.ravel()
-
     FPFiles = sorted(glob(DataDir+DrapeRasterWild), key=str)
     n_files = len(FPFiles)
     print("Number of files = ", n_files)
 
-    elev_raster_file = DataDir + ElevationRaster
-
-    hillshade = LSDMap_BP.Hillshade(elev_raster_file)
-    #hillshade_array = LSDP.ReadRasterArrayBlocks(elev_raster_file)
-
-    # now get the extent
-    extent_raster = LSDMap_IO.GetRasterExtent(elev_raster_file)
-
-    x_min = extent_raster[0]
-    x_max = extent_raster[1]
-    y_min = extent_raster[2]
-    y_max = extent_raster[3]
-
-    # now get the tick marks
-    n_target_tics = 5
-    xlocs,ylocs,new_x_labels,new_y_labels = LSDMap_BP.GetTicksForUTM(elev_raster_file,x_max,x_min,y_max,y_min,n_target_tics)
-
-    print("xmax: " + str(x_max))
-    print("xmin: " + str(x_min))
-    print("ymax: " + str(y_max))
-    print("ymin: " + str(y_min))
+    # Read each drape once, all at the same time
+    drapes = ReadDrapeRasters(FPFiles, n_threads)
 
     """
     Find the maximum water depth in all rasters.
     You need this to normalize the colourscale accross
     all plots when teh imshow is done later.
     """
+    if drape_max is None and n_files > 0:
+        print("Calculating max drape raster value from the drape rasters...")
+        drape_max = findmaxval_multirasters(FPFiles)
+    print("The drape(s) max value is set to: ", drape_max)
 
-    try:
-        print("Calculating max drape raster value by scanning rasters...")
-        max_water_depth = findmaxval_multirasters(FPFiles)
-        drape_max = max_water_depth
-
-    except:
-        print("Something went wrong trying to obtain the max value in \
-                your drape raster file list.")
-    finally:
-        print("The drape(s) max value is set to: ", drape_max)
-
-
-    #im = mpimg.AxesImage()
+    if drape_min_threshold is not None:
+        for FP_raster in drapes:
+            low_values_index = FP_raster < drape_min_threshold
+            FP_raster[low_values_index] = np.nan
 
-    for i in range(n_files):
-
-        print("The floodplain file name is: ", FPFiles[i])
-        FP_raster = LSDMap_IO.ReadRasterArrayBlocks(FPFiles[i])
-        #FP_raster = np.ma.masked_where(FP_raster <= 0, FP_raster)
-
-        filename = os.path.basename(FPFiles[i])
-        title = lsdlabels.make_line_label(filename)
-        print(title)
-
-        low_values_index = FP_raster < drape_min_threshold
-        FP_raster[low_values_index] = np.nan
-
-        im = ax_arr[i].imshow(hillshade, "gray", extent=extent_raster, interpolation="nearest")
-        """
-        Now we can set vmax to be the maximum water depth we calcualted earlier, making our separate
-        subplots all have the same colourscale
-        """
-        im = ax_arr[i].imshow(FP_raster, cmap, extent=extent_raster,
-                                alpha=1.0, interpolation="nearest",
-                                vmin=drape_min_threshold,
-                                vmax=drape_max)
-        ax_arr[i].set_title(title)
-        pp.setp( ax_arr[i].xaxis.get_majorticklabels(), rotation=70 )
-
-    f.subplots_adjust(right=0.85)
-    cax = f.add_axes([0.9, 0.1, 0.03, 0.8])
-
-    cbar = f.colorbar(im, cax=cax)
-    cbar.set_label(cbar_label)
-    #cbar.set_ticks(np.linspace(0, 8, 8))
-    #cbar = LSDP.colours.colorbar_index(f, cax, 8, cmap,
-    #                                     drape_min_threshold, drape_max)
-
-    #tick_locator = ticker.MaxNLocator(nbins=8)
-    #cbar.locator = tick_locator
-    #cbar.update_ticks()
-
-    f.text(0.5, 0.04, 'Easting (m)', ha='center', fontsize=17)
-    f.text(0.04, 0.5, 'Northing (m)', va='center', rotation='vertical', fontsize=17)
+    return _RenderMultiDrape(DataDir, ElevationRaster, FPFiles, drapes, cmap,
+                             drape_min_threshold, drape_max, cbar_label, n_cols)
 
 
 def MultiDrapeErodeDiffMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
                         drape_min_threshold=None, cbar_label=None,
                         drape_max_threshold=None,
-                        middle_mask_range=None):
+                        middle_mask_range=None, n_cols=2, n_threads=4):
     """Plots multiple drape maps of erosion/deposition (a DEM of difference)
        over a hillshade raster of the basin.
 
@@ -507,6 +527,8 @@ def MultiDrapeErodeDiffMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
                        in the range -0.1 to 0.1 will be masked and not plotted
                        on the final map. Use for masking very small values
                        either side of zero.
+     n_cols (int, optional): The number of columns of panels.
+     n_threads (int, optional): The number of threads reading the drapes.
 
     Notes:
         Consider, if plotting multiple datasets, how you
@@ -519,89 +541,36 @@ def MultiDrapeErodeDiffMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
     Note: If `drape_max_threshold` is not set, the function searches for the maximum value
 	in the range of rasters found by expanding the `DrapeRasterWild` argument
 	and searching for the maximum value out of all rasters found.
+	Each drape is read once and the hillshade is made once (see SharedHillshade).
 
-    Raises:
-	Exception: If the maximum value in the drape maps could not be found.
+    Returns:
+	The figure and the array of axes.
 
     Author: DAV & FJC
     """
-    #import lsdmatplotlibextensions as mplext
-
-    f, ax_arr = pp.subplots(2, 2, figsize=(10, 5), sharex=True, sharey=True)
-    ax_arr = ax_arr.ravel()
-
     FPFiles = sorted(glob(DataDir+DrapeRasterWild), key=str)
     n_files = len(FPFiles)
     print("Number of files = ", n_files)
 
-    elev_raster_file = DataDir + ElevationRaster
-
-    hillshade = LSDMap_BP.Hillshade(elev_raster_file)
-    #hillshade_array = LSDP.ReadRasterArrayBlocks(elev_raster_file)
-
-    # now get the extent
-    extent_raster = LSDMap_IO.GetRasterExtent(elev_raster_file)
-
-    x_min = extent_raster[0]
-    x_max = extent_raster[1]
-    y_min = extent_raster[2]
-    y_max = extent_raster[3]
-
-    # now get the tick marks
-    n_target_tics = 5
-    xlocs, ylocs, new_x_labels, new_y_labels = LSDMap_BP.GetTicksForUTM(
-                                                            elev_raster_file,
-                                                            x_max,
-                                                            x_min,
-                                                            y_max,
-                                                            y_min,
-                                                            n_target_tics)
-
-    print("xmax: " + str(x_max))
-    print("xmin: " + str(x_min))
-    print("ymax: " + str(y_max))
-    print("ymin: " + str(y_min))
+    # Read each drape once, all at the same time
+    drapes = ReadDrapeRasters(FPFiles, n_threads)
 
     """
     Find the maximum water depth in all rasters.
     You need this to normalize the colourscale accross
     all plots when teh imshow is done later.
     """
-    if drape_max_threshold is None:
-        try:
-            print("Calculating max drape raster value by scanning rasters...")
-            max_water_depth = findmaxval_multirasters(FPFiles)
-            drape_max_threshold = max_water_depth
-
-        except ValueError:
-            print("Something went wrong trying to obtain the max value in \
-                    your drape raster file list.")
-        finally:
-            print("The drape(s) max value is set to: ", drape_max_threshold)
-
-    if drape_min_threshold is None:
-        try:
-            print("Calculating min drape raster value by scanning rasters...")
-            min_water_depth = findminval_multirasters(FPFiles)
-            drape_min_threshold = min_water_depth
-
-        except ValueError:
-            print("Something went wrong trying to obtain the min value in \
-                    your drape raster file list.")
-        finally:
-            print("The drape(s) min value is set to: ", drape_min_threshold)
-
+    if drape_max_threshold is None and n_files > 0:
+        print("Calculating max drape raster value from the drape rasters...")
+        drape_max_threshold = findmaxval_multirasters(FPFiles)
+    print("The drape(s) max value is set to: ", drape_max_threshold)
 
-    for i in range(n_files):
-
-        print("The floodplain file name is: ", FPFiles[i])
-        FP_raster = LSDMap_IO.ReadRasterArrayBlocks(FPFiles[i])
-        #FP_raster = np.ma.masked_where(FP_raster <= 0, FP_raster)
-
-        filename = os.path.basename(FPFiles[i])
-        title = lsdlabels.make_line_label(filename)
-        print(title)
+    if drape_min_threshold is None and n_files > 0:
+        print("Calculating min drape raster value from the drape rasters...")
+        drape_min_threshold = findminval_multirasters(FPFiles)
+    print("The drape(s) min value is set to: ", drape_min_threshold)
 
+    for FP_raster in drapes:
         # Mask the extreme high values
         hi_values_index = FP_raster > drape_max_threshold
         FP_raster[hi_values_index] = np.nan
@@ -618,30 +587,5 @@ def MultiDrapeErodeDiffMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
                                                       FP_raster < middle_mask_range[1]))
             FP_raster[masked_mid_values_index] = np.nan
 
-        im = ax_arr[i].imshow(hillshade, "gray", extent=extent_raster, interpolation="nearest")
-        """
-        Now we can set vmax to be the maximum water depth we calcualted earlier, making our separate
-        subplots all have the same colourscale
-        """
-        im = ax_arr[i].imshow(FP_raster, cmap, extent=extent_raster,
-                                alpha=1.0, interpolation="nearest",
-                                vmin=drape_min_threshold,
-                                vmax=drape_max_threshold)
-        ax_arr[i].set_title(title)
-        pp.setp( ax_arr[i].xaxis.get_majorticklabels(), rotation=70 )
-
-    f.subplots_adjust(right=0.85)
-    cax = f.add_axes([0.9, 0.1, 0.03, 0.8])
-
-    cbar = f.colorbar(im, cax=cax)
-    cbar.set_label(cbar_label)
-    #cbar.set_ticks(np.linspace(0, 8, 8))
-    #cbar = mplext.colours.colorbar_index(f, cax, 8, cmap,
-    #                                     drape_min_threshold, drape_max)
-
-    #tick_locator = ticker.MaxNLocator(nbins=8)
-    #cbar.locator = tick_locator
-    #cbar.update_ticks()
-
-    f.text(0.5, 0.04, 'Easting (m)', ha='center', fontsize=17)
-    f.text(0.04, 0.5, 'Northing (m)', va='center', rotation='vertical', fontsize=17)
+    return _RenderMultiDrape(DataDir, ElevationRaster, FPFiles, drapes, cmap,
+                             drape_min_threshold, drape_max_threshold, cbar_label, n_cols)
@@ -28,7 +28,7 @@ def calculate_waterinundation_area(raster, cellsize, threshold):
     """Note: this will probably need some sort of threshold as Caesar maps 
     out very small water depths and so could give huge 'inundation' areas."""
     total_cells = _np.count_nonzero(raster > threshold)
-    area = DX * DX * total_cells  # metres
+    area = cellsize * cellsize * total_cells  # metres
     
     print("Inundation area is: ", area, " metres square")
     return area
@@ -95,79 +95,149 @@ def natural_key(string_):
     """
     return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', string_)]
 
+# The columns of the inundation time series
+INUNDATION_METRICS = ["timestep", "inundation_area", "mean_depth", "floodplain_mean_depth",
+                      "channel_mean_depth", "max_depth"]
+
+def zone_codes(floodplain_mask, stream_mask, channel_order=5):
+    """Codes each cell by the zones it is in (1 = floodplain, 2 = main channel),
+    so the metrics of all the zones can be summed with one np.bincount per frame.
+
+    Args:
+        floodplain_mask (array): 1 in the floodplain
+        stream_mask (array): The stream order of the channels
+        channel_order (int): The stream order of the main channel
+
+    Returns:
+        An array of zone codes (0-3)
+    """
+    codes = _np.zeros(_np.shape(floodplain_mask), dtype=_np.int64)
+    codes[_np.asarray(floodplain_mask) == 1] += 1
+    codes[_np.asarray(stream_mask) == channel_order] += 2
+    return codes
+
+def frame_inundation_metrics(water_raster, codes, cellsize, threshold=0.02):
+    """Calculates all the inundation metrics of one water depth frame together:
+    the inundated area and the mean and max depth of the whole raster, and the mean
+    depths of the floodplain and main channel. Nodata (nan) cells are left out.
+
+    Args:
+        water_raster (array): The water depths
+        codes (array): The zone codes from zone_codes
+        cellsize (float): The cell size in metres
+        threshold (float): The depth above which a cell counts as inundated
+
+    Returns:
+        inundation_area, mean_depth, floodplain_mean_depth, channel_mean_depth, max_depth
+    """
+    depths = _np.asarray(water_raster, dtype=_np.float64).ravel()
+    valid = ~_np.isnan(depths)
+    # bit 2 of the code is set for the inundated cells
+    these_codes = codes.ravel()[valid] + 4*(depths[valid] > threshold)
+    depths = depths[valid]
+    sums = _np.bincount(these_codes, weights=depths, minlength=8).reshape(2,4).sum(axis=0)
+    counts = _np.bincount(these_codes, minlength=8).reshape(2,4)
+    n_inundated = counts[1].sum()
+    counts = counts.sum(axis=0)
+
+    with _np.errstate(invalid='ignore', divide='ignore'):
+        mean_depth = sums.sum()/counts.sum()
+        floodplain_mean = (sums[1]+sums[3])/(counts[1]+counts[3])
+        channel_mean = (sums[2]+sums[3])/(counts[2]+counts[3])
+    max_depth = depths.max() if depths.size > 0 else _np.nan
+    return cellsize*cellsize*n_inundated, mean_depth, floodplain_mean, channel_mean, max_depth
+
+def _frame_metrics_worker(args):
+    # reads one frame, with nodata as nan (-9999 if the raster doesn't say), and gets its metrics
+    water_raster_file, codes, cellsize, threshold = args
+    NDV = lsdgdal.GetGeoInfo(water_raster_file)[0]
+    if NDV is None:
+        NDV = -9999
+    water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file).astype(_np.float64)
+    water_raster[water_raster == NDV] = _np.nan
+    return frame_inundation_metrics(water_raster, codes, cellsize, threshold)
+
 def simulation_inundation_timeseries(glob_wildcard, floodplain_mask, stream_mask,
-                                     threshold=0,
+                                     cellsize, threshold=0.02, channel_order=5,
+                                     n_threads=4,
                                      savefilename="inundation_metrics.txt"):
-    """Creates a timeseries of a given inundation metric. 
-    
-    Options should be:
+    """Creates a timeseries of the inundation metrics of a set of water depth rasters.
+    The frames are read by a pool of threads and all the metrics of a frame are
+    calculated together (see frame_inundation_metrics).
+
+    The metrics are:
         Inundation Area (Entire catchment)
         Mean Water Depth (Entire catchment)
         Mean Water Depth (Floodplain only)
         Mean Water Depth (Channel)
+        Max Water Depth (Entire catchment)
+
+    Args:
+        glob_wildcard (str): The water depth rasters, i.e. "WaterDepths*.asc"
+        floodplain_mask (array): 1 in the floodplain
+        stream_mask (array): The stream order of the channels
+        cellsize (float): The cell size of the rasters in metres
+        threshold (float): The depth above which a cell counts as inundated
+        channel_order (int): The stream order of the main channel
+        n_threads (int): The number of threads reading the frames
+        savefilename (str): The text file for the time series. If None it is not saved.
+
+    Returns:
+        An array with a row per frame and the columns in INUNDATION_METRICS
     """
-    # Create an empty array with the correct number of columns
-    data_array = _np.empty((0,5), dtype=_np.float32)
+    from multiprocessing.pool import ThreadPool
+
+    water_raster_files = sorted(glob.glob(glob_wildcard), key=natural_key)
+    codes = zone_codes(floodplain_mask, stream_mask, channel_order)
+
+    data_array = _np.empty((len(water_raster_files), len(INUNDATION_METRICS)), dtype=_np.float64)
+    data_array[:,0] = [int(timestep_string_from_filename(f)) for f in water_raster_files]
     print("Data array shape: ", data_array.shape)
 
-    for water_raster_file in sorted(glob.glob(glob_wildcard), key=natural_key):
-        print(water_raster_file)
-        water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
-        
-        timestep_row = [] # Empty list to store elements of the row
-        cur_timestep = timestep_string_from_filename(water_raster_file) # get the current timestep by parsing the filename
-
-        # Inundation area
-        this_inundation_area = calculate_waterinundation_area(water_raster, DX, 0.02)
-        this_mean_catchment_waterdepth = calculate_mean_waterdepth(water_raster)
-        this_mean_floodplain_waterdepth = floodplain_mean_depth(water_raster, floodplain_mask)
-        this_mean_mainchannel_waterdepth = main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
-        
-        # Append each value to the current row list object
-        timestep_row.append([cur_timestep,
-                             this_inundation_area,
-                             this_mean_catchment_waterdepth,
-                             this_mean_floodplain_waterdepth,
-                             this_mean_mainchannel_waterdepth])
-        # Convert the list into a numpy array
-        timestep_row = _np.asarray(timestep_row, dtype=_np.float32)
-        
-        # Now append (stack) that row onto the bottom of the array (axis=0)
-        data_array = _np.append(data_array, timestep_row, axis=0)
-    
+    jobs = [(f, codes, cellsize, threshold) for f in water_raster_files]
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        # imap keeps the order of the frames
+        for i, metrics in enumerate(pool.imap(_frame_metrics_worker, jobs)):
+            data_array[i,1:] = metrics
+    finally:
+        pool.close()
+        pool.join()
+
     print(data_array)
     print(data_array.shape)
-    
-    with open(savefilename,'wb') as f:
-        _np.savetxt(f, data_array, fmt='%i %f %f %f %f')
 
+    if savefilename is not None:
+        with open(savefilename,'wb') as f:
+            _np.savetxt(f, data_array, fmt='%i %f %f %f %f %f')
+    return data_array
 
 
-    
-"""Get your rasters into arrays"""    
-water_raster_wildcard = "/run/media/dav/SHETLAND/ModelRuns/Ryedale_storms/Gridded/Hydro/WaterDepths*.asc"
-water_raster_file = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/peak_flood_maps/ryedale/WaterDepths2880_GRID_TLIM.asc"
-#raster_file = "/run/media/dav/SHETLAND/Analyses/HydrogeomorphPaper/peak_flood_maps/boscastle/peak_flood/WaterDepths2400_GRID_HYDRO.asc"
-floodplain_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_FP.bil"
-stream_raster_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_SO.bil"
-
-water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
-
-floodplain_mask = lsdgdal.ReadRasterArrayBlocks(floodplain_file)
-stream_mask = lsdgdal.ReadRasterArrayBlocks(stream_raster_file)
-#print(stream_mask)
-
-DX = lsdgdal.GetUTMMaxMin(water_raster_file)[0]   # I never realised you could do this!
-print(DX)
-
-"""Calculate the depths and areas"""
-#calculate_mean_waterdepth(water_raster)
-#calcualte_max_waterdepth(water_raster)
-#calculate_waterinundation_area(water_raster, DX, 0.02)
-#floodplain_mean_depth(water_raster, floodplain_mask)
-#main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
-
-"""Make the timeseries file"""
-simulation_inundation_timeseries(water_raster_wildcard, floodplain_mask,
-                                 stream_mask,
-                                 savefilename="ryedale_inundation_GRIDDED_HYDRO.txt")
+if __name__ == "__main__":
+    """Get your rasters into arrays"""
+    water_raster_wildcard = "/run/media/dav/SHETLAND/ModelRuns/Ryedale_storms/Gridded/Hydro/WaterDepths*.asc"
+    water_raster_file = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/peak_flood_maps/ryedale/WaterDepths2880_GRID_TLIM.asc"
+    #raster_file = "/run/media/dav/SHETLAND/Analyses/HydrogeomorphPaper/peak_flood_maps/boscastle/peak_flood/WaterDepths2400_GRID_HYDRO.asc"
+    floodplain_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_FP.bil"
+    stream_raster_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_SO.bil"
+
+    water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
+
+    floodplain_mask = lsdgdal.ReadRasterArrayBlocks(floodplain_file)
+    stream_mask = lsdgdal.ReadRasterArrayBlocks(stream_raster_file)
+    #print(stream_mask)
+
+    DX = lsdgdal.GetUTMMaxMin(water_raster_file)[0]   # I never realised you could do this!
+    print(DX)
+
+    """Calculate the depths and areas"""
+    #calculate_mean_waterdepth(water_raster)
+    #calcualte_max_waterdepth(water_raster)
+    #calculate_waterinundation_area(water_raster, DX, 0.02)
+    #floodplain_mean_depth(water_raster, floodplain_mask)
+    #main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
+
+    """Make the timeseries file"""
+    simulation_inundation_timeseries(water_raster_wildcard, floodplain_mask,
+                                     stream_mask, DX,
+                                     savefilename="ryedale_inundation_GRIDDED_HYDRO.txt")
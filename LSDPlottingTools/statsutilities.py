@@ -103,9 +103,10 @@ def add_outlier_column_to_PD(df, column = "none", threshold = "none"):
     else:
         return lst_df
 
-def binning_PD(df, column = "", values = [], log = False):
+def binning_PD(df, column = "", values = [], log = False, as_dict = True):
     """
     takes a dataframe (Pandas) and return a list of dataframes binned by one columns.
+    The bin of each row is found once with a sorted search (see bin_dataframe).
     Args:
         df: The pandas dataframe
         column (str): name of the column that hold the data
@@ -113,18 +114,51 @@ def binning_PD(df, column = "", values = [], log = False):
                        _ you also can give the value "auto_power_10" to this. it will automatically bin the data each 10**n until the max
                        _ "unique" will bin the df for each values of the column (Basin/ source key for example)
         log (bool): if you want to compare values to log of column
+        as_dict (bool): if False, return the BinnedDataFrame view rather than copying each bin into a dataframe
     return:
         dictionnary of pandas dataframe, the key being the upper value
     """
+    binned = bin_dataframe(df, column = column, values = values, log = log)
+    if(as_dict):
+        return binned.to_dict()
+    return binned
+
+def bin_dataframe(df, column = "", values = [], log = False):
+    """
+    Bins a dataframe by one column. Each row gets a bin id with a single np.searchsorted,
+    so this is one pass over the data whatever the number of bins.
+    The bins are: below values[0], then values[i-1] <= x < values[i], and everything
+    from values[-1] up. Rows where the column is NaN are not in any bin.
+
+    Args:
+        df: The pandas dataframe
+        column (str): name of the column that hold the data
+        values (list or str): the upper values of each bin, or "auto_power_10" (a bin each 10**n)
+                       or "unique" (a bin for each value of the column, i.e. source key)
+        log (bool): if you want to compare values to log of column
+
+    Returns:
+        A BinnedDataFrame
+
+    Author: BG/SMM
+    """
     # check the function parameters
     if(column == ""):
-        print("You need to give a valid column name")
-    if(isinstance(values, list) and len(values) < 2):
-        print("You need at least two values to bin the dataframe")
+        raise ValueError("You need to give a valid column name")
+
+    data = df[column].values
+    # log the data if required, only once
+    if(log):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_data = np.log10(data.astype(float))
+    else:
+        log_data = data
+
+    unique = False
     if(isinstance(values,str) and values == "auto_power_10"):
         print("I am automatically choosing the binning values each 10**n, thanks for trusting me")
-        max_val = df[column].max()
-        min_value = df[column].min()
+        max_val = np.nanmax(data)
+        min_value = np.nanmin(data)
 
         po = 0
         values = []
@@ -137,48 +171,187 @@ def binning_PD(df, column = "", values = [], log = False):
         del values[-1] # delete the last value to keep last bin > to last value
         print("Your binning values are: ")
         print(values)
+    elif(isinstance(values,str) and values == "unique"):
+        print("I am automatically choosing the binning values for each unique values, thanks for trusting me")
+        unique = True
+        # log10 is monotonic so it doesn't change the groups: bin the raw values
+        # so that the labels are the values of the column
+        log_data = data
+        values = np.sort(pd.unique(data[pd.notnull(data)]))
+        print("Your binning values are: ")
+        print(values)
+    if(len(values) == 0):
+        raise ValueError("You need at least one value to bin the dataframe")
+
+    # the labels come from the values as they were given (i.e. 1 rather than 1.0 in [0.5, 1, 10])
+    if(unique):
+        labels = [str(v) for v in values]
     else:
-        if(isinstance(values,str) and values == "unique"):
-            print("I am automatically choosing the binning values for each unique values, thanks for trusting me")
-            values = df[column].unique()
-            print("Your binning values are: ")
-            print(values)
-    cumul_lines = 0# check if all the values are inside bins
+        labels = [str(v) for v in values]+['>'+str(values[-1])]
+    bin_ids = np.searchsorted(np.asarray(values), log_data, side = "left" if unique else "right")
+    bin_ids[pd.isnull(log_data)] = -1
+
+    return BinnedDataFrame(df, bin_ids, labels)
+
+def _density_ranges(data, value_range, pad = None):
+    # the (min, max) of each dimension, padded if asked (i.e. by a few kernel widths)
+    ranges = []
+    for i, d in enumerate(data):
+        if value_range is not None and value_range[i] is not None:
+            lo, hi = value_range[i]
+        else:
+            lo, hi = np.nanmin(d), np.nanmax(d)
+            if pad is not None:
+                lo, hi = lo-pad[i], hi+pad[i]
+        if hi <= lo:
+            hi = lo+1.0
+        ranges.append((float(lo), float(hi)))
+    return ranges
+
+def fast_histogram(data, bins = 50, value_range = None, density = False):
+    """
+    A histogram of one or more dimensions (i.e. a 2D histogram of drainage area and
+    knickpoint magnitude) done with one np.bincount over regular bins, which is much
+    faster than np.histogram2d. Values outside the range and NaNs are left out.
 
+    Args:
+        data (list of arrays): one array per dimension, all the same length
+        bins (int or list of int): the number of bins, or one per dimension
+        value_range (list of (min,max)): the range of each dimension. Default is the range of the data.
+        density (bool): If True the counts are divided by the number of points and the bin area
 
-    # log the data if required
-    if(log):
-        return_DF = [df[np.log10(df[column])<values[0]]]
-        cumul_lines += return_DF[0].shape[0]
-        for i in range(1,len(values)):
-            tempdf = df[np.log10(df[column])<values[i]]
-            tempdf = tempdf[tempdf[column]>values[i-1]]
-            return_DF.append(tempdf)
-            cumul_lines += return_DF[i].shape[0]
-        tempdf= df[np.log10(df[column])>=values[-1]]
-        cumul_lines += tempdf.shape[0]
-        return_DF.append(tempdf)
-    else:
-        return_DF = [df[df[column]<values[0]]]
-        cumul_lines += return_DF[0].shape[0]
-        for i in range(1,len(values)):
-            tempdf = df[df[column]<values[i]]
-            tempdf = tempdf[tempdf[column]>values[i-1]]
-            return_DF.append(tempdf)
-            cumul_lines += return_DF[i].shape[0]
+    Returns:
+        counts (array with one axis per dimension), edges (list of bin edge arrays)
 
-        cumul_lines += df[df[column]>=values[-1]].shape[0]
-        return_DF.append(df[df[column]>=values[-1]]) # last overweight bin
+    Author: SMM
+    """
+    data = [np.asarray(d, dtype=np.float64) for d in data]
+    n_dims = len(data)
+    if np.isscalar(bins):
+        bins = [int(bins)]*n_dims
+    ranges = _density_ranges(data, value_range)
+
+    keep = np.ones(data[0].size, dtype=bool)
+    indices = []
+    for d, n_bins, (lo, hi) in zip(data, bins, ranges):
+        keep &= (d >= lo) & (d <= hi)
+        with np.errstate(invalid='ignore'):
+            index = np.floor((d-lo)/(hi-lo)*n_bins)
+        # the maximum goes in the last bin, as in np.histogram
+        indices.append(np.clip(np.nan_to_num(index), 0, n_bins-1).astype(np.int64))
+    flat = np.ravel_multi_index([i[keep] for i in indices], bins)
+    counts = np.bincount(flat, minlength=int(np.prod(bins))).reshape(bins).astype(np.float64)
+
+    edges = [np.linspace(lo, hi, n_bins+1) for n_bins, (lo, hi) in zip(bins, ranges)]
+    if density and counts.sum() > 0:
+        bin_area = np.prod([(hi-lo)/n_bins for n_bins, (lo, hi) in zip(bins, ranges)])
+        counts /= counts.sum()*bin_area
+    return counts, edges
+
+def linear_binned_counts(data, n_grid = 256, value_range = None):
+    """
+    Linear binning of points onto a regular grid: each point shares its weight between the
+    grid nodes around it in proportion to how close it is to them. This is the first step
+    of the binned kernel density estimate.
 
-        print("DEBUG: " +str(cumul_lines) +" lines detected over " +str(df.shape[0]))
-    # compile the results in a dictionnary
-    dict_return = {}
-    for i in range(len(values)):
-        dict_return[str(values[i])] = return_DF[i]
+    Args:
+        data (list of arrays): one array per dimension, all the same length
+        n_grid (int or list of int): the number of grid nodes in each dimension
+        value_range (list of (min,max)): the range of the grid in each dimension
 
-    dict_return['>'+str(values[-1])] = return_DF[-1]
+    Returns:
+        counts (array with one axis per dimension), grid (list of node coordinate arrays)
 
-    return dict_return
+    Author: SMM
+    """
+    import itertools
+
+    data = [np.asarray(d, dtype=np.float64) for d in data]
+    n_dims = len(data)
+    if np.isscalar(n_grid):
+        n_grid = [int(n_grid)]*n_dims
+    ranges = _density_ranges(data, value_range)
+
+    keep = np.ones(data[0].size, dtype=bool)
+    for d, (lo, hi) in zip(data, ranges):
+        keep &= (d >= lo) & (d <= hi)
+
+    # the node below each point and the weight of the node above it
+    lower = []
+    upper_weight = []
+    for d, n, (lo, hi) in zip(data, n_grid, ranges):
+        position = (d[keep]-lo)/(hi-lo)*(n-1)
+        i0 = np.clip(np.floor(position).astype(np.int64), 0, n-2)
+        lower.append(i0)
+        upper_weight.append(position-i0)
+
+    # add the weights to each corner of the cell around the points
+    counts = np.zeros(int(np.prod(n_grid)))
+    for corner in itertools.product([0,1], repeat = n_dims):
+        weights = np.ones(lower[0].size)
+        for dim, c in enumerate(corner):
+            weights *= upper_weight[dim] if c else 1-upper_weight[dim]
+        flat = np.ravel_multi_index([lower[dim]+c for dim, c in enumerate(corner)], n_grid)
+        counts += np.bincount(flat, weights = weights, minlength = counts.size)
+
+    grid = [np.linspace(lo, hi, n) for n, (lo, hi) in zip(n_grid, ranges)]
+    return counts.reshape(n_grid), grid
+
+def binned_kde(data, n_grid = 256, bandwidth = None, value_range = None):
+    """
+    A Gaussian kernel density estimate evaluated on a regular grid. The points are
+    linearly binned onto the grid and the binned counts are convolved with the kernel
+    using FFTs, so the cost depends on the grid size rather than on the number of points
+    times the number of grid nodes as in scipy's gaussian_kde.
+
+    Args:
+        data (list of arrays): one array per dimension, all the same length
+        n_grid (int or list of int): the number of grid nodes in each dimension
+        bandwidth (float or list of float): the standard deviation of the kernel in each dimension.
+            Default is Scott's rule (std * n**(-1/(d+4))).
+        value_range (list of (min,max)): the range of the grid in each dimension. Default is the
+            range of the data plus three bandwidths on each side.
+
+    Returns:
+        density (array with one axis per dimension), grid (list of node coordinate arrays)
+
+    Author: SMM
+    """
+    from scipy.signal import fftconvolve
+
+    data = [np.asarray(d, dtype=np.float64) for d in data]
+    n_dims = len(data)
+    if np.isscalar(n_grid):
+        n_grid = [int(n_grid)]*n_dims
+    finite = np.ones(data[0].size, dtype=bool)
+    for d in data:
+        finite &= np.isfinite(d)
+    data = [d[finite] for d in data]
+    n_points = data[0].size
+
+    if bandwidth is None:
+        bandwidth = [np.std(d)*n_points**(-1.0/(n_dims+4)) for d in data]
+    elif np.isscalar(bandwidth):
+        bandwidth = [float(bandwidth)]*n_dims
+    bandwidth = [b if b > 0 else 1.0 for b in bandwidth]
+    ranges = _density_ranges(data, value_range, pad = [3*b for b in bandwidth])
+
+    counts, grid = linear_binned_counts(data, n_grid, ranges)
+    spacing = [(hi-lo)/(n-1) for n, (lo, hi) in zip(n_grid, ranges)]
+
+    # the kernel on the grid, out to 4 bandwidths (but no larger than the grid)
+    kernel = np.ones([1]*n_dims)
+    for dim in range(n_dims):
+        half_width = int(min(np.ceil(4*bandwidth[dim]/spacing[dim]), n_grid[dim]-1))
+        offsets = np.arange(-half_width, half_width+1)*spacing[dim]
+        kernel_1d = np.exp(-0.5*(offsets/bandwidth[dim])**2)
+        shape = [1]*n_dims
+        shape[dim] = kernel_1d.size
+        kernel = kernel*(kernel_1d/kernel_1d.sum()).reshape(shape)
+
+    density = fftconvolve(counts, kernel, mode = "same")
+    density = np.clip(density, 0, None)/(max(n_points,1)*np.prod(spacing))
+    return density, grid
 
 def dixon_test(data, left=True, right=True, q_dict = ""):
     """
@@ -306,6 +479,342 @@ def remove_outlying_residuals(xdata,ydata,residuals):
     (m,b,r,pvalue,stderr)=stats.linregress(NX,NY)
 
     return (NX,NY, is_outlier_vec, m,b)
+
+
+def grouped_linregress(group_index, xdata, ydata, weights=None):
+    """
+    This does a least squares linear regression for every group of a GroupIndex at once,
+    using sums within the groups rather than a regression per group.
+
+    Args:
+        group_index (GroupIndex): The groups
+        xdata (array-like): The x data
+        ydata (array-like): The y data
+        weights (array-like): Optional 0/1 weights, i.e. to leave out outliers
+
+    Returns:
+        slope: the slope of regression line of each group (nan if there are fewer than 2 points)
+        intercept: intercept of the regression line of each group
+        n: the number of points used in each group
+
+    Author: SMM
+    """
+    x = np.asarray(xdata, dtype=np.float64)
+    y = np.asarray(ydata, dtype=np.float64)
+    if weights is None:
+        w = np.ones(x.size)
+    else:
+        w = np.asarray(weights, dtype=np.float64)
+
+    n = group_index.sum(w)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # centre the data on the group means so the sums don't lose precision
+        x_mean = group_index.sum(w*x)/n
+        y_mean = group_index.sum(w*y)/n
+        dx = x - group_index.broadcast(x_mean)
+        dy = y - group_index.broadcast(y_mean)
+        Sxx = group_index.sum(w*dx*dx)
+        Sxy = group_index.sum(w*dx*dy)
+        slope = Sxy/Sxx
+        intercept = y_mean - slope*x_mean
+    slope[n < 2] = np.nan
+    intercept[n < 2] = np.nan
+    return slope, intercept, n
+
+def grouped_median(group_index, values, approximate_above=None, n_bins=1024):
+    """
+    The median of each group of a GroupIndex. Groups with more than approximate_above
+    members use the histogram median of GroupIndex.approximate_median, which needs no
+    sort, and the others the exact median.
+
+    Args:
+        group_index (GroupIndex): The groups
+        values (array-like): one dimensional data
+        approximate_above (int): The size above which groups use the approximate median.
+            If None all the medians are exact.
+        n_bins (int): The number of histogram bins of the approximate median
+
+    Returns:
+        An array with the median of each group
+
+    Author: SMM
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if approximate_above is None:
+        return group_index.median(values)
+    large = group_index.sizes > approximate_above
+    if not np.any(large):
+        return group_index.median(values)
+
+    medians = np.empty(group_index.n_groups)
+    large_rows = large[group_index.group_ids]
+    for these_rows, approximate in [(~large_rows, False), (large_rows, True)]:
+        if not np.any(these_rows):
+            continue
+        # group the rows by their group number in the full index
+        sub_index = GroupIndex(group_index.group_ids[these_rows])
+        if approximate:
+            medians[sub_index.keys[0]] = sub_index.approximate_median(values[these_rows], n_bins)
+        else:
+            medians[sub_index.keys[0]] = sub_index.median(values[these_rows])
+    return medians
+
+def grouped_modified_z_score(group_index, points, approximate_above=None, n_bins=1024):
+    """
+    The modified z-score of is_outlier for every point, using the median and median
+    absolute deviation of its own group. All the groups are done at once.
+
+    Args:
+        group_index (GroupIndex): The groups
+        points (array-like): one dimensional data
+        approximate_above (int): Groups larger than this use approximate medians (see grouped_median)
+        n_bins (int): The number of histogram bins of the approximate median
+
+    Returns:
+        An array with the modified z-score of each point (0 where the MAD of the group is 0)
+
+    Author: SMM
+    """
+    points = np.asarray(points, dtype=np.float64)
+    median = grouped_median(group_index, points, approximate_above, n_bins)
+    diff = np.abs(points - group_index.broadcast(median))
+    med_abs_deviation = group_index.broadcast(grouped_median(group_index, diff, approximate_above, n_bins))
+
+    # If MAD is 0, then there are no outliers
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(med_abs_deviation == 0, 0, 0.6745*diff/med_abs_deviation)
+
+def grouped_is_outlier(group_index, points, thresh=3.5, approximate_above=None):
+    """
+    This is is_outlier applied separately to each group of a GroupIndex: the modified
+    z-score of each point uses the median and median absolute deviation of its own group.
+
+    Args:
+        group_index (GroupIndex): The groups
+        points (array-like): one dimensional data
+        thresh (float): The modified z-score threshold
+        approximate_above (int): Groups larger than this use approximate medians (see grouped_median)
+
+    Returns:
+        A boolean array, True for the outliers
+
+    Author: SMM
+    """
+    return grouped_modified_z_score(group_index, points, approximate_above) > thresh
+
+def add_grouped_outlier_column_to_PD(df, column = "diff", group_by = [], threshold = 3.5, approximate_above = None):
+    """
+    Adds boolean outlier columns (column+"_outlier", True if outlier) to a dataframe, where
+    the outliers are found within groups of rows (i.e. within each basin or source) rather
+    than over the whole dataframe. All the groups are done at once, so there is no need to
+    split the dataframe with binning_PD first.
+
+    Args:
+        df (Pandas dataframe): The dataframe
+        column (list or string): name of the column(s) you want to outlier-check
+        group_by (list or string): name of the column(s) that define the groups, i.e. "basin_key".
+            If empty the whole dataframe is one group.
+        threshold (list or float): the modified z-score threshold, or one per column
+        approximate_above (int): Groups larger than this use approximate medians (see grouped_median)
+
+    Returns:
+        The dataframe with the outlier columns
+
+    Author: SMM
+    """
+    if(isinstance(column,str)):
+        column = [column]
+    if(isinstance(group_by,str)):
+        group_by = [group_by]
+    if(isinstance(threshold,float) or isinstance(threshold,int)):
+        threshold = [threshold]*len(column)
+    if(len(threshold) != len(column)):
+        raise ValueError("You need to assign one threshold per columns name")
+
+    if(len(group_by) == 0):
+        index = GroupIndex(np.zeros(df.shape[0], dtype=np.int64))
+    else:
+        index = GroupIndex(*[df[name].values for name in group_by])
+
+    for coln, thresh in zip(column, threshold):
+        df[coln+"_outlier"] = grouped_is_outlier(index, df[coln].values, thresh, approximate_above)
+    return df
+
+class GroupIndex(object):
+    """
+    A sort-based group-by index. The rows are sorted once by one or more key
+    columns (i.e. source_key, basin_key), and the rows of each group are then a
+    contiguous slice of the sort order (CSR-style offsets). This lets you get
+    per-group summaries with numpy reduceat rather than masking the full
+    arrays once per group.
+
+    Args:
+        keys: one or more arrays of keys, all the same length. If there are several
+            the first is the primary key (i.e. GroupIndex(basin, source) groups by
+            basin and then by source within each basin).
+
+    Author: SMM
+    """
+    def __init__(self, *keys):
+        if len(keys) == 0:
+            raise ValueError("You need to give me at least one key array")
+        self.key_arrays = [np.asarray(k) for k in keys]
+        self.n_rows = self.key_arrays[0].size
+
+        # np.lexsort uses the last key as the primary one
+        if len(self.key_arrays) == 1:
+            self.order = np.argsort(self.key_arrays[0], kind="mergesort")
+        else:
+            self.order = np.lexsort(self.key_arrays[::-1])
+
+        # find where the sorted keys change
+        change = np.zeros(self.n_rows, dtype=bool)
+        if self.n_rows > 0:
+            change[0] = True
+            for k in self.key_arrays:
+                sk = k[self.order]
+                change[1:] |= sk[1:] != sk[:-1]
+        self.starts = np.nonzero(change)[0]
+        self.offsets = np.append(self.starts, self.n_rows)
+        self.n_groups = self.starts.size
+        self.sizes = np.diff(self.offsets)
+
+        # the key of each group, and the group of each row (in the original order)
+        self.keys = [k[self.order][self.starts] for k in self.key_arrays]
+        self.group_ids = np.empty(self.n_rows, dtype=np.int64)
+        self.group_ids[self.order] = np.repeat(np.arange(self.n_groups), self.sizes)
+
+    def __len__(self):
+        return self.n_groups
+
+    def key_list(self):
+        """Returns the group keys as a list (of tuples if there are several key arrays)"""
+        if len(self.keys) == 1:
+            return self.keys[0].tolist()
+        return list(zip(*[k.tolist() for k in self.keys]))
+
+    def find(self, *key):
+        """Returns the position of a group given its key(s), or -1 if it is not there"""
+        lo, hi = 0, self.n_groups
+        for i, k in enumerate(key):
+            these = self.keys[i][lo:hi]
+            new_lo = lo + np.searchsorted(these, k, side="left")
+            hi = lo + np.searchsorted(these, k, side="right")
+            lo = new_lo
+        if lo >= hi:
+            return -1
+        return lo
+
+    def indices(self, *key):
+        """Returns the row indices (in the original order) of the group with this key"""
+        g = self.find(*key)
+        if g < 0:
+            return np.array([], dtype=np.int64)
+        return np.sort(self.order[self.offsets[g]:self.offsets[g+1]])
+
+    def sort(self, values):
+        """Returns the values sorted by group"""
+        return np.asarray(values)[self.order]
+
+    def reduce(self, values, ufunc):
+        """Applies a numpy ufunc (i.e. np.add, np.maximum) to each group in one pass"""
+        if self.n_groups == 0:
+            return np.array([])
+        return ufunc.reduceat(self.sort(values), self.starts)
+
+    def sum(self, values):
+        return self.reduce(values, np.add)
+
+    def max(self, values):
+        return self.reduce(values, np.maximum)
+
+    def min(self, values):
+        return self.reduce(values, np.minimum)
+
+    def mean(self, values):
+        return self.sum(np.asarray(values, dtype=np.float64))/self.sizes
+
+    def median(self, values):
+        """Returns the median of each group, from one sort of the values within the groups"""
+        if self.n_groups == 0:
+            return np.array([])
+        sorted_values = np.asarray(values, dtype=np.float64)[self.order_within(values)]
+        lower = self.starts + (self.sizes-1)//2
+        upper = self.starts + self.sizes//2
+        return 0.5*(sorted_values[lower]+sorted_values[upper])
+
+    def quantile(self, values, q, order = None):
+        """
+        Returns the q-th quantile (0 <= q <= 1) of each group, interpolated linearly
+        between the sorted values as in np.percentile. If you already have
+        order_within(values) you can pass it as order to skip the sort.
+        """
+        if self.n_groups == 0:
+            return np.array([])
+        if order is None:
+            order = self.order_within(values)
+        sorted_values = np.asarray(values, dtype=np.float64)[order]
+        position = self.starts + q*(self.sizes-1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position-lower
+        return sorted_values[lower] + fraction*(sorted_values[upper]-sorted_values[lower])
+
+    def approximate_median(self, values, n_bins=1024):
+        """
+        Returns an approximate median of each group from a histogram of the group between
+        its minimum and maximum, without sorting the values. The middle value (or the two
+        middle values of an even count, which are averaged as in np.median) is placed within
+        its bin by spreading the values of the bin evenly across it. Each middle value is in
+        the bin it is placed in, so the error is less than a bin width ((max-min)/n_bins).
+        Use it for very large groups.
+        """
+        if self.n_groups == 0:
+            return np.array([])
+        values = np.asarray(values, dtype=np.float64)
+        lo = self.min(values)
+        width = (self.max(values)-lo)/n_bins
+
+        # a histogram for every group at once
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bins = np.where(width[self.group_ids] > 0, (values-lo[self.group_ids])/width[self.group_ids], 0)
+        bins = np.clip(np.floor(bins).astype(np.int64), 0, n_bins-1)
+        counts = np.bincount(self.group_ids*n_bins+bins, minlength=self.n_groups*n_bins).reshape(self.n_groups, n_bins)
+        cumulative = np.cumsum(counts, axis=1)
+
+        # the two middle values (the same one for an odd count) are found in their bins,
+        # taking the values of a bin to be at the middles of equal parts of the bin
+        groups = np.arange(self.n_groups)
+        def order_statistic(k):
+            this_bin = np.argmax(cumulative > k[:,None], axis=1)
+            in_bin = counts[groups, this_bin]
+            below = cumulative[groups, this_bin] - in_bin
+            return lo + (this_bin + (k-below+0.5)/in_bin)*width
+        lower = order_statistic((self.sizes-1)//2)
+        upper = order_statistic(self.sizes//2)
+        return np.clip(0.5*(lower+upper), lo, self.max(values))
+
+    def order_within(self, values):
+        """Returns the row indices sorted by group and then by values within each group"""
+        return np.lexsort((np.asarray(values), self.group_ids))
+
+    def argmax(self, values):
+        """Returns the row index (in the original order) of the maximum value of each group"""
+        return self.order_within(values)[self.offsets[1:]-1]
+
+    def argmin(self, values):
+        """Returns the row index (in the original order) of the minimum value of each group"""
+        return self.order_within(values)[self.starts]
+
+    def broadcast(self, group_values):
+        """Spreads one value per group back to the rows"""
+        return np.asarray(group_values)[self.group_ids]
+
+    def groups(self):
+        """Iterates over the groups, yielding the key and the row indices of each group"""
+        key_list = self.key_list()
+        for g in range(self.n_groups):
+            yield key_list[g], np.sort(self.order[self.offsets[g]:self.offsets[g+1]])
     
     
     
@@ -322,3 +831,88 @@ def remove_outlying_residuals(xdata,ydata,residuals):
 
 
 #
+
+class BinnedDataFrame(object):
+    """
+    A grouped view of a dataframe that has been binned by bin_dataframe. The dataframe
+    is not copied: each bin is a set of rows, so it behaves like the dict of
+    dataframes of binning_PD (keys(), items(), binned[label]) but a bin's dataframe
+    is only made when you ask for it. Per bin statistics are vectorised over all the bins.
+
+    Args:
+        df: The pandas dataframe
+        bin_ids (array): The bin of each row (position in labels), -1 if it is in no bin
+        labels (list of str): The name of each bin
+
+    Author: SMM
+    """
+    def __init__(self, df, bin_ids, labels):
+        self.df = df
+        self.bin_ids = np.asarray(bin_ids, dtype=np.int64)
+        self.labels = list(labels)
+        self.n_bins = len(self.labels)
+        self._label_index = dict((label, i) for i, label in enumerate(self.labels))
+
+        # A group index over the rows that are in a bin
+        self.rows = np.nonzero(self.bin_ids >= 0)[0]
+        self.index = GroupIndex(self.bin_ids[self.rows])
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.counts[self.index.keys[0]] = self.index.sizes
+
+    def __len__(self):
+        return self.n_bins
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __contains__(self, label):
+        return label in self._label_index
+
+    def keys(self):
+        return list(self.labels)
+
+    def bin_rows(self, label):
+        """Returns the row positions (for df.iloc) of the bin with this label"""
+        return self.rows[self.index.indices(self._label_index[label])]
+
+    def __getitem__(self, label):
+        return self.df.iloc[self.bin_rows(label)]
+
+    def items(self):
+        for label in self.labels:
+            yield label, self[label]
+
+    def to_dict(self):
+        """Copies the bins into a dict of dataframes, like binning_PD used to return"""
+        return dict((label, self[label].copy()) for label in self.labels)
+
+    def _per_bin(self, group_values, empty_value = np.nan):
+        # Spread the values of the non-empty bins onto all the bins
+        result = np.full(self.n_bins, empty_value, dtype=np.float64)
+        result[self.index.keys[0]] = group_values
+        return pd.Series(result, index = self.labels)
+
+    def aggregate(self, column, how = "mean"):
+        """
+        Returns a statistic of a column for every bin at once.
+
+        Args:
+            column (str): The column
+            how (str): "count", "sum", "mean", "median", "min" or "max"
+
+        Returns:
+            A pandas Series indexed by the bin labels (NaN for empty bins)
+        """
+        if how == "count":
+            return pd.Series(self.counts, index = self.labels)
+        values = self.df[column].values[self.rows].astype(np.float64)
+        if how == "sum":
+            return self._per_bin(self.index.sum(values), 0)
+        if how in ("mean", "median", "min", "max"):
+            return self._per_bin(getattr(self.index, how)(values))
+        raise ValueError("I don't know the aggregation "+str(how))
+
+    def quantile(self, column, q):
+        """Returns the q-th quantile (0 <= q <= 1) of a column for every bin, as a pandas Series"""
+        values = self.df[column].values[self.rows].astype(np.float64)
+        return self._per_bin(self.index.quantile(values, q))
@@ -51,7 +51,216 @@ def writeFile(filename,geotransform,geoprojection,data):
 
 
 
-def Rasterize_BGS_geologic_maps(shapefile_name):
+def _ScanAttributes(daLayer, fields):
+    """
+    Reads only the given fields of every feature (the geometries and the other
+    fields are skipped by the driver) and yields them as tuples.
+    """
+    layerDefinition = daLayer.GetLayerDefn()
+    all_fields = [layerDefinition.GetFieldDefn(i).GetName() for i in range(layerDefinition.GetFieldCount())]
+    daLayer.SetIgnoredFields([f for f in all_fields if f not in fields]+["OGR_GEOMETRY","OGR_STYLE"])
+    daLayer.ResetReading()
+    try:
+        for feature in daLayer:
+            yield tuple(feature.GetField(f) for f in fields)
+    finally:
+        daLayer.SetIgnoredFields([])
+        daLayer.ResetReading()
+
+def GetLithologyNames(daLayer, id_field, name_field):
+    """
+    Makes the key between the lithology IDs (that are burnt into the raster)
+    and the rock names in one pass over the attributes.
+
+    Args:
+        daLayer: The ogr layer
+        id_field (str): The field with the lithology ID
+        name_field (str): The field with the name of the rock
+
+    Returns:
+        A dict of rock names, with the IDs as keys
+
+    Author: SMM
+    """
+    geol_dict = dict()
+    for ID, GEOL in _ScanAttributes(daLayer, [id_field, name_field]):
+        if ID not in geol_dict:
+            print("I found a new rock type, ID: "+ str(ID)+ " and rock type: " + str(GEOL))
+            geol_dict[ID] = GEOL
+    return geol_dict
+
+def MakeLithologyCodes(daLayer, geol_field):
+    """
+    Numbers the rock types in a text field (1,2,3... in the order they are found)
+    in one pass over the attributes.
+
+    Args:
+        daLayer: The ogr layer
+        geol_field (str): The field with the rock type
+
+    Returns:
+        A dict of integer codes, with the rock types as keys
+
+    Author: SMM
+    """
+    geol_dict = dict()
+    for (GEOL,) in _ScanAttributes(daLayer, [geol_field]):
+        if GEOL not in geol_dict:
+            geol_dict[GEOL] = len(geol_dict)+1
+            print("I found a new rock type, GEOL: "+ str(GEOL)+ " and rock type: " + str(geol_dict[GEOL]))
+    return geol_dict
+
+def WriteLithologyKey(outcsv, geol_dict):
+    """
+    Writes the lithology key to a csv file with the columns ID and rocktype.
+
+    Author: SMM
+    """
+    with open(outcsv, 'w') as f:
+        f.write('ID,rocktype\n')
+        for key in geol_dict:
+            f.write(str(key)+','+ str(geol_dict[key])+'\n')
+
+def Rasterize_Layer_Tiles(shapefile_name, outraster, raster_resolution, attribute = None,
+                          code_field = None, code_dict = None, tile_size = 2048,
+                          n_threads = 4, NoDataVal = -9999):
+    """
+    Rasterises a shapefile into a tiled, compressed integer GeoTiff. The raster is
+    split into tiles that are rasterised at the same time in a pool of threads.
+    Each thread has its own copy of the layer, and only rasterises the polygons
+    that overlap its tile (using a spatial filter).
+
+    The value burnt into the raster either comes from a numeric field (attribute),
+    or from a text field (code_field) whose values are turned into integers with
+    code_dict (see MakeLithologyCodes). The codes are added to the features by an
+    SQL CASE (as in GLIM_geologic_maps_modify_shapefile), so each tile is still
+    rasterised in one go.
+
+    Args:
+        shapefile_name (str): The shapefile
+        outraster (str): The GeoTiff to make
+        raster_resolution (float): The size of the pixels, in the units of the shapefile
+        attribute (str): A numeric field to burn into the raster
+        code_field (str): A text field to burn into the raster, used if attribute is None
+        code_dict (dict): The integer code of each value of code_field
+        tile_size (int): The size of the tiles in pixels
+        n_threads (int): The number of threads
+        NoDataVal (int): The nodata value
+
+    Returns:
+        The name of the raster
+
+    Author: SMM
+    """
+    import threading
+    from multiprocessing.pool import ThreadPool
+
+    if attribute is None and (code_field is None or code_dict is None):
+        raise ValueError("You need to give me an attribute, or a code_field and code_dict")
+
+    dataSource = ogr.Open(shapefile_name)
+    daLayer = dataSource.GetLayer(0)
+    projection = daLayer.GetSpatialRef().ExportToWkt()
+    layer_name = daLayer.GetName()
+
+    # a spatial index (the .qix file) makes the spatial filter of each tile quick. The
+    # shapefile driver only makes it if the shapefile is opened for writing
+    qix_file = os.path.splitext(shapefile_name)[0]+".qix"
+    if dataSource.GetDriver().GetName() == "ESRI Shapefile" and not exists(qix_file):
+        print("Making a spatial index of "+shapefile_name)
+        updateSource = ogr.Open(shapefile_name, 1)
+        if updateSource is not None:
+            updateSource.ExecuteSQL('CREATE SPATIAL INDEX ON "'+layer_name+'"')
+            updateSource = None
+        if not exists(qix_file):
+            print("Warning: I couldn't make a spatial index of "+shapefile_name+
+                  " (is it read only?), so each tile will search the whole layer.")
+
+    if attribute is None:
+        sql = _CodeCaseSQL(layer_name, code_field, code_dict, NoDataVal)
+        attribute = "GEOL_CODE"
+    else:
+        sql = None
+
+    # The grid of the raster
+    inGridSize = float(raster_resolution)
+    xMin, xMax, yMin, yMax = daLayer.GetExtent()
+    xRes = int(np.ceil((xMax - xMin) / inGridSize))
+    yRes = int(np.ceil((yMax - yMin) / inGridSize))
+    print("The raster will be "+str(xRes)+" by "+str(yRes)+" pixels")
+
+    rasterDS = gdal.GetDriverByName('GTiff').Create(outraster, xRes, yRes, 1, gdal.GDT_Int32,
+                                                    options = ["TILED=YES", "COMPRESS=DEFLATE",
+                                                               "BIGTIFF=IF_SAFER"])
+    rasterDS.SetProjection(projection)
+    rasterDS.SetGeoTransform((xMin, inGridSize, 0, yMax, 0, -inGridSize))
+    rBand = rasterDS.GetRasterBand(1)
+    rBand.SetNoDataValue(NoDataVal)
+
+    tiles = [(x0, y0, min(tile_size, xRes-x0), min(tile_size, yRes-y0))
+             for y0 in range(0, yRes, tile_size) for x0 in range(0, xRes, tile_size)]
+
+    # ogr layers can't be shared between threads
+    local = threading.local()
+    opened = []
+    def rasterize_tile(tile):
+        x0, y0, nx, ny = tile
+        if not hasattr(local, "layer"):
+            local.dataSource = ogr.Open(shapefile_name)
+            if sql is None:
+                local.layer = local.dataSource.GetLayer(0)
+            else:
+                local.layer = local.dataSource.ExecuteSQL(sql, dialect = "SQLITE")
+                opened.append((local.dataSource, local.layer))
+        tile_xmin = xMin + x0*inGridSize
+        tile_ymax = yMax - y0*inGridSize
+        local.layer.SetSpatialFilterRect(tile_xmin, tile_ymax - ny*inGridSize,
+                                         tile_xmin + nx*inGridSize, tile_ymax)
+
+        tileDS = gdal.GetDriverByName('MEM').Create('', nx, ny, 1, gdal.GDT_Int32)
+        tileDS.SetProjection(projection)
+        tileDS.SetGeoTransform((tile_xmin, inGridSize, 0, tile_ymax, 0, -inGridSize))
+        tileDS.GetRasterBand(1).Fill(NoDataVal)
+        gdal.RasterizeLayer(tileDS, [1], local.layer, options = ["ATTRIBUTE="+attribute])
+        return x0, y0, tileDS.GetRasterBand(1).ReadAsArray()
+
+    pool = ThreadPool(max(1, min(n_threads, len(tiles))))
+    try:
+        for i, (x0, y0, Z) in enumerate(pool.imap_unordered(rasterize_tile, tiles)):
+            rBand.WriteArray(Z, x0, y0)
+            print("Rasterized tile "+str(i+1)+" of "+str(len(tiles)))
+    finally:
+        pool.close()
+        pool.join()
+        for threadDS, threadLayer in opened:
+            threadDS.ReleaseResultSet(threadLayer)
+
+    rBand.FlushCache()
+    rasterDS = None
+    return outraster
+
+def _SQLEquals(field, value):
+    """An attribute filter selecting the features where field is value"""
+    if value is None:
+        return '"'+field+'" IS NULL'
+    if isinstance(value, (int, float)):
+        return '"'+field+'" = '+repr(value)
+    return '"'+field+'" = \''+str(value).replace("'","''")+'\''
+
+def _CodeCaseSQL(layer_name, field, code_dict, else_value = None):
+    """
+    An SQL (SQLite dialect) statement selecting all the features of a layer, with a
+    GEOL_CODE column holding the code_dict code of the value of field.
+    Features whose value isn't in code_dict get else_value (NULL if it is None).
+    """
+    cases = " ".join("WHEN "+_SQLEquals(field, value)+" THEN "+str(code)
+                     for value, code in code_dict.items())
+    if else_value is not None:
+        cases += " ELSE "+str(else_value)
+    return 'SELECT *, CAST(CASE '+cases+' END AS INTEGER) AS GEOL_CODE FROM "'+layer_name+'"'
+
+def Rasterize_BGS_geologic_maps(shapefile_name, raster_resolution = 90, tile_size = 2048,
+                                n_threads = 4):
 
     # The shapefile to be rasterized:     
     print('Rasterize ' + shapefile_name) 
@@ -82,10 +291,8 @@ def Rasterize_BGS_geologic_maps(shapefile_name):
     print("Full name of out raster is: "+outraster)       
 
     # Rasterize!!
-    system_call = 'gdal_rasterize -a BGSREF -l ' + shapefileshortname +' -tr 90 -90 -a_nodata -9999 ' +  shapefile_name + ' ' + outraster
-    print("System call is: ")
-    print(system_call)    
-    os.system(system_call)
+    Rasterize_Layer_Tiles(shapefile_name, outraster, raster_resolution, attribute = "BGSREF",
+                          tile_size = tile_size, n_threads = n_threads)
     
     # now convert the raster to UTM, as well as delete the stupid TIF
     # The raster file to be created and receive the rasterized shapefile 
@@ -94,36 +301,33 @@ def Rasterize_BGS_geologic_maps(shapefile_name):
     print("Full name of out raster is: "+outraster_bil)
     
     # This assumes UTM zone 30, because why would we do any work in East Anglia?
-    system_call2 = 'gdalwarp -t_srs EPSG:32630 -of ENVI -dstnodata -9999 ' +  outraster + ' ' + outraster_bil
-    os.system(system_call2)
+    gdal.Warp(outraster_bil, outraster, dstSRS = "EPSG:32630", format = "ENVI",
+              dstNodata = -9999, multithread = True)
     
     # Now get rid of the tif
-    system_call3 = 'rm '+ outraster
-    os.system(system_call3)
+    os.remove(outraster)
     
-      
     # Make a key for the bedrock
-    geol_dict = dict()
-    for feature in daLayer:
-        ID = feature.GetField("BGSREF")
-        GEOL = feature.GetField("RCS_D")
-        
-        if ID not in geol_dict:
-            print("I found a new rock type, ID: "+ str(ID)+ " and rock type: " + str(GEOL))
-            geol_dict[ID] = GEOL
+    geol_dict = GetLithologyNames(daLayer, "BGSREF", "RCS_D")
 
     print("The rocks are: ")
     print(geol_dict)
     
-    with open(outcsv, 'wb') as f:
-        f.write('ID,rocktype\n')
-        for key in geol_dict:
-            f.write(str(key)+','+ str(geol_dict[key])+'\n')
+    WriteLithologyKey(outcsv, geol_dict)
       
     print("All done")
   
     
-def Rasterize_GLIM_geologic_maps_pythonic(shapefile_name, raster_resolution = 400):
+def Rasterize_GLIM_geologic_maps_pythonic(shapefile_name, raster_resolution = 400,
+                                          geol_field = "xx", tile_size = 2048, n_threads = 4):
+    """
+    Rasterises a GLIM geology shapefile. The rock types in geol_field are numbered
+    (see MakeLithologyCodes) and the numbers are burnt into a tiled, compressed
+    integer GeoTiff (see Rasterize_Layer_Tiles). The key between the numbers
+    and the rock types is written to shapefileshortname_lithokey.csv.
+
+    Author: SMM
+    """
 
     # The shapefile to be rasterized:     
     print('Rasterize ' + shapefile_name) 
@@ -152,41 +356,17 @@ def Rasterize_GLIM_geologic_maps_pythonic(shapefile_name, raster_resolution = 40
     outcsv = shapefilefilepath+os.sep+shapefileshortname+'_lithokey.csv'
     print("Full name of out raster is: "+outraster)       
 
-    # Create the destination data source
-    inGridSize=float(raster_resolution)
-    xMin, xMax, yMin, yMax = daLayer.GetExtent()
-    xRes = int((xMax - xMin) / inGridSize)
-    yRes = int((yMax - yMin) / inGridSize)
-    rasterDS =  gdal.GetDriverByName('GTiff').Create(outraster, xRes, yRes, 1,  gdal.GDT_Byte)
-    
-    # Define spatial reference
-    NoDataVal = -9999
-    rasterDS.SetProjection(daLayer.GetSpatialRef().ExportToWkt())
-    rasterDS.SetGeoTransform((xMin, inGridSize, 0, yMax, 0, -inGridSize))
-    rBand = rasterDS.GetRasterBand(1)
-    rBand.SetNoDataValue(NoDataVal)
-    rBand.Fill(NoDataVal)
-
-    # Rasterize
-    gdal.RasterizeLayer(rasterDS, [1], daLayer, options = ["ATTRIBUTE=GEOL_CODE"]) 
-    
     # Make a key for the bedrock
-    geol_dict = dict()
-    for feature in daLayer:
-        ID = feature.GetField("xx")
-        GEOL = feature.GetField("GEOL_CODE")
-        
-        if ID not in geol_dict:
-            print("I found a new rock type, ID: "+ str(ID)+ " and rock type: " + str(GEOL))
-            geol_dict[ID] = GEOL
+    geol_dict = MakeLithologyCodes(daLayer, geol_field)
 
     print("The rocks are: ")
     print(geol_dict)
+
+    # Rasterize
+    Rasterize_Layer_Tiles(shapefile_name, outraster, raster_resolution, code_field = geol_field,
+                          code_dict = geol_dict, tile_size = tile_size, n_threads = n_threads)
     
-    with open(outcsv, 'wb') as f:
-        f.write('ID,rocktype\n')
-        for key in geol_dict:
-            f.write(str(key)+','+ str(geol_dict[key])+'\n')
+    WriteLithologyKey(outcsv, dict((code, GEOL) for GEOL, code in geol_dict.items()))
       
     print("Done rasterizing!")
     return outraster         
@@ -217,7 +397,19 @@ def Correct_Raterized_GLIM_map(tifname):
     outraster2 = filepath+fileshortname + '2.tif'
     writeFile(outraster2,geotransform,geoproj,X)   
 
-def GLIM_geologic_maps_modify_shapefile(shapefile_name):
+def GLIM_geologic_maps_modify_shapefile(shapefile_name, geol_field = "xx"):
+    """
+    Copies a GLIM shapefile, adding a GEOL_CODE field with the number of the rock
+    type in geol_field. The rock types are numbered in one pass over the attributes
+    and the copy is made by GDAL in one go (with an SQL CASE), not feature by feature.
+    Rasterize_GLIM_geologic_maps_pythonic doesn't need this anymore, but it is
+    useful if you want the codes in the shapefile.
+
+    Returns:
+        The name of the new shapefile and the dict of the codes
+
+    Author: SMM
+    """
  
     # The shapefile to be rasterized:     
     print('Rasterize ' + shapefile_name) 
@@ -228,47 +420,25 @@ def GLIM_geologic_maps_modify_shapefile(shapefile_name):
     
     # get the new shapefile name
     new_shapefile_name = shapefilefilepath+os.sep+shapefileshortname+"_new.shp"
-    
-    # copy the shapefile into the new shapefile--we don't wwant to mess up the original data
     print("The New Shapefile name is: "+new_shapefile_name)
-    Copy_Shapefile(shapefile_name,new_shapefile_name)
-    
-    # New shapefile is opened for writing. 
-    dataSource = ogr.Open(new_shapefile_name,1)
-    daLayer = dataSource.GetLayer(0)
-  
-    # add a new field
-    new_field = ogr.FieldDefn("GEOL_CODE", ogr.OFTInteger)
-    daLayer.CreateField(new_field)
 
-    # lets see what the layers are
-    print("Let me tell you what the names of the fields are after I added one!")
-    layerDefinition = daLayer.GetLayerDefn()
-    for i in range(layerDefinition.GetFieldCount()):
-        print(layerDefinition.GetFieldDefn(i).GetName())      
-
-               
     # Make a key for the bedrock
-    geol_dict = dict()
-    geol_iterator = 0
-    for feature in daLayer:
-        GEOL = feature.GetField("xx")
-        
-        if GEOL not in geol_dict:
-            geol_iterator = geol_iterator+1
-            print("I found a new rock type, GEOL: "+ str(GEOL)+ " and rock type: " + str(geol_iterator))
-            geol_dict[GEOL] = geol_iterator
-        
-        # now get the geol code
-        this_geol_code = geol_dict[GEOL]
-        # set the feature
-        feature.SetField("GEOL_CODE", this_geol_code)
-        
-        # need to update the layer        
-        daLayer.SetFeature(feature)
-            
+    dataSource = ogr.Open(shapefile_name)
+    daLayer = dataSource.GetLayer(0)
+    geol_dict = MakeLithologyCodes(daLayer, geol_field)
+    layer_name = daLayer.GetName()
+    daLayer = None
+    dataSource = None
+
     print("The rocks are: ")
     print(geol_dict)
+
+    # copy the shapefile into the new shapefile--we don't wwant to mess up the original data
+    sql = _CodeCaseSQL(layer_name, geol_field, geol_dict)
+    if exists(new_shapefile_name):
+        ogr.GetDriverByName('ESRI Shapefile').DeleteDataSource(new_shapefile_name)
+    gdal.VectorTranslate(new_shapefile_name, shapefile_name, format = 'ESRI Shapefile',
+                         SQLStatement = sql, SQLDialect = "SQLITE")
       
     print("All done") 
 
@@ -361,6 +531,4 @@ if __name__ == "__main__":
     #new_shapefile_name = 'C:\\VagrantBoxes\\LSDTopoTools\\Topographic_projects\\Iberia\\New_TipOfSpain.shp'    
     #tifname = 'C:\\VagrantBoxes\\LSDTopoTools\\Topographic_projects\\Iberia\\TipOfSpain_new.tif'
     
-    new_shapefile_name, geol_dict = GLIM_geologic_maps_modify_shapefile(shapefile_name)
-    tifname = Rasterize_GLIM_geologic_maps_pythonic(new_shapefile_name,raster_resolution = 400)
-    Correct_Raterized_GLIM_map(tifname)
+    tifname = Rasterize_GLIM_geologic_maps_pythonic(shapefile_name,raster_resolution = 400)
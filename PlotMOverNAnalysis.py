@@ -65,6 +65,8 @@ def main(argv):
     parser.add_argument("-show_SA_segments", "--show_SA_segments", type=bool, default=False, help="Show the segmented S-A data in SA plot. Default = False")
 
     parser.add_argument("-basin_keys", "--basin_keys",type=str,default = "", help = "This is a comma delimited string that gets the list of basins you want for the plotting. Default = no basins")
+    parser.add_argument("-burn_in", "--MCMC_burn_in", type=int, default=0, help="The number of iterations at the start of each MCMC chain left out of the summary statistics. Default = 0")
+    parser.add_argument("-n_proc", "--n_processes", type=int, default=1, help="The number of processes used to make the basin plots. 0 uses all the cores. Default = 1")
 
     # These control the format of your figures
     parser.add_argument("-fmt", "--FigFormat", type=str, default='png', help="Set the figure format for the plots. Default is png")
@@ -100,17 +102,25 @@ def main(argv):
     if args.plot_rasters:
         MN.MakeRasterPlotsBasins(this_dir, args.fname_prefix, args.size_format, args.FigFormat)
         MN.MakeRasterPlotsMOverN(this_dir, args.fname_prefix, args.start_movern, args.n_movern, args.d_movern, args.size_format, args.FigFormat)
+    # the full stats files are loaded once for all the m/n plots
+    FullStats = None
+    if args.plot_chi_profiles or args.plot_outliers or args.plot_MLE_movern:
+        FullStats = MN.MOverNFullStats(this_dir, args.fname_prefix, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern)
     if args.plot_chi_profiles:
-        MN.MakeChiPlotsMLE(this_dir, args.fname_prefix, basin_list=these_basin_keys, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern, size_format=args.size_format, FigFormat = args.FigFormat)
+        MN.MakeChiPlotsMLE(this_dir, args.fname_prefix, basin_list=these_basin_keys, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern, size_format=args.size_format, FigFormat = args.FigFormat,
+                           n_processes=args.n_processes, FullStats=FullStats)
     if args.plot_outliers:
-        MN.PlotProfilesRemovingOutliers(this_dir, args.fname_prefix, basin_list=these_basin_keys, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern)
+        MN.PlotProfilesRemovingOutliers(this_dir, args.fname_prefix, basin_list=these_basin_keys, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern,
+                                        n_processes=args.n_processes, FullStats=FullStats)
     if args.plot_MLE_movern:
-        MN.PlotMLEWithMOverN(this_dir, args.fname_prefix,basin_list=these_basin_keys, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern, size_format=args.size_format, FigFormat = args.FigFormat)
+        MN.PlotMLEWithMOverN(this_dir, args.fname_prefix,basin_list=these_basin_keys, start_movern=args.start_movern, d_movern=args.d_movern, n_movern=args.n_movern, size_format=args.size_format, FigFormat = args.FigFormat,
+                             n_processes=args.n_processes, FullStats=FullStats)
     if args.plot_SA_data:
         SA.SAPlotDriver(this_dir, args.fname_prefix, FigFormat = args.FigFormat,size_format=args.size_format,
                         show_raw = args.show_SA_raw, show_segments = args.show_SA_segments,basin_keys = these_basin_keys)
     if args.plot_MCMC:
-        MN.plot_MCMC_analysis(this_dir, args.fname_prefix,basin_list=these_basin_keys, FigFormat= args.FigFormat, size_format=args.size_format)
+        MN.plot_MCMC_analysis(this_dir, args.fname_prefix,basin_list=these_basin_keys, FigFormat= args.FigFormat, size_format=args.size_format,
+                              burn_in=args.MCMC_burn_in, n_processes=args.n_processes)
 
 
 #=============================================================================
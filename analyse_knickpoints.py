@@ -126,21 +126,24 @@ def plot_knickpoint_elevations(DataDirectory, csv_name, kp_type = "diff"):
     plt.savefig(DataDirectory+write_name+"."+file_ext,dpi=300)
     plt.clf()
 
-def return_outlier(df,data = "diff", thresh=3.5):
+def return_outlier(df,data = "diff", thresh=3.5, group_by = []):
     """
-    Returns a boolean array with True if points are outliers and False
-    otherwise.
+    Returns the rows of the dataframe that are outliers, using the modified z-score
+    (based on the median absolute deviation) of is_outlier.
 
     Parameters:
     -----------
-        points : An numobservations by numdimensions array of observations
+        df : A pandas dataframe of knickpoints
+        data : The column to test
         thresh : The modified z-score to use as a threshold. Observations with
             a modified z-score (based on the median absolute deviation) greater
             than this value will be classified as outliers.
+        group_by : column name(s), i.e. "basin_key". If given the outliers are found
+            within each group, all the groups at once.
 
     Returns:
     --------
-        mask : A numobservations-length boolean array.
+        The dataframe of the outliers
 
     References:
     ----------
@@ -148,16 +151,13 @@ def return_outlier(df,data = "diff", thresh=3.5):
         Handle Outliers", The ASQC Basic References in Quality Control:
         Statistical Techniques, Edward F. Mykytka, Ph.D., Editor.
     """
-    points = df[data]
-    if len(points.shape) == 1:
-        points = points[:,None]
-    median = np.median(points, axis=0)
-    diff = np.sum((points - median)**2, axis=-1)
-    diff = np.sqrt(diff)
-    med_abs_deviation = np.median(diff)
-
-    modified_z_score = 0.6745 * diff / med_abs_deviation
-    msk =  modified_z_score > thresh
+    if(isinstance(group_by,str)):
+        group_by = [group_by]
+    if(len(group_by) == 0):
+        index = lst.GroupIndex(np.zeros(df.shape[0], dtype=np.int64))
+    else:
+        index = lst.GroupIndex(*[df[name].values for name in group_by])
+    msk = lst.grouped_is_outlier(index, df[data].values, thresh)
     df = df[msk]
     return df
 
@@ -180,12 +180,16 @@ def knickpoint_plots_for_basins(DataDirectory, csv_name, kp_type = "diff"):
     #list_of_lists = zip(elevation,flow_distance,basin_id)
     #print column_lists
 
-    # loop through and get a plot for each basin id
-    ids = set(basin_id)
-    for id in ids:
+    # group the knickpoints by basin once, then loop through and get a plot for each basin id
+    elevation = np.asarray(elevation)
+    flow_distance = np.asarray(flow_distance)
+    kp_data = np.asarray(kp_data)
+    basin_index = lst.GroupIndex(np.asarray(basin_id))
+    for id, these_rows in basin_index.groups():
         print("This basin id/key is: "+str(id))
-        these_lists = [(a,b,c,d,e,f) for (a,b,c,d,e,f) in zip(elevation,flow_distance,drainage_area,kp_data,kp_sign,basin_id) if f == id]
-        this_elev, this_distance, this_area, this_magnitude, this_sign, this_id = zip(*these_lists)
+        this_elev = elevation[these_rows]
+        this_distance = flow_distance[these_rows]
+        this_magnitude = kp_data[these_rows]
 
         fig,ax = plt.subplots(figsize=(10,12))
         #ax = ax.ravel()
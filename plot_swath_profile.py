@@ -11,11 +11,12 @@ import numpy as np, matplotlib.pyplot as plt
 from matplotlib import rcParams
 import matplotlib.colors as colors
 import matplotlib.cm as cmx
+from LSDPlottingTools.LSDMap_BasicPlotting import ReadSwathProfileFile, ReadSwathProfileFiles
 
 
 
 
-def plot_swath_profile(full_file_path, ax):
+def plot_swath_profile(full_file_path, ax, swath = None):
 
     # Set up fonts for plots
     rcParams['font.family'] = 'sans-serif'
@@ -24,43 +25,12 @@ def plot_swath_profile(full_file_path, ax):
     rcParams['legend.numpoints'] = 1
     axis_size = 16
 
-    # FileList = dir +   
-    f = open(full_file_path, 'r')
-    lines = f.readlines()
-    N_Segments = len(lines)-1
-
-    # Initialise a bunch of vectors
-    distance = np.zeros(N_Segments)
-    mean = np.zeros(N_Segments)
-    sd = np.zeros(N_Segments)
-    minimum = np.zeros(N_Segments)
-    LQ = np.zeros(N_Segments)
-    median = np.zeros(N_Segments)
-    UQ = np.zeros(N_Segments)
-    maximum = np.zeros(N_Segments)
-    for i in range (0, N_Segments):        
-       
-       line = lines[i+1].strip().split(" ")
-       distance[i] = float(line[0])
-       mean[i] = float(line[1])
-       sd[i] = float(line[2])
-       minimum[i] = float(line[3])
-       LQ[i] = float(line[4])
-       median[i] = float(line[5])
-       UQ[i] = float(line[6])
-       maximum[i] = float(line[7])
-       
-       # if there is nodata (-9999) replace with the numpy nodata entry
-       if (mean[i] == -9999):
-         mean[i] = np.nan
-         sd[i] = np.nan
-         minimum[i] = np.nan
-         LQ[i] = np.nan
-         median[i] = np.nan
-         UQ[i] = np.nan
-         maximum[i] = np.nan
-         
-    f.close()
+    if swath is None:
+        swath = ReadSwathProfileFile(full_file_path)
+    distance = swath["distance"].values
+    mean = swath["mean"].values
+    LQ = swath["LQ"].values
+    UQ = swath["UQ"].values
 
     #######################
     #                     #
@@ -98,10 +68,10 @@ def multiSwathPlot(data_dir, wildcard_fname):
     
     fig, ax = plt.subplots()
     
-    for f in glob.glob(data_dir + wildcard_fname):
+    swaths = ReadSwathProfileFiles(glob.glob(data_dir + wildcard_fname))
+    for f, swath in swaths.groupby("file", sort = False):
         print(f)
-        full_file_path = data_dir + wildcard_fname
-        plot_swath_profile(f, ax)
+        plot_swath_profile(f, ax, swath = swath)
         
     fig.canvas.draw()
         
@@ -233,88 +233,206 @@ def CreateMapFigure(BasemapExtentDataset, AspectRatio=0, FigSizeFormat="default"
             
     return Fig, Ax, Map
 
-def ResampleRaster(InputRasterFile,OutputRasterFile,XResolution,YResolution=None,Format="ENVI"):
-    
+# The file extension of each raster format written by ReprojectRaster
+RASTER_EXTENSIONS = {"GTiff": ".tif", "ENVI": ".bil", "EHdr": ".bil"}
+
+def ReprojectedRasterName(InputRasterFile, DstCRS, Resolution, Format="GTiff",
+                          Resampling="bilinear", CacheDirectory=None):
     """
-    Description goes here...
-    
-    MDH
-    
+    The name of the file a reprojected raster is cached in. The name includes a
+    hash of the source file (its path, size and modification time), the output
+    CRS, resolution, format and resampling, so each product is only made once.
+
+    Args:
+        InputRasterFile: the raster to reproject
+        DstCRS: the output coordinate system (anything rasterio understands)
+        Resolution: the output (x, y) resolution, or None for the default
+        Format: the output format
+        Resampling: the name of the resampling method
+        CacheDirectory: where the reprojected rasters are kept. Default is the
+            directory of the input raster
+
+    Returns:
+        the name of the cached raster
+
+    MDH & SMM
     """
+    import os, hashlib
+
+    if CacheDirectory is None:
+        CacheDirectory = os.path.dirname(os.path.abspath(InputRasterFile))
+    Stats = os.stat(InputRasterFile)
+    Key = hashlib.sha1()
+    for Part in [os.path.abspath(InputRasterFile), Stats.st_size, Stats.st_mtime,
+                 DstCRS, Resolution, Format, Resampling]:
+        Key.update((repr(Part)+"|").encode("utf-8"))
+    Prefix = os.path.splitext(os.path.basename(InputRasterFile))[0]
+    return os.path.join(CacheDirectory, Prefix+"_reprojected_"+Key.hexdigest()[:12]+RASTER_EXTENSIONS.get(Format, ".tif"))
+
+def ReprojectRaster(InputRasterFile, OutputRasterFile=None, DstCRS=None, XResolution=None,
+                    YResolution=None, Format=None, Resampling="bilinear", n_threads=4,
+                    WindowSize=512, CacheDirectory=None):
 
-    # import modules    
+    """
+    Resamples and/or reprojects a raster one window of the output at a time, so
+    only a few windows (one per thread) are ever in memory. Each thread warps its
+    windows from its own handle on the source, and the windows are written as they
+    arrive. The data type of the source is kept, and GeoTiffs are written tiled
+    and compressed.
+
+    If no output file is given the raster is written to a cache file named after
+    the source, CRS and resolution (see ReprojectedRasterName), and the cache file
+    is returned straight away if it has already been made. The raster is written
+    under a temporary name and only renamed once it is complete, so an interrupted
+    run never leaves a partial raster that looks like a finished one.
+
+    Args:
+        InputRasterFile: the raster to reproject
+        OutputRasterFile: the output raster, or None to use the cache
+        DstCRS: the output coordinate system. Default is the CRS of the input
+        XResolution: the output x resolution. Default keeps the resolution (or
+            the equivalent resolution in the new CRS)
+        YResolution: the output y resolution. Default is XResolution
+        Format: the output driver (i.e. GTiff, ENVI). Default is the input driver
+        Resampling: the name of a rasterio resampling method
+        n_threads: the number of threads warping windows
+        WindowSize: the size of the windows in pixels
+        CacheDirectory: the directory of the cache, see ReprojectedRasterName
+
+    Returns:
+        the name of the output raster
+
+    MDH & SMM
+    """
+
+    # import modules
+    import os, threading, tempfile
+    from glob import glob
     import rasterio, affine
-    from rasterio.warp import reproject, Resampling
-    
-    # read the source raster    
+    from multiprocessing.pool import ThreadPool
+    from rasterio.crs import CRS
+    from rasterio.enums import Resampling as ResamplingMethods
+    from rasterio.vrt import WarpedVRT
+    from rasterio.windows import Window
+    from rasterio.warp import calculate_default_transform as cdt
+
+    # set up the output grid from the source raster
     with rasterio.open(InputRasterFile) as src:
-        Array = src.read()
-        OldResolution = src.res
-    
-        #setup output resolution
-        if YResolution == None:
+        if DstCRS is None:
+            DstCRS = src.crs
+        if Format is None:
+            Format = src.driver
+        if XResolution is not None and YResolution is None:
             YResolution = XResolution
-        NewResolution = (XResolution,YResolution)
-        
-        
-        # setup the transform to change the resolution
-        XResRatio = OldResolution[0]/NewResolution[0]
-        YResRatio = OldResolution[1]/NewResolution[1]
-        NewArray = np.empty(shape=(Array.shape[0], int(round(Array.shape[1] * XResRatio)), int(round(Array.shape[2] * YResRatio))))
-        Aff = src.affine
-        NewAff = affine.Affine(Aff.a/XResRatio, Aff.b, Aff.c, Aff.d, Aff.e/YResRatio, Aff.f)
-            
-        # reproject the raster
-        reproject(Array, NewArray, src_transform=Aff, dst_transform=NewAff, src_crs = src.crs, dst_crs = src.crs, resample=Resampling.bilinear)
-        
-        # write results to file
-        with rasterio.open(OutputRasterFile, 'w', driver=src.driver, \
-                            height=NewArray.shape[1],width=NewArray.shape[2], \
-                            nodata=src.nodata,dtype=str(NewArray.dtype), \
-                            count=src.count,crs=src.crs,transform=NewAff) as dst:
-            dst.write(NewArray)
+        NewResolution = None if XResolution is None else (XResolution, YResolution)
+
+        Cached = OutputRasterFile is None
+        if Cached:
+            OutputRasterFile = ReprojectedRasterName(InputRasterFile, str(DstCRS), NewResolution,
+                                                     Format, Resampling, CacheDirectory)
+            if os.path.isfile(OutputRasterFile):
+                print("Using the reprojected raster "+OutputRasterFile)
+                return OutputRasterFile
+
+        if CRS.from_user_input(DstCRS) == src.crs:
+            # only change the resolution, keeping the origin
+            if NewResolution is None:
+                NewResolution = src.res
+            Aff = src.transform
+            NewAff = affine.Affine(np.sign(Aff.a)*NewResolution[0], Aff.b, Aff.c,
+                                   Aff.d, np.sign(Aff.e)*NewResolution[1], Aff.f)
+            Width = int(round(src.width*src.res[0]/NewResolution[0]))
+            Height = int(round(src.height*src.res[1]/NewResolution[1]))
+        else:
+            NewAff, Width, Height = cdt(src.crs, DstCRS, src.width, src.height, *src.bounds,
+                                        resolution=NewResolution)
+
+        Profile = {"driver": Format, "width": Width, "height": Height, "count": src.count,
+                   "dtype": src.dtypes[0], "nodata": src.nodata, "crs": DstCRS, "transform": NewAff}
+        if Format == "GTiff":
+            Profile.update({"tiled": True, "blockxsize": 256, "blockysize": 256,
+                            "compress": "deflate", "BIGTIFF": "IF_SAFER"})
+
+    # the windows of the output
+    Windows = [Window(Col, Row, min(WindowSize, Width-Col), min(WindowSize, Height-Row))
+               for Row in range(0, Height, WindowSize) for Col in range(0, Width, WindowSize)]
+
+    # each thread has its own handle on the source, since they can't be shared
+    Local = threading.local()
+    Handles = []
+    Lock = threading.Lock()
+
+    def WarpWindow(Win):
+        if not hasattr(Local, "VRT"):
+            Src = rasterio.open(InputRasterFile)
+            Local.VRT = WarpedVRT(Src, crs=DstCRS, transform=NewAff, width=Width, height=Height,
+                                  resampling=ResamplingMethods[Resampling])
+            with Lock:
+                Handles.append((Local.VRT, Src))
+        return Win, Local.VRT.read(window=Win)
+
+    # write to a temporary file next to the output. Some formats (i.e. ENVI) also
+    # write sidecar files named after it, so these are moved along with the raster
+    OutputStem, Extension = os.path.splitext(OutputRasterFile)
+    Handle, TempRasterFile = tempfile.mkstemp(prefix=os.path.basename(OutputStem)+"_tmp",
+                                              suffix=Extension,
+                                              dir=os.path.dirname(os.path.abspath(OutputRasterFile)))
+    os.close(Handle)
+    TempStem = os.path.splitext(TempRasterFile)[0]
+
+    print("Reprojecting "+InputRasterFile+" in "+str(len(Windows))+" windows")
+    Pool = ThreadPool(max(1, min(n_threads, len(Windows))))
+    try:
+        with rasterio.open(TempRasterFile, "w", **Profile) as dst:
+            for Win, Data in Pool.imap_unordered(WarpWindow, Windows):
+                dst.write(Data, window=Win)
+    except:
+        # don't leave a half written raster behind
+        for TempFile in glob(TempStem+".*"):
+            os.remove(TempFile)
+        raise
+    finally:
+        Pool.close()
+        Pool.join()
+        for VRT, Src in Handles:
+            VRT.close()
+            Src.close()
+
+    # the raster itself goes last, so it only exists once everything is in place
+    # (python 2 has no os.replace, but there os.rename replaces files on posix)
+    Replace = getattr(os, "replace", os.rename)
+    for TempFile in glob(TempStem+".*"):
+        if TempFile != TempRasterFile:
+            Replace(TempFile, OutputStem+TempFile[len(TempStem):])
+    Replace(TempRasterFile, OutputRasterFile)
+
+    return OutputRasterFile
+
+def ResampleRaster(InputRasterFile,OutputRasterFile,XResolution,YResolution=None,Format=None,n_threads=4):
 
-def ConvertRaster2LatLong(InputRasterFile,OutputRasterFile):
-    
     """
-    Convert a raster to lat long WGS1984 EPSG:4326 coordinates for global plotting
-    
+    Changes the resolution of a raster, keeping its coordinate system.
+    The output has the format of the input unless Format is given.
+    See ReprojectRaster.
+
     MDH
-    
+
     """
+    return ReprojectRaster(InputRasterFile, OutputRasterFile, XResolution=XResolution,
+                           YResolution=YResolution, Format=Format, n_threads=n_threads)
+
+def ConvertRaster2LatLong(InputRasterFile,OutputRasterFile=None,n_threads=4):
+
+    """
+    Convert a raster to lat long WGS1984 EPSG:4326 coordinates for global plotting.
+    If no output file is given the converted raster is cached next to the input.
+    See ReprojectRaster.
+
+    MDH
+
+    """
+    return ReprojectRaster(InputRasterFile, OutputRasterFile, DstCRS="EPSG:4326", n_threads=n_threads)
 
-    # import modules    
-    import rasterio
-    from rasterio.warp import reproject, calculate_default_transform as cdt, Resampling
-    
-    # read the source raster    
-    with rasterio.open(InputRasterFile) as src:
-        #get input coordinate system
-        Input_CRS = src.crs
-        # define the output coordinate system
-        Output_CRS = {'init': "epsg:4326"}
-        # set up the transform    
-        Affine, Width, Height = cdt(Input_CRS,Output_CRS,src.width,src.height,*src.bounds)
-        kwargs = src.meta.copy()
-        kwargs.update({
-            'crs': Output_CRS,
-            'transform': Affine,
-            'affine': Affine,
-            'width': Width,
-            'height': Height
-        })
-        
-        with rasterio.open(OutputRasterFile, 'w', **kwargs) as dst:
-            for i in range(1, src.count+1):
-                reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
-                    src_transform=src.affine,
-                    src_crs=src.crs,
-                    dst_transform=Affine,
-                    dst_crs=Output_CRS,
-                    resampling=Resampling.bilinear)
-                
 def PlotRaster(RasterFile, Map, alpha=1.):
     
     """